@@ -0,0 +1,112 @@
+"""
+Read-through cache for the catalog endpoints, which are requested on every page load but rarely change.
+
+The serialized data of list and retrieve responses is stored in the default cache (redis) per endpoint, action, query params
+and permission scope of the user. Every endpoint got a version number which is part of the key. A change of one of the backing
+models increments the version through the signal handlers in api.signals, which invalidates every cached response of that endpoint at once.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from base import models
+
+logger = logging.getLogger(name="django")
+
+# models whose changes invalidate the cached responses of an endpoint
+ENDPOINT_MODELS = {
+    'rentalobjecttypes': [models.RentalObjectType, models.RentalObjectType.tags.through],
+    'categories': [models.Category],
+    'tags': [models.Tag],
+    'texts': [models.Text],
+    'settings': [models.Settings],
+    'duration': [models.MaxRentDuration],
+}
+
+
+def _version_key(endpoint: str) -> str:
+    return f"catalog:{endpoint}:version"
+
+
+def _counter_key(endpoint: str, counter: str) -> str:
+    return f"catalog:{endpoint}:{counter}"
+
+
+def _increment(key: str) -> None:
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def permission_scope(request: Request) -> str:
+    """
+    the permission classes only distinguish between those flags, so users with the same flags get the same responses
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return 'anonymous'
+    return '-'.join(flag for flag, value in [('staff', user.is_staff), ('lending', user.has_perm('base.lending_access')),
+                                             ('inventory', user.has_perm('base.inventory_editing'))] if value) or 'user'
+
+
+def invalidate(endpoint: str) -> None:
+    """
+    drops all cached responses of an endpoint by moving to a new version
+    """
+    try:
+        _increment(_version_key(endpoint))
+    except Exception:
+        # an unreachable cache must not break writes. the cached responses expire after CATALOG_CACHE_TIMEOUT
+        logger.exception(f"could not invalidate catalog cache for {endpoint}")
+
+
+def stats() -> dict:
+    """
+    hit and miss counters of every endpoint, shared by all workers since they are stored in the cache itself
+    """
+    counters = cache.get_many([_counter_key(endpoint, counter) for endpoint in ENDPOINT_MODELS for counter in ['hits', 'misses']])
+    return {endpoint: {counter: counters.get(_counter_key(endpoint, counter), 0) for counter in ['hits', 'misses']} for endpoint in ENDPOINT_MODELS}
+
+
+class CachedCatalogMixin:
+    """
+    caches list and retrieve of a viewset. set cache_endpoint to the key of the endpoint in ENDPOINT_MODELS
+    """
+    cache_endpoint = None
+
+    def list(self, request: Request, *args, **kwargs):
+        return self._cached_response(request, 'list', super().list, *args, **kwargs)
+
+    def retrieve(self, request: Request, *args, **kwargs):
+        return self._cached_response(request, 'retrieve', super().retrieve, *args, **kwargs)
+
+    def _cache_key(self, request: Request, action: str) -> str:
+        params = '&'.join(f"{key}={','.join(sorted(request.query_params.getlist(key)))}" for key in sorted(request.query_params.keys()))
+        version = cache.get_or_set(_version_key(self.cache_endpoint), 1, timeout=None)
+        # image urls are absolute and contain the host
+        digest = hashlib.sha256(f"{request.get_host()}:{action}:{self.kwargs.get(self.lookup_field, '')}:{params}".encode("utf-8")).hexdigest()
+        return f"catalog:{self.cache_endpoint}:{version}:{permission_scope(request)}:{digest}"
+
+    def _cached_response(self, request: Request, action: str, view, *args, **kwargs) -> Response:
+        if not settings.CATALOG_CACHE_ENABLED:
+            return view(request, *args, **kwargs)
+        try:
+            key = self._cache_key(request, action)
+            data = cache.get(key)
+            _increment(_counter_key(self.cache_endpoint, 'misses' if data is None else 'hits'))
+        except Exception:
+            # without redis every request is answered from the database like before
+            logger.exception("catalog cache is not reachable")
+            return view(request, *args, **kwargs)
+        if data is not None:
+            return Response(data)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            try:
+                cache.set(key, response.data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+            except Exception:
+                logger.exception("catalog cache is not reachable")
+        return response
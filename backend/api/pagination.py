@@ -0,0 +1,30 @@
+"""
+Opt-in keyset pagination for the list endpoints whose tables grow with the history (reservations, rentals, bookings, users).
+
+Without a cursor or page_size query param the endpoints answer with the whole list as before, so existing clients keep
+working. With one of them the rows are ordered by the cursor_ordering of the viewset (newest primary key first by default)
+and every page continues after the last row of the previous one (WHERE id < last id) instead of skipping an offset, so
+deep pages are as cheap as the first one and rows created while paging do not shift the pages. The filters of
+get_queryset (open, self, canceled, ...) are applied first, the cursor only adds its condition to them.
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    ordering = '-pk'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        """
+        the cursor_ordering of the view, it has to start with a unique field, otherwise the cursor falls back to offsets
+        """
+        ordering = getattr(view, 'cursor_ordering', None) or self.ordering
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
@@ -69,7 +69,7 @@ class RentalObjectTypePermission(permissions.BasePermission):
             return True
         elif view.action in ['destroy', 'update', 'partial_update', 'create']:
             return request.user.has_perm('base.inventory_editing')
-        elif view.action == 'currently_free_objects':
+        elif view.action in ['currently_free_objects', 'all_currently_free_objects']:
             return request.user.has_perm('base.lending_access')
         return False
 
@@ -242,7 +242,7 @@ class OnPremiseWorkplacePermission(permissions.BasePermission):
         """
         The user should be able to the workplaces
         """
-        if view.action in ['retrieve','list', 'get_slots']:
+        if view.action in ['retrieve','list', 'get_slots', 'get_all_slots']:
             return True
         elif view.action in []:
             return request.user.has_perm('base.lending_access')
@@ -6,17 +6,124 @@ from rest_framework import validators
 from django.db import transaction
 from django.utils import timezone
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from django.forms import model_to_dict
 import logging
 import re
 from base.models import Category, RentalObject, RentalObjectType, Reservation, Rental, Tag, Text, Profile
 from base import models
+from base import availability
+from base import config
 from datetime import timedelta, datetime
 
 logger = logging.getLogger(name="django")
 
 
+def _paths(value: str) -> dict:
+    """
+    "id,reservation.objecttype.name" -> {'id': {}, 'reservation': {'objecttype': {'name': {}}}}
+    """
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name != '':
+                node = node.setdefault(name, {})
+    return tree
+
+
+def sparse_fieldsets(serializer: serializers.BaseSerializer, fields: str = None, expand: str = None) -> None:
+    """
+    trims the fields of a (list) serializer in place, e.g. for ?fields=id,reserved_from,reserver.user.username&expand=reserver,reserver.user
+
+    fields: only the listed fields are rendered, a dotted path only renders these fields of the nested serializer.
+    expand: only the listed nested serializers are rendered as objects, the others as their primary key(s).
+    without the params the whole graph is rendered. fields that are not rendered are never computed, so their
+    SerializerMethodFields (extendable, fullfilled, ...) are skipped as well
+    """
+    if fields is None and expand is None:
+        return
+    _prune(serializer, _paths(fields) if fields is not None else None, _paths(expand) if expand is not None else None)
+
+
+def _prune(serializer: serializers.BaseSerializer, fields: dict, expand: dict) -> None:
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    for name in list(serializer.fields):
+        field = serializer.fields[name]
+        if fields and name not in fields:
+            del serializer.fields[name]
+            continue
+        if not isinstance(field, serializers.BaseSerializer):
+            continue
+        if expand is not None and name not in expand:
+            source = {'source': field.source} if field.source != name else {}
+            serializer.fields[name] = serializers.PrimaryKeyRelatedField(
+                read_only=True, many=isinstance(field, serializers.ListSerializer), **source)
+            continue
+        _prune(field, fields.get(name) if fields else None, expand.get(name) if expand is not None else None)
+
+
+def rendered_paths(serializer: serializers.BaseSerializer, prefix: tuple = ()) -> set:
+    """
+    the relations the serializer renders as paths of field names, e.g. {('reservation',), ('reservation', 'objecttype')}.
+    fields that use other relations than their source (SerializerMethodFields, ...) name them in related_lookups of their serializer
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    paths = set()
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        paths.update(prefix + tuple(lookup.split('__')) for lookup in getattr(serializer, 'related_lookups', {}).get(name, []))
+        if isinstance(field, serializers.SerializerMethodField):
+            continue
+        if field.source == '*':
+            continue
+        path = prefix + tuple(field.source.split('.'))
+        if isinstance(field, serializers.BaseSerializer):
+            paths.add(path)
+            paths.update(rendered_paths(field, path))
+        elif isinstance(field, serializers.ManyRelatedField):
+            # the primary keys of a many to many relation are read from the related rows
+            paths.add(path)
+    return paths
+
+
+def _select_related_leaves(tree: dict, prefix: tuple = ()) -> list:
+    leaves = []
+    for name, children in tree.items():
+        leaves += _select_related_leaves(children, prefix + (name,)) if children else [prefix + (name,)]
+    return leaves
+
+
+def trim_related(queryset, serializer: serializers.BaseSerializer):
+    """
+    drops the select_related and prefetch_related lookups of the queryset the serializer does not render.
+    foreign keys rendered as primary key need no join, their id is a column of the row itself
+    """
+    paths = rendered_paths(serializer)
+
+    def needed(lookup: tuple) -> bool:
+        return any(path[:len(lookup)] == lookup for path in paths)
+
+    if isinstance(queryset.query.select_related, dict):
+        kept = set()
+        for leaf in _select_related_leaves(queryset.query.select_related):
+            # the longest part of the join that is still rendered, e.g. reservation__reserver of reservation__reserver__user
+            prefix = next((leaf[:length] for length in range(len(leaf), 0, -1) if needed(leaf[:length])), None)
+            if prefix is not None:
+                kept.add('__'.join(prefix))
+        queryset = queryset.select_related(None)
+        if kept:
+            queryset = queryset.select_related(*kept)
+    if queryset._prefetch_related_lookups:
+        kept = [lookup for lookup in queryset._prefetch_related_lookups
+                if needed(tuple((lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup).split('__')))]
+        queryset = queryset.prefetch_related(None).prefetch_related(*kept)
+    return queryset
+
+
 class RentalObjectTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = RentalObjectType
@@ -79,8 +186,7 @@ class UserCreationSerializer(serializers.HyperlinkedModelSerializer):
         """
         overwrite the email validation to prevent multiuse of emails. Validate Email corresponding to a specific regex
         """
-        regex = re.compile(models.Settings.objects.get(
-            type='email_validation_regex').value)
+        regex = re.compile(config.value('email_validation_regex'))
         result = regex.fullmatch(email)
         if not (result and result.group(0) == email):
             raise serializers.ValidationError("Email ist im falsche Format")
@@ -185,11 +291,17 @@ class RentalObjectSerializer(serializers.ModelSerializer):
     merged_identifier = serializers.SerializerMethodField(
         required=False, read_only=True)
 
+    # relations used by the SerializerMethodFields, see rendered_paths
+    related_lookups = {'merged_identifier': ['type']}
+
     class Meta:
         model = RentalObject
         fields = '__all__'
 
     def get_currently_in_house(self, obj: models.RentalObject) -> bool:
+        if hasattr(obj, 'in_house'):
+            # annotated by RentalObject.annotate_in_house
+            return obj.in_house
         return obj.rental_set.filter(Q(Q(handed_out_at__lte=timezone.now()) & Q(Q(received_back_at__gte=timezone.now()) | Q(received_back_at__isnull=True)))).count() == 0
 
     def get_merged_identifier(self, obj: models.RentalObject) -> str:
@@ -204,39 +316,18 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class BulkReservationSerializer(serializers.ModelSerializer):
+    """
+    renders the reservations of a cart, the items are validated by base.cart.Cart
+    """
     class Meta:
         model = models.Reservation
         fields = '__all__'
-        validators = [
-            validators.UniqueTogetherValidator(
-                queryset=models.Reservation.objects.all(),
-                fields=['reserver', 'operation_number', 'objecttype'],
-                message="This Combination of reserver, operation_number and object_type already exists"
-            ),
-        ]
-
-    def validate(self, data):
-        objectType = models.RentalObjectType.max_rent_duration(pk=data['objecttype'].pk, prio=data['reserver'].prio)
-        if type(objectType) is not dict and model_to_dict(objectType)['duration'] + timedelta(days=7) < data['reserved_until']-data['reserved_from']:
-            raise serializers.ValidationError(
-                detail="the rent duration exceeds max_rent_duration.")
-        if data['reserved_from'].isoweekday() != int(models.Settings.objects.get(type='lenting_day').value):
-            raise serializers.ValidationError(
-                detail="this day is not a lenting day therefore a reservation can not start here")
-        if data['reserved_until'].isoweekday() != int(models.Settings.objects.get(type='returning_day').value):
-            raise serializers.ValidationError(
-                detail="this day is not a returning day therefore a reservation can not end here")
-        if data['reserved_from'] >= data['reserved_until']:
-            raise serializers.ValidationError(
-                detail="reserved_from must be before reserved_until")
-        if data['count'] > models.RentalObjectType.available(pk=data['objecttype'], from_date=data['reserved_from'], until_date=data['reserved_until'])['available']:
-            raise serializers.ValidationError(
-                detail="There are not enough objects of this type to fullfill your reservation")
-        return data
 
 
 class ReservationProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    # user.profile is this profile again, UserSerializer renders its prio
+    related_lookups = {'user': ['prio']}
 
     class Meta:
         model = models.Profile
@@ -247,6 +338,7 @@ class ReservationSerializer(serializers.ModelSerializer):
     objecttype = RentalObjectTypeSerializer(read_only=True)
     fullfilled = serializers.SerializerMethodField(
         required=False, read_only=True) 
+    related_lookups = {'fullfilled': ['rental_set']}
 
     class Meta:
         model = models.Reservation
@@ -254,7 +346,8 @@ class ReservationSerializer(serializers.ModelSerializer):
         exclude = ['reserver', 'notified']
 
     def get_fullfilled(self, obj):
-        return obj.rental_set.filter(handed_out_at__isnull=False).count() > 0
+        # iterate instead of filtering to use prefetched rentals
+        return any(rental.handed_out_at is not None for rental in obj.rental_set.all())
 
 
 class ReservationAdminSerializer(serializers.ModelSerializer):
@@ -262,6 +355,7 @@ class ReservationAdminSerializer(serializers.ModelSerializer):
     objecttype = RentalObjectTypeSerializer(read_only=True)
     fullfilled = serializers.SerializerMethodField(
         required=False, read_only=True)
+    related_lookups = {'fullfilled': ['rental_set']}
 
     class Meta:
         model = models.Reservation
@@ -280,6 +374,7 @@ class RentalSerializer(serializers.ModelSerializer):
         required=False, read_only=True)
     extended_count = serializers.SerializerMethodField(
         required=False, read_only=True)
+    related_lookups = {'extendable': ['rented_object'], 'extended_count': ['extension_set']}
 
     class Meta:
         model = Rental
@@ -290,7 +385,7 @@ class RentalSerializer(serializers.ModelSerializer):
         enforce that we do not overlap rentals on one object
         """
         if self.instance.reserved_until != reserved_until and models.RentalObjectType.available(pk=self.instance.rented_object.type.pk, from_date=self.instance.reserved_until +
-                                                                                                settings.DEFAULT_OFFSET_BETWEEN_RENTALS, until_date=reserved_until)['available'] == 0:
+                                                                                                settings.DEFAULT_OFFSET_BETWEEN_RENTALS, until_date=reserved_until, live=True)['available'] == 0:
             raise serializers.ValidationError(
                 "reserved until overlaps with a reservation or rental")
         return reserved_until
@@ -299,19 +394,38 @@ class RentalSerializer(serializers.ModelSerializer):
         """
         add a field to check until when an item is rented
         """
-        return obj.extended_until()
+        return obj.current_until
     
     def get_extended_count(self, obj:Rental) -> int:
         return obj.extension_set.count()
 
+    def extension_range(rental: Rental):
+        """
+        the range that has to be free to extend a rental by 1 week
+        """
+        # reserved_from + offset should result in the reseved + offset + offset for reparations
+        return rental.current_until + settings.DEFAULT_OFFSET_BETWEEN_RENTALS, rental.current_until + timedelta(weeks=1)
+
+    def extension_inventory(rentals) -> availability.Inventory:
+        """
+        loads everything needed to answer get_extendable for all given rentals at once. pass it as 'inventory' in the serializer context
+        """
+        ranges = [RentalSerializer.extension_range(rental) for rental in rentals]
+        if len(ranges) == 0:
+            return None
+        return availability.Inventory({rental.rented_object.type_id for rental in rentals}, min(from_date for from_date, _ in ranges), max(until_date for _, until_date in ranges))
+
     # default extension time = 1 week
     def get_extendable(self, obj) -> bool:
         """
         checking if the object is extendable by 1 week returns true if it is
         """
-        # reserved_from + offset should result in the reseved + offset + offset for reparations
-        available = models.RentalObjectType.available(pk=obj.rented_object.type.pk, from_date=self.get_extended_until(obj) +
-                                                      settings.DEFAULT_OFFSET_BETWEEN_RENTALS, until_date=self.get_extended_until(obj)+timedelta(weeks=1))
+        from_date, until_date = RentalSerializer.extension_range(obj)
+        inventory = self.context.get('inventory')
+        if inventory is not None:
+            available = inventory.available(obj.rented_object.type_id, from_date=from_date, until_date=until_date)
+        else:
+            available = models.RentalObjectType.available(pk=obj.rented_object.type_id, from_date=from_date, until_date=until_date)
         return available["available"] >= 1
 
 
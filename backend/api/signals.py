@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.db import transaction
+from functools import partial
+
+from api import cache
+
+
+def invalidate_catalog(sender) -> None:
+    """
+    invalidate the cached responses of every catalog endpoint that serializes the sender.
+    waits for the commit, otherwise a request in between could cache the old rows again under the new version
+    """
+    for endpoint, endpoint_models in cache.ENDPOINT_MODELS.items():
+        if sender in endpoint_models:
+            transaction.on_commit(partial(cache.invalidate, endpoint))
+
+
+@receiver(post_save)
+def invalidate_catalog_on_save(sender, **kwargs):
+    invalidate_catalog(sender)
+
+
+@receiver(post_delete)
+def invalidate_catalog_on_delete(sender, **kwargs):
+    invalidate_catalog(sender)
+
+
+@receiver(m2m_changed)
+def invalidate_catalog_on_m2m_change(sender, action, **kwargs):
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        invalidate_catalog(sender)
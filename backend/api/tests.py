@@ -1,3 +1,239 @@
-from django.test import TestCase
+"""
+Tests of the api endpoints, the engines behind them are tested in base.tests
+"""
+import hashlib
+import importlib
+import io
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.renderers import FastJSONRenderer
+from api.serializers import RentalSerializer
+from base import models
+from base.management.commands.seed_benchmark_data import PREFIX
+
+
+class EmailValidationTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username="pending", email="pending@rwth-aachen.de", is_active=False)
+
+    def validate(self, token: str):
+        return self.client.post('/api/users/email_validation/', {'hash': token})
+
+    def test_valid_token(self):
+        models.EmailValidation.objects.create(user=self.user, token="valid", expires=timezone.now() + timedelta(days=1))
+        self.assertEqual(self.validate("valid").status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        # a link can only be used once
+        self.assertEqual(self.validate("valid").status_code, 400)
+
+    def test_expired_token(self):
+        models.EmailValidation.objects.create(user=self.user, token="expired", expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.validate("expired").status_code, 400)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+    def test_links_sent_before_the_migration(self):
+        # the migration stores the hash of the old links of every pending account
+        migration = importlib.import_module('base.migrations.0006_emailvalidation')
+        logged_in = User.objects.create(username="logged_in", is_active=False, last_login=timezone.now())
+        migration.tokens_for_sent_links(apps, None)
+        self.assertFalse(models.EmailValidation.objects.filter(user=logged_in).exists())
+        validation = models.EmailValidation.objects.get(user=self.user)
+        self.assertEqual(validation.expires, self.user.date_joined + settings.EMAIL_VALIDATION_EXPIRY)
+        legacy_hash = hashlib.sha256((str(self.user.date_joined) + self.user.username + settings.EMAIL_VALIDATION_HASH_SALT).encode("utf-8")).hexdigest()
+        self.assertEqual(self.validate(legacy_hash).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+
+
+class BulkRentalCreationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = models.Category.objects.create(name="bulk rentals")
+        cls.types = [models.RentalObjectType.objects.create(name=f"bulk rentals {index}", category=category, prefix_identifier=f"BR{index}") for index in range(2)]
+        cls.objects = [models.RentalObject.objects.create(type=object_type, internal_identifier=index)
+                       for object_type in cls.types for index in range(2)]
+        cls.user = User.objects.create(username="bulk_rentals", is_staff=True)
+        profile = models.Profile.objects.create(user=cls.user)
+        cls.reservations = [models.Reservation.objects.create(reserver=profile, objecttype=object_type, operation_number=1, count=2,
+                                                              reserved_from=date(2026, 1, 1), reserved_until=date(2026, 1, 8))
+                            for object_type in cls.types]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, data):
+        return self.client.post('/api/rentals/bulk/', data, format='json')
+
+    def test_create(self):
+        data = [{'id': self.reservations[0].pk, 'selectedObjects': [self.objects[0].pk, self.objects[1].pk]},
+                {'id': self.reservations[1].pk, 'selectedObjects': [self.objects[2].pk]}]
+        self.assertEqual(self.post(data).status_code, 200)
+        rentals = models.Rental.objects.all()
+        self.assertEqual(sorted(rentals.values_list('rented_object', flat=True)), [self.objects[0].pk, self.objects[1].pk, self.objects[2].pk])
+        # one number for all rentals of the request, the end of the reservation as end of the rental
+        self.assertEqual(len({rental.rental_number for rental in rentals}), 1)
+        self.assertTrue(all(rental.current_until == rental.reservation.reserved_until for rental in rentals))
+        # posting again keeps the selected and removes the unselected rentals
+        data[0]['selectedObjects'] = [self.objects[1].pk]
+        self.assertEqual(self.post(data).status_code, 200)
+        self.assertEqual(sorted(models.Rental.objects.values_list('rented_object', flat=True)), [self.objects[1].pk, self.objects[2].pk])
+
+    def test_invalid_requests_write_nothing(self):
+        valid = {'id': self.reservations[0].pk, 'selectedObjects': [self.objects[0].pk]}
+        for invalid in [{'id': self.reservations[1].pk, 'selectedObjects': [self.objects[1].pk]},
+                        {'id': 999999, 'selectedObjects': [self.objects[2].pk]},
+                        {'id': self.reservations[1].pk, 'selectedObjects': [999999]}]:
+            with self.subTest(invalid=invalid):
+                self.assertEqual(self.post([valid, invalid]).status_code, 400)
+                self.assertFalse(models.Rental.objects.exists())
+
+
+class FastJSONRendererTest(TestCase):
+
+    def assertRendersLikeDRF(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_serializer_data(self):
+        self.assertRendersLikeDRF([{'id': 1, 'name': "Zelt \u2028 \u00fc", 'reserved_from': date(2026, 1, 1), 'canceled': None,
+                                    'created_at': datetime(2026, 1, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+                                    'duration': timedelta(days=7), 'price': Decimal("1.50"), 'extensions': [], 1: True}])
+
+    def test_data_orjson_can_not_write(self):
+        self.assertRendersLikeDRF({'number': 2 ** 64})
+        self.assertRendersLikeDRF({'number': -2 ** 70})
+
+    def test_floats(self):
+        data = {'numbers': [0.1, 1e16, 1.5e-7, -2.5e300]}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        # not the same bytes, DRF writes 1e+16 and 1.5e-07
+        self.assertNotEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        # documented difference: orjson writes null where DRF raises
+        self.assertRaises(ValueError, JSONRenderer().render, {'number': float('nan')})
+        self.assertEqual(FastJSONRenderer().render({'number': float('nan')}), b'{"number":null}')
+
+
+@override_settings(REQUEST_INSTRUMENTATION_ENABLED=True)
+class InstrumentationTest(TestCase):
+
+    def test_serializer_time_of_viewsets(self):
+        data = serializers.BaseSerializer.__dict__['data']
+        user = User.objects.create(username="instrumented", is_superuser=True)
+        models.Profile.objects.create(user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.assertLogs('django', 'INFO'):
+            response = client.get('/api/rentals/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, view;dur=[\d.]+, total;dur=[\d.]+$')
+        # only the serializers of the request were timed, nothing is patched for the rest of the process
+        self.assertIs(serializers.BaseSerializer.__dict__['data'], data)
+        self.assertIs(type(RentalSerializer(many=True)), serializers.ListSerializer)
+
+
+class SeededApiTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_benchmark_data', scale='small', seed=3, stdout=io.StringIO())
+        cls.admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        models.Profile.objects.create(user=cls.admin)
+        cls.user = models.Reservation.objects.filter(reserver__user__username__startswith=PREFIX, rental__handed_out_at__isnull=False).order_by(
+            'pk').first().reserver.user
+
+    def client_of(self, user) -> APIClient:
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+
+class CursorPaginationTest(SeededApiTestCase):
+
+    page_size = 2
+
+    def pages(self, client, url: str, key: str = 'id') -> list:
+        """
+        the keys of all rows of all pages, following next until the last page
+        """
+        keys = []
+        next_page = url + ('&' if '?' in url else '?') + f'page_size={self.page_size}'
+        while next_page:
+            response = client.get(next_page)
+            self.assertEqual(response.status_code, 200, next_page)
+            self.assertLessEqual(len(response.data['results']), self.page_size)
+            keys += [row[key] for row in response.data['results']]
+            next_page = response.data['next']
+        return keys
+
+    def test_pages_match_the_filtered_list(self):
+        for user, urls in [(self.admin, ['/api/reservations/', '/api/reservations/?canceled=false&open=true', '/api/rentals/',
+                                         '/api/rentals/?open=true', '/api/onpremisebooking/?canceled=false', '/api/users/']),
+                           (self.user, ['/api/reservations/?self=true', '/api/rentals/?self=true', '/api/onpremisebooking/?self=true'])]:
+            client = self.client_of(user)
+            for url in urls:
+                with self.subTest(user=user.username, url=url):
+                    # without a cursor or page_size the whole list is answered as before
+                    rows = client.get(url).data
+                    self.assertIsInstance(rows, list)
+                    keys = self.pages(client, url)
+                    self.assertEqual(keys, sorted((row['id'] for row in rows), reverse=True))
+                    # more than one page
+                    self.assertGreater(len(keys), self.page_size)
+
+    @skipUnless(connection.vendor == 'postgresql', "distinct on fields needs postgres")
+    def test_unique_operation_numbers(self):
+        client = self.client_of(self.admin)
+        operation_numbers = self.pages(client, '/api/reservations/?unique=true', 'operation_number')
+        self.assertEqual(operation_numbers, sorted(set(models.Reservation.objects.values_list('operation_number', flat=True)), reverse=True))
+
+
+class SparseFieldsetsTest(SeededApiTestCase):
+
+    def get(self, url: str):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client_of(self.admin).get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response.data, [query['sql'] for query in queries.captured_queries]
+
+    def test_fields_prune_the_queries(self):
+        for url, table in [('/api/reservations/', 'base_reservation'), ('/api/rentals/', 'base_rental')]:
+            with self.subTest(url=url):
+                full, full_queries = self.get(url)
+                sparse, sparse_queries = self.get(url + '?fields=id')
+                self.assertEqual(sparse, [{'id': row['id']} for row in full])
+                # no joins for relations that are not rendered and no prefetches
+                main = [sql for sql in sparse_queries if f'FROM "{table}"' in sql]
+                self.assertEqual(len(main), 1)
+                self.assertNotIn('JOIN', main[0])
+                self.assertTrue(any('JOIN' in sql for sql in full_queries if f'FROM "{table}"' in sql))
+                self.assertLess(len(sparse_queries), len(full_queries))
+
+    def test_nested_fields_and_expand(self):
+        full, _ = self.get('/api/reservations/')
+        sparse, queries = self.get('/api/reservations/?fields=id,objecttype.name,reserver.user.username&expand=objecttype,reserver,reserver.user')
+        self.assertEqual(sparse, [{'id': row['id'], 'objecttype': {'name': row['objecttype']['name']},
+                                   'reserver': {'user': {'username': row['reserver']['user']['username']}}} for row in full])
+        # the nested serializers that are not expanded are rendered as primary key without a join
+        collapsed, queries = self.get('/api/reservations/?fields=id,objecttype,reserver&expand=')
+        self.assertEqual(collapsed, [{'id': row['id'], 'objecttype': row['objecttype']['id'], 'reserver': row['reserver']['id']} for row in full])
+        self.assertNotIn('JOIN', next(sql for sql in queries if 'FROM "base_reservation"' in sql))
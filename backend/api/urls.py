@@ -30,5 +30,6 @@ urlpatterns = [
          name='knox_logoutall'),
     path(r'auth/checkcredentials/', views.checkCredentials,
          name='check credentials return 200 if valid'),
+    path(r'cache/stats/', views.catalogCacheStats, name='catalog cache hits and misses'),
 ]
 urlpatterns += router.urls
@@ -1,15 +1,14 @@
 import hashlib
+import hmac
 from django.utils.crypto import get_random_string
 from datetime import datetime, timedelta
 from django.contrib.auth import login
 from django.contrib.auth.models import User, Group, Permission
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.forms.models import model_to_dict
 from django.core.exceptions import FieldError
-from django.db.models import Max, Q, F
+from django.db.models import Q, F, Prefetch
 from django.db import transaction
 from django.utils import timezone
 from django.http import HttpResponse, FileResponse
@@ -23,7 +22,7 @@ from rest_framework import viewsets, renderers
 from rest_framework import permissions
 from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.response import Response
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.decorators import api_view, action, authentication_classes, permission_classes
 from rest_framework.views import exception_handler
 
@@ -38,6 +37,20 @@ from api import serializers
 
 from base.models import RentalObject, RentalObjectType, Category, Reservation, Rental, Profile, Tag, Text
 from base import models
+from base import availability
+from base import cart
+from base import occupancy
+from base import config
+from base import durations
+from base import slots
+from base import numbers
+from base import outbox
+from base import texts
+from base import metrics
+from api.cache import CachedCatalogMixin
+from api.pagination import OptInCursorPagination
+from api import cache
+from backend.instrumentation import InstrumentedViewMixin
 
 from docxtpl import DocxTemplate
 import io
@@ -69,6 +82,16 @@ def integrity_error_exception_handler(exc, context):
 
     return response
 
+
+def requested_pks(request: Request, param: str) -> list:
+    """
+    parses ids from a query param, either comma separated (types=1,2,3) or repeated (types=1&types=2). answers 400 if one is not a number
+    """
+    try:
+        return [int(pk) for value in request.query_params.getlist(param) for pk in value.split(',') if pk != '']
+    except ValueError:
+        raise ValidationError({param: "expected comma separated ids"})
+
 class LoginView(KnoxLoginView):
     """
     Loginview returns a Authtoken for the user to login
@@ -97,15 +120,64 @@ def checkCredentials(request: Request):
     return (Response(serializer.data, status=200))
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def catalogCacheStats(request: Request):
+    """
+    hit and miss counters of the catalog cache per endpoint
+    """
+    return Response(cache.stats())
+
+
+def prometheusMetrics(request):
+    """
+    metrics of every gunicorn worker and celery in the prometheus text format (base.metrics). a plain django view, the
+    scraper is no api user. if settings.METRICS_TOKEN is set it has to be sent as bearer token
+    """
+    if not settings.METRICS_ENABLED:
+        return HttpResponse(status=404)
+    if settings.METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse(status=401)
+    stats = cache.stats()
+    hits = [('', metrics.series({'endpoint': endpoint, 'result': result}), counters[counter]) for endpoint, counters in stats.items()
+            for result, counter in [('hit', 'hits'), ('miss', 'misses')]]
+    ratios = [('', metrics.series({'endpoint': endpoint}), counters['hits'] / (counters['hits'] + counters['misses']))
+              for endpoint, counters in stats.items() if counters['hits'] + counters['misses'] > 0]
+    extra = metrics.family('catalog_cache_requests_total', 'counter', "catalog cache lookups per endpoint and result", hits) + \
+        metrics.family('catalog_cache_hit_ratio', 'gauge', "share of the catalog cache lookups answered from the cache", ratios)
+    return HttpResponse(metrics.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class SparseFieldsetsMixin:
+    """
+    ?fields= and ?expand= for list and retrieve (serializers.sparse_fieldsets). the select_related and prefetch_related
+    lookups of get_queryset are trimmed to the relations the serializer renders
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.action in ['list', 'retrieve']:
+            serializers.sparse_fieldsets(serializer, self.request.query_params.get('fields'), self.request.query_params.get('expand'))
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ['list', 'retrieve']:
+            queryset = serializers.trim_related(queryset, self.get_serializer())
+        return queryset
+
+
+class UserViewSet(SparseFieldsetsMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
-    queryset = User.objects.all().order_by('-date_joined')
+    queryset = User.objects.select_related('profile__prio').prefetch_related('groups').order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [UserPermission]
+    pagination_class = OptInCursorPagination
 
     @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
+    @transaction.atomic
     def passwordreset(self, request:Request):
         if 'username' in request.data and 'email' in request.data:
             usermodel = models.User.objects.filter(username=request.data['username'], email=request.data['email'])
@@ -117,8 +189,8 @@ class UserViewSet(viewsets.ModelViewSet):
                 models.PasswordReset.objects.create(user=usermodel, hash=hash)
                 link=settings.FRONTEND_HOST + 'account/passwordreset?hash='+ hash
                 email_text = render_to_string('passwordreset.html',{'link':link})
-                send_mail(subject="Passwordreset", message=email_text, html_message=email_text,
-                        from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[request.data['email']])
+                outbox.queue_mail(subject="Passwordreset", message=email_text, html_message=email_text,
+                                  from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[request.data['email']])
             else:
                 logger.info(f"Es wurden {usermodel.count()} Accounts zu den Daten Email: {request.data['username']} und Nutzername: {request.data['email']} gefunden. Daher kann kein Reset Link gesendet werden")
         return Response(data={'abs':'abs'})
@@ -263,14 +335,13 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         hash = request.POST['hash']
         # to be able to deactivate accounts last login is checked
-        for model in User.objects.all().filter(is_active=False, last_login__isnull=True):
-            model_hash = hashlib.sha256(
-                (str(model.date_joined) + model.username + settings.EMAIL_VALIDATION_HASH_SALT).encode("utf-8")).hexdigest()
-            if model_hash == hash:
-                model.is_active = True
-                model.save()
-                # User.objects.get(pk=model.id).update(is_active=True)
-                return Response(data={'success': True, 'detail': "Die Email wurde erfolgreich validiert und man kann sich mit dem verbundenen Account einloggen."})
+        validation = models.EmailValidation.objects.select_related('user').filter(
+            token=hash, expires__gte=timezone.now(), user__is_active=False, user__last_login__isnull=True).first()
+        if validation is not None:
+            validation.user.is_active = True
+            validation.user.save()
+            validation.delete()
+            return Response(data={'success': True, 'detail': "Die Email wurde erfolgreich validiert und man kann sich mit dem verbundenen Account einloggen."})
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'success': False, 'detail': "Der Link wurde entweder schon benutzt oder der Link ist falsch, bitte stelle sicher dass der Link richtig eingegeben wurde"})
         # {key:value for key, value in }
 
@@ -286,6 +357,7 @@ class UserViewSet(viewsets.ModelViewSet):
                 return serializers.AdminUserSerializer
             return UserSerializer
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         """
         use default implementation, but remove password from returned data and send email to user.
@@ -303,32 +375,31 @@ class UserViewSet(viewsets.ModelViewSet):
             templateData = user
         templateData['frontend_host'] = settings.FRONTEND_HOST
         templateData['hash'] = hashlib.sha256(
-            (str(templateData["date_joined"]) + templateData["username"] + settings.EMAIL_VALIDATION_HASH_SALT).encode("utf-8")).hexdigest()
+            (str(timezone.now()) + get_random_string(length=256)).encode("utf-8")).hexdigest()
+        models.EmailValidation.objects.create(user=user, token=templateData['hash'], expires=timezone.now() + settings.EMAIL_VALIDATION_EXPIRY)
         templateData['validation_link'] = f"{templateData['frontend_host']}validate/{templateData['hash']}"
-        template = Template(models.Text.objects.filter(
-            name='signup_mail').first().content.replace(r"%}}</p>", r"%}}").replace(r"<p>{{%", r"{{%"))
-        message = template.render(Context(templateData))
+        message = texts.render('signup_mail', templateData)
 
-        # TODO validate if mail has been send
-        send_mail(subject="Registrierung", message=message, html_message=message,
-                  from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[templateData['email']])
+        # sent by celery after the commit, failed attempts are retried (base.outbox)
+        outbox.queue_mail(subject="Registrierung", message=message, html_message=message,
+                          from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[templateData['email']])
         return Response(data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [GroupPermission]
 
 
-class RentalobjectViewSet(viewsets.ModelViewSet):
+class RentalobjectViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = RentalObject.objects.all().order_by('internal_identifier')
     serializer_class = RentalObjectSerializer
     # TODO assign rights
     permission_classes = [customPermissions.RentalObjectPermission]
 
     def get_queryset(self):
-        queryset = RentalObject.objects.all()
+        queryset = RentalObject.annotate_in_house(RentalObject.objects.select_related('type'))
         getdict = self.request.GET
         if 'type' in getdict:
             queryset = queryset.filter(type=getdict['type'])
@@ -336,7 +407,8 @@ class RentalobjectViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class RentalobjectTypeViewSet(viewsets.ModelViewSet):
+class RentalobjectTypeViewSet(CachedCatalogMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'rentalobjecttypes'
     queryset = RentalObjectType.objects.all()
     serializer_class = RentalObjectTypeSerializer
     permission_classes = [customPermissions.RentalObjectTypePermission]
@@ -385,28 +457,48 @@ class RentalobjectTypeViewSet(viewsets.ModelViewSet):
         serializer = serializers.MaxRentDurationSerializer(instance)
         return Response(serializer.data)
 
+    @action(detail=False, url_path="durations", methods=['GET'], permission_classes=[permissions.IsAuthenticated])
+    def max_durations(self, request: Request):
+        """
+        returns the max Duration of every type for the user in one call, like duration for a single type
+        """
+        user_priority = request.user.profile.prio
+        instances = []
+        for pk in models.RentalObjectType.objects.order_by('pk').values_list('pk', flat=True):
+            instance = durations.resolve(pk, user_priority)
+            if instance is None:
+                # fallback fallback to 1 week
+                instance = models.MaxRentDuration(prio=None, rental_object_type_id=pk, duration=durations.DEFAULT_DURATION)
+            instances.append(instance)
+        serializer = serializers.MaxRentDurationSerializer(instances, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, url_path="freeobjects", methods=['GET'])
     def currently_free_objects(self, request: Request, pk=None):
-        object_status = models.RentalObjectStatus.objects.all().filter(from_date__lte=timezone.now(), until_date__gte=timezone.now(),
-                                                                       rentable=False, rental_object__in=RentalObject.objects.filter(type=pk))
-        queryset = models.RentalObject.objects.filter(
-            type=pk, rentable=True).exclude(rentalobjectstatus__in=object_status)
-        result = []
-        for rental_object in queryset:
-            query_res = rental_object.rental_set.filter(Q(
-                Q(received_back_at__isnull=True), Q(Q(handed_out_at__lte=timezone.now())|Q(handed_out_at__isnull=True))))
-            if len(query_res) == 0:
-                data = model_to_dict(rental_object)
-                result.append(data)
-        return Response(result)
+        queryset = models.RentalObject.currently_free(
+            models.RentalObject.objects.filter(type=pk))
+        return Response(list(queryset.values(*self.free_object_fields)))
 
-    @action(detail=True, url_path="available", methods=['GET'], permission_classes=[permissions.IsAuthenticated])
-    def available_object(self, request: Request, pk=None):
+    @action(detail=False, url_path="freeobjects", methods=['GET'])
+    def all_currently_free_objects(self, request: Request):
         """
-        takes two arguments a start date and an end date end calculates if that object is available around that time
+        the currently free objects of every type {type id: [objects]} for the lending desk. the optional types query param (e.g. types=1,2,3) limits the result to those types
+        """
+        queryset = models.RentalObject.objects.all()
+        if 'types' in request.query_params:
+            queryset = queryset.filter(type__in=requested_pks(request, 'types'))
+        data = {}
+        for rental_object in models.RentalObject.currently_free(queryset).order_by('type', 'internal_identifier').values(*self.free_object_fields):
+            data.setdefault(rental_object['type'], []).append(rental_object)
+        return Response(data)
+
+    # same keys model_to_dict returned for a RentalObject
+    free_object_fields = ['id', 'type', 'inventory_number', 'rentable', 'internal_identifier']
+
+    def _requested_range(self, request: Request):
+        """
+        parses from_date and until_date query params for the availability endpoints
         """
-        if not models.RentalObjectType.objects.all().filter(id=pk).exists():
-            raise models.RentalObjectType.DoesNotExist
         if not 'from_date' in request.query_params:
             raise FieldError("from_date query param is missing")
         if not 'until_date' in request.query_params:
@@ -416,6 +508,16 @@ class RentalobjectTypeViewSet(viewsets.ModelViewSet):
             request.query_params['from_date'], "%Y-%m-%d").replace(tzinfo=timezone.get_current_timezone())
         until_date = datetime.strptime(
             request.query_params['until_date'], "%Y-%m-%d").replace(tzinfo=timezone.get_current_timezone())
+        return from_date, until_date
+
+    @action(detail=True, url_path="available", methods=['GET'], permission_classes=[permissions.IsAuthenticated])
+    def available_object(self, request: Request, pk=None):
+        """
+        takes two arguments a start date and an end date end calculates if that object is available around that time
+        """
+        if not models.RentalObjectType.objects.all().filter(id=pk).exists():
+            raise models.RentalObjectType.DoesNotExist
+        from_date, until_date = self._requested_range(request)
         ret = models.RentalObjectType.available(
             pk=pk, until_date=until_date, from_date=from_date)
         return Response(data=ret)
@@ -423,15 +525,16 @@ class RentalobjectTypeViewSet(viewsets.ModelViewSet):
     @action(detail=False, url_path="available", methods=['GET'], permission_classes=[permissions.IsAuthenticated])
     def available_objects(self, request: Request):
         """
-        this function does the same as available_object only for querysets returns all objects available around that time
+        this function does the same as available_object only for querysets returns all objects available around that time.
+        the optional types query param (e.g. types=1,2,3) limits the result to those types.
+        all types are calculated together with a constant number of queries, see base.availability.available_for_types
         """
-        # TODO allow the supply of a specific set of types
+        from_date, until_date = self._requested_range(request)
         queryset = self.get_queryset().filter(visible=True)
-        data = {}
-        for object_type in queryset:
-            data[object_type.id] = self.available_object(
-                request=request, pk=object_type.id).data
-
+        if 'types' in request.query_params:
+            queryset = queryset.filter(pk__in=requested_pks(request, 'types'))
+        data = availability.available_for_types(
+            queryset.values_list('pk', flat=True), from_date=from_date, until_date=until_date)
         return Response(data)
 
     def get_queryset(self):
@@ -442,14 +545,15 @@ class RentalobjectTypeViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedCatalogMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'categories'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     # TODO assign rights
     permission_classes = [customPermissions.CategoryPermission]
 
 
-class ReservationViewSet(viewsets.ModelViewSet):
+class ReservationViewSet(SparseFieldsetsMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
     """
     Limit returned objects by open, from and until get requests
     """
@@ -458,12 +562,21 @@ class ReservationViewSet(viewsets.ModelViewSet):
     serializer_class = ReservationSerializer
     # TODO assign rights
     permission_classes = [customPermissions.ReservationPermission]
+    pagination_class = OptInCursorPagination
+
+    @property
+    def cursor_ordering(self):
+        # distinct on operation_number only works if the rows are ordered by it first, it is unique after the distinct.
+        # the pk picks the same reservation of an operation on every page
+        return ('-operation_number', '-pk') if self.request.GET.get('unique') in ['true', 'True'] else '-pk'
 
     def get_serializer_class(self):
         return serializers.ReservationAdminSerializer if self.request.user.is_staff else serializers.ReservationSerializer
 
     def get_queryset(self):
-        queryset = Reservation.objects.all()
+        # everything ReservationAdminSerializer renders, the mixin drops what the serializer of the request does not need
+        queryset = Reservation.objects.select_related('objecttype', 'reserver__prio', 'reserver__user').prefetch_related(
+            'objecttype__tags', 'reserver__user__groups', 'rental_set')
         getdict = self.request.GET
         if 'reserved_from' in getdict:
             # we fetch all starting after that
@@ -500,6 +613,7 @@ class ReservationViewSet(viewsets.ModelViewSet):
         return Response(result)
 
     @action(detail=True, methods=['POST'], url_path="cancel", permission_classes=[permissions.IsAuthenticated])
+    @transaction.atomic
     def cancel_reservation(self, request: Request, pk=None):
         reservation = Reservation.objects.get(pk=pk)
         if request.user != reservation.reserver.user and not request.user.is_staff:
@@ -511,66 +625,58 @@ class ReservationViewSet(viewsets.ModelViewSet):
         reservation.rental_set.all().delete()
         serializer = ReservationSerializer(reservation)
         template_data = serializer.data
-        template = Template(models.Text.objects.filter(
-            name='reservation_cancel_mail').first().content)
-        message = template.render(Context(template_data))
-        send_mail(subject="Stornierung deiner Reservierung", message=message, html_message=message,
-                  from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[reservation.reserver.user.email])
+        message = texts.render('reservation_cancel_mail', template_data, unwrapped=False)
+        outbox.queue_mail(subject="Stornierung deiner Reservierung", message=message, html_message=message,
+                          from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[reservation.reserver.user.email])
 
         return Response(serializer.data)
 
     @action(detail=False, methods=['POST'], url_path="bulk", permission_classes=[permissions.IsAuthenticated])
+    @transaction.atomic
     def bulk_create(self, request: Request):
         """
         create reservations from a list of reservation candidates
         """
-        data = request.data['data']
-        if models.Reservation.objects.all().exists():
-            operation_number = models.Reservation.objects.aggregate(
-                Max('operation_number'))['operation_number__max']+1
-        else:
-            operation_number = 1
-
-        response_data = []
-        for reservation in data:
-            if reservation['count'] > models.RentalObjectType.available(reservation['objecttype'], datetime.strptime(reservation['reserved_from'], "%Y-%m-%d").replace(tzinfo=timezone.get_current_timezone()), datetime.strptime(reservation['reserved_until'], "%Y-%m-%d").replace(tzinfo=timezone.get_current_timezone()))['available']:
-                return Response({'data': 'not enough objects available'}, status=status.HTTP_400_BAD_REQUEST)
-        template_data = {"reservations": []}
-        for reservation in data:
-            # merge reservations of the same type and not aleardy rented
-            if models.Reservation.objects.filter(
-                    reserved_from=reservation["reserved_from"],
-                    reserved_until=reservation["reserved_until"],
-                    objecttype=reservation["objecttype"],
-                    reserver=request.user.profile.pk).exclude(
-                        rental__in=Rental.objects.filter(rented_object__type=reservation['objecttype'])).exclude(canceled__isnull=False).count() == 0:
-                reservation['operation_number'] = operation_number
-                reservation['reserver'] = request.user.profile.pk
-                serializer = serializers.BulkReservationSerializer(
-                    data=reservation)
-                serializer.is_valid(raise_exception=True)
-                template_data["reservations"].append(serializer.validated_data)
-                serializer.save()
-            else:
-                count = reservation['count']
-                reservation = models.Reservation.objects.get(
-                    reserved_from=reservation["reserved_from"], reserved_until=reservation["reserved_until"], objecttype=reservation["objecttype"], reserver=request.user.profile.pk, canceled__isnull=True)
-                reservation.count += count
-                reservation.save()
-                serializer = serializers.BulkReservationSerializer(reservation)
-
-            response_data.append(serializer.data)
+        reservation_cart = cart.Cart(request.data['data'], request.user.profile)
+        # concurrent carts with the same types wait here until this transaction is committed, so nobody books the objects
+        # counted as available by the cart in between. the check reads the rows, not the materialized occupancy.
+        # items that can not be parsed are rejected by the cart, only the types of the others are locked
+        availability.lock_types(reservation_cart.type_pks())
+        if not reservation_cart.is_valid():
+            return Response({'data': next(error for error in reservation_cart.errors if error is not None), 'errors': reservation_cart.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        operation_number = numbers.next_number('operation_number')
+
+        # merge reservations of the same type and not aleardy rented
+        reservations = dict(reservation_cart.merge_into)
+        created = []
+        for pk, reserved_from, reserved_until, count in reservation_cart.parsed:
+            key = (pk, reserved_from, reserved_until)
+            if key in reservations:
+                reservations[key].count += count
+                continue
+            reservations[key] = models.Reservation(reserver=request.user.profile, objecttype=reservation_cart.types[pk], reserved_from=reserved_from,
+                                                   reserved_until=reserved_until, count=count, operation_number=operation_number)
+            created.append(reservations[key])
+        models.Reservation.objects.bulk_create(created)
+        for reservation in reservation_cart.merge_into.values():
+            reservation.save(update_fields=['count'])
+        # bulk_create skips the signals
+        occupancy.schedule_refresh([day_range for reservation in created for day_range in occupancy.affected_ranges(reservation)])
+
+        response_data = serializers.BulkReservationSerializer([reservations[parsed[:3]] for parsed in reservation_cart.parsed], many=True).data
+        template_data = {"reservations": [{'reserver': reservation.reserver, 'objecttype': reservation.objecttype, 'reserved_from': reservation.reserved_from,
+                                           'reserved_until': reservation.reserved_until, 'count': reservation.count,
+                                           'operation_number': reservation.operation_number} for reservation in created]}
         template_data = {**template_data,
-                         "lenting_start_hour": models.Settings.objects.get(type="lenting_start_hour").value,
-                         "lenting_end_hour": models.Settings.objects.get(type="lenting_end_hour").value,
-                         "returning_start_hour": models.Settings.objects.get(type="returning_start_hour").value,
-                         "returning_end_hour": models.Settings.objects.get(type="returning_end_hour").value, }
-        template = Template(models.Text.objects.filter(
-            name='reservation_confirmation_mail').first().content.replace(r"%}}</p>", r"%}}").replace(r"<p>{{%", r"{{%"))
-        message = template.render(Context(template_data))
+                         "lenting_start_hour": config.value("lenting_start_hour"),
+                         "lenting_end_hour": config.value("lenting_end_hour"),
+                         "returning_start_hour": config.value("returning_start_hour"),
+                         "returning_end_hour": config.value("returning_end_hour"), }
+        message = texts.render('reservation_confirmation_mail', template_data)
         if len(template_data['reservations']) > 0:
-            send_mail(subject="Deine Reservierung", message=message, html_message=message,
-                      from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[template_data['reservations'][0]["reserver"].user.email])
+            outbox.queue_mail(subject="Deine Reservierung", message=message, html_message=message,
+                              from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[template_data['reservations'][0]["reserver"].user.email])
         return Response(data={'data': response_data})
 
     @ action(detail=False, methods=['POST'], url_path="download_form", permission_classes=[permissions.IsAuthenticated])
@@ -595,13 +701,19 @@ class ReservationViewSet(viewsets.ModelViewSet):
         return HttpResponse(file.getvalue(), content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
 
 
-class RentalViewSet(viewsets.ModelViewSet):
+class RentalViewSet(SparseFieldsetsMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Rental.objects.all()
     serializer_class = RentalSerializer
     permission_classes = [customPermissions.RentalPermission]
+    pagination_class = OptInCursorPagination
 
     def get_queryset(self):
-        queryset = models.Rental.objects.all()
+        # load the whole graph RentalSerializer renders up front instead of querying it per rental
+        queryset = models.Rental.objects.select_related(
+            'reservation__objecttype', 'reservation__reserver__prio', 'reservation__reserver__user').prefetch_related(
+            Prefetch('rented_object', queryset=models.RentalObject.annotate_in_house(
+                models.RentalObject.objects.select_related('type'))),
+            'extension_set', 'reservation__rental_set', 'reservation__objecttype__tags', 'reservation__reserver__user__groups')
         if self.request.user.is_staff:
             queryset = queryset
         else:
@@ -617,6 +729,21 @@ class RentalViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(reservation=int(self.request.GET["reservation"]))
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        default list, but the extendability of all rentals is answered by one availability.Inventory
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rentals = list(page if page is not None else queryset)
+        context = self.get_serializer_context()
+        serializer = self.get_serializer(rentals, many=True, context=context)
+        if 'extendable' in serializer.child.fields:
+            context['inventory'] = serializers.RentalSerializer.extension_inventory(rentals)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
     @ action(detail=True, methods=['POST'], url_path="extend", permission_classes=[permissions.IsAuthenticated])
     @transaction.atomic
     def extend_rental(self, request: Request, pk=None):
@@ -643,51 +770,49 @@ class RentalViewSet(viewsets.ModelViewSet):
             return APIException("nicht verlängerbar", code=status.HTTP_400_BAD_REQUEST)
 
     @ action(detail=False, methods=['POST'], url_path="bulk", permission_classes=[permissions.IsAuthenticated])
+    @transaction.atomic
     def bulk_rental_creation(self, request: Request):
         """
-        Takes a list of reservations with a list of slectedObjects each to create collected rentals to be handed out
+        Takes a list of reservations with a list of slectedObjects each to create collected rentals to be handed out.
+        reservations, objects and existing rentals are loaded with one query each and the new rentals are inserted at once
         """
-        if models.Rental.objects.all().exists():
-            rental_number = models.Rental.objects.aggregate(
-                Max('rental_number'))['rental_number__max']+1
-        else:
-            rental_number = 1
+        reservations = models.Reservation.objects.in_bulk([reservation['id'] for reservation in request.data])
+        rental_objects = models.RentalObject.objects.in_bulk(
+            {selected for reservation in request.data for selected in reservation['selectedObjects']})
+        # validate everything before anything is written, like Rental.save does for a single rental
         for reservation in request.data:
-            logger.info(reservation)
-            reservation_model = models.Reservation.objects.get(pk=reservation['id'])
-            # remove all Rentals that are on this rental 
-            reservation_model.rental_set.exclude(rented_object__in=reservation['selectedObjects']).delete()
-            already_saved_rental_objects = reservation_model.rental_set
+            if int(reservation['id']) not in reservations:
+                return Response(f"reservation {reservation['id']} does not exist", status=status.HTTP_400_BAD_REQUEST)
             for selected in reservation['selectedObjects']:
-                if already_saved_rental_objects.filter(rented_object__pk=selected):
+                if int(selected) not in rental_objects:
+                    return Response(f"object {selected} does not exist", status=status.HTTP_400_BAD_REQUEST)
+                if rental_objects[int(selected)].type_id != reservations[int(reservation['id'])].objecttype_id:
+                    return Response("Reservationtype and type of inserted rented object have to be equal", status=status.HTTP_400_BAD_REQUEST)
+
+        already_saved = {}
+        for reservation_pk, rented_object_pk in models.Rental.objects.filter(reservation__in=reservations.keys()).values_list('reservation', 'rented_object'):
+            already_saved.setdefault(reservation_pk, set()).add(rented_object_pk)
+        rental_number = numbers.next_number('rental_number')
+        rentals = []
+        for reservation in request.data:
+            reservation_model = reservations[int(reservation['id'])]
+            selected_objects = [int(selected) for selected in reservation['selectedObjects']]
+            # remove all Rentals that are on this rental
+            reservation_model.rental_set.exclude(rented_object__in=selected_objects).delete()
+            for selected in selected_objects:
+                if selected in already_saved.get(reservation_model.pk, set()):
                     continue
-                rental_object = models.RentalObject.objects.get(pk=selected)
-                models.Rental.objects.create(reservation=reservation_model,rented_object=rental_object, rental_number=rental_number)
-        reservation_model.refresh_from_db()
-        serializer = serializers.ReservationSerializer(reservation_model)
+                already_saved.setdefault(reservation_model.pk, set()).add(selected)
+                rentals.append(models.Rental(reservation=reservation_model, rented_object=rental_objects[selected],
+                                             rental_number=rental_number, current_until=reservation_model.reserved_until))
+        models.Rental.objects.bulk_create(rentals)
+        # bulk_create skips the signals
+        occupancy.schedule_refresh([day_range for rental in rentals for day_range in occupancy.affected_ranges(rental)])
+
+        serializer = serializers.ReservationSerializer(models.Reservation.objects.filter(pk__in=reservations.keys()).select_related(
+            'objecttype').prefetch_related('rental_set', 'objecttype__tags'), many=True)
         return Response(serializer.data)
-        template_data = []
-        ret_data = []
-        for reservation in request.data:
-            for index in range(reservation['count']):
-                rental = {}
-                rental['rented_object'] = reservation['selectedObjects'][index]
-                rental['lender'] = request.user.pk
-                rental['rental_number'] = rental_number
-                rental['handed_out_at'] = timezone.now()
-                rental['reservation'] = reservation['id']
-                # we need an own serializer since reservation needs to be read only on the other serializer
-                serializer = serializers.RentalCreateSerializer(data=rental)
-                serializer.is_valid(raise_exception=True)
-                template_data.append(serializer.validated_data)
-                serializer.save()
-                ret_data.append(serializer.data)
-        template = Template(models.Text.objects.filter(
-            name='rental_confirmation_mail').first().content.replace(r"%}}</p>", r"%}}").replace(r"<p>{{%", r"{{%"))
-        message = template.render(Context({'rentals': template_data}))
-        send_mail(subject="Dein Ausleihvorgang", message=message, html_message=message,
-                  from_email=settings.DEFAULT_FROM_EMAIL, recipient_list=[template_data[0]['reservation'].reserver.user.email])
-        return Response(ret_data)
+
     @ action(detail=False, methods=['POST'], url_path="bulkhandout", permission_classes=[permissions.IsAuthenticated])
     def bulk_rental_handout(self, request: Request):
         """
@@ -699,6 +824,8 @@ class RentalViewSet(viewsets.ModelViewSet):
                 if rental_set.all().count() != reservation.count:
                     raise ValueError("The number of rented objects is unequal to the number of reserved objects")
                 rental_set.all().update(handed_out_at= timezone.now())
+                # queryset updates do not send signals
+                occupancy.schedule_refresh([(reservation.objecttype_id, min(reservation.reserved_from, timezone.localdate()), availability.blocked_end(reservation.reserved_until))])
                 #TODO send email on handout
         return Response()
 
@@ -716,7 +843,8 @@ class RentalViewSet(viewsets.ModelViewSet):
         return Response(updated)
 
 
-class TextViewSet(viewsets.ModelViewSet):
+class TextViewSet(CachedCatalogMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'texts'
     queryset = Text.objects.all()
     serializer_class = TextSerializer
     permission_classes = [customPermissions.TextPermission]
@@ -729,20 +857,22 @@ class TextViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(CachedCatalogMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     # TODO assign rights everyone list, retrieve, post patch and put only with permission and logged in
     permission_classes = [customPermissions.TagPermission]
 
 
-class PriorityViewSet(viewsets.ModelViewSet):
+class PriorityViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = models.Priority.objects.all()
     serializer_class = serializers.PrioritySerializer
     permission_classes = [customPermissions.PriorityPermission]
 
 
-class SettingsViewSet(viewsets.ModelViewSet):
+class SettingsViewSet(CachedCatalogMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'settings'
     queryset = models.Settings.objects.filter(public=True)
     serializer_class = serializers.SettingsSerializer
     permission_classes = [customPermissions.SettingsPermission]
@@ -754,7 +884,8 @@ class SettingsViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class MaxRentDurationViewSet(viewsets.ModelViewSet):
+class MaxRentDurationViewSet(CachedCatalogMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    cache_endpoint = 'duration'
     queryset = models.MaxRentDuration.objects.all()
     serializer_class = serializers.MaxRentDurationSerializer
     permission_classes = [customPermissions.MaxRentDurationPermission]
@@ -767,7 +898,7 @@ class MaxRentDurationViewSet(viewsets.ModelViewSet):
                 rental_object_type=getdict['object_type'])
         return queryset
 
-class FilesViewSet(viewsets.ModelViewSet):
+class FilesViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = models.Files.objects.all()
     serializer_class = serializers.FilesSerializer
     permission_classes = [customPermissions.FilesPermission]
@@ -796,12 +927,12 @@ class FilesViewSet(viewsets.ModelViewSet):
         return HttpResponse(file, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
 
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = models.Profile.objects.all()
     serializer_class = serializers.ProfileSerializer
 
 
-class OnPremiseWorkplaceViewSet(viewsets.ModelViewSet):
+class OnPremiseWorkplaceViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = models.OnPremiseWorkplace.objects.all()
     serializer_class = serializers.OnPremiseWorkplaceSerializer
     permission_classes = [customPermissions.OnPremiseWorkplacePermission]
@@ -820,61 +951,26 @@ class OnPremiseWorkplaceViewSet(viewsets.ModelViewSet):
         """
         return all Timeslots which are bookable [{start: time, end:time, weekday: int, date:date ,disabled: bool}]
         """
-        weekdays = models.Settings.objects.get(
-            type='onpremise_weekdays').value.replace(' ', '').split(',')
-        temp = models.Settings.objects.get(
-            type='onpremise_starttime').value.replace(' ', '').split(':')
-        onpremise_start_hour = int(temp[0])
-        onpremise_start_min = int(temp[1] if len(temp) > 1 else 0)
-        temp = models.Settings.objects.get(
-            type='onpremise_endtime').value.replace(' ', '').split(':')
-        onpremise_end_hour = int(temp[0])
-        onpremise_end_min = int(temp[1] if len(temp) > 1 else 0)
-        onpremise_break = timedelta(minutes=int(models.Settings.objects.get(
-            type='onpremise_breakinbetween_in_min').value.replace(' ', '')))
-        onpremise_date_range = int(models.Settings.objects.get(
-            type='onpremise_date_range_in_days').value.replace(' ', ''))
-        duration = timedelta(minutes=int(models.Settings.objects.get(
-            type='onepremise_slotduration').value.replace(' ', '')))
-        ret = []
-        excluded_workplaces = models.OnPremiseWorkplace.objects.get(
-            pk=pk).exclusions.all()
-        for diff in range(onpremise_date_range):
-            delta = timedelta(days=diff)
-            now = timezone.now().astimezone(tz=timezone.get_default_timezone())
-            slot_day = now + delta
-            if str(slot_day.isoweekday()) not in weekdays:
-                continue
+        workplace = self.get_object()
+        return Response(slots.slots_for_workplaces([workplace.pk])[workplace.pk])
+
+    @action(detail=False, url_path="slots", methods=['GET'], permission_classes=[permissions.IsAuthenticated])
+    def get_all_slots(self, request: Request):
+        """
+        the slots of all workplaces at once {workplace: [{start, end, weekday, date, disabled}]}.
+        supports the displayed query param like the list and workplaces=1,2,3 to limit the result to those workplaces
+        """
+        queryset = self.get_queryset()
+        if 'workplaces' in request.query_params:
+            queryset = queryset.filter(pk__in=requested_pks(request, 'workplaces'))
+        return Response(slots.slots_for_workplaces(queryset.values_list('pk', flat=True)))
+
 
-            init_start_hour = onpremise_start_hour
-            init_start_min = onpremise_start_min
-            start = slot_day.replace(
-                hour=init_start_hour, minute=init_start_min, second=0, microsecond=0)
-            while (start + duration <= slot_day.replace(hour=onpremise_end_hour, minute=onpremise_end_min, second=0, microsecond=0)):
-                slot_start = start
-                slot_end = start + duration
-                # fetch all bookings in the slot that are not canceled
-                bookings = models.OnPremiseBooking.objects.filter(
-                    slot_start__lte=slot_end, slot_end__gte=slot_start, workplace_id=pk, canceled__isnull=True)
-                # general disabled time
-                blocked = models.OnPremiseBlockedTimes.objects.filter(
-                    starttime__lte=slot_end, endtime__gte=slot_start)
-                # fetch status
-                status = models.OnPremiseWorkplaceStatus.objects.filter(
-                    from_date__lte=slot_end, until_date__gte=slot_start, workplace_id=pk)
-                exclusion_bookings = models.OnPremiseBooking.objects.filter(
-                    workplace__in=excluded_workplaces, slot_start__lte=slot_end, slot_end__gte=slot_start)
-                ret.append({'start': slot_start, 'end': slot_end, 'weekday': slot_day.weekday(), 'date': start.date(
-                ), 'disabled': (bookings.count() != 0 or status.count() != 0 or blocked.count() != 0 or exclusion_bookings.count() != 0)})
-                start = slot_end + onpremise_break
-
-        return Response(ret)
-
-
-class OnPremiseBookingViewSet(viewsets.ModelViewSet):
-    queryset = models.OnPremiseBooking.objects.all()
+class OnPremiseBookingViewSet(SparseFieldsetsMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
+    queryset = models.OnPremiseBooking.objects.select_related('user__profile__prio').prefetch_related('user__groups')
     serializer_class = serializers.OnPremiseBookingSerializer
     permission_classes = [customPermissions.OnPremiseBookingPermission]
+    pagination_class = OptInCursorPagination
 
     @action(detail=True, url_path="cancel", methods=['POST'], permission_classes=[permissions.IsAuthenticated])
     def cancel_onpremise_booking(self, request: Request, pk=None):
@@ -902,7 +998,7 @@ class OnPremiseBookingViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class OnPremiseBlockedTimesViewSet(viewsets.ModelViewSet):
+class OnPremiseBlockedTimesViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = models.OnPremiseBlockedTimes.objects.all()
     serializer_class = serializers.OnPremiseBlockedTimesSerializer
     permission_classes = [customPermissions.OnPremiseBlockedTimesPermission]
@@ -0,0 +1,68 @@
+"""
+gzip and brotli compression of responses above settings.RESPONSE_COMPRESSION_MIN_SIZE bytes.
+
+Lists like the availability map of every type or the admin rental list are mostly repeated keys and compress to a fraction
+of their size. Brotli is used if the client accepts it and the brotli package is installed, gzip otherwise. Small
+responses are sent as they are, compressing them costs more time than it saves. Like django's GZipMiddleware the gzip
+output gets random padding in its header, which makes BREACH attacks on secrets in compressed responses impractical.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# text formats only, images, docx files and the like are compressed already
+COMPRESSIBLE = re.compile(r'^(application/(json|javascript|xml)|text/|image/svg)')
+GZIP_RANDOM_BYTES = 100
+
+
+def accepts(request, encoding: str) -> bool:
+    """
+    whether the Accept-Encoding header lists the encoding without q=0
+    """
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.partition(';')
+        if name.strip().lower() == encoding:
+            return re.fullmatch(r'q=0(\.0*)?', params.replace(' ', '')) is None
+    return False
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    should be one of the first middlewares, the ones before it see the compressed response
+    """
+
+    def __init__(self, get_response) -> None:
+        if not settings.RESPONSE_COMPRESSION_ENABLED:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding') or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+        if not COMPRESSIBLE.match(response.get('Content-Type', '')):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if brotli is not None and accepts(request, 'br'):
+            content, encoding = brotli.compress(response.content, quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY), 'br'
+        elif accepts(request, 'gzip'):
+            content, encoding = compress_string(response.content, max_random_bytes=GZIP_RANDOM_BYTES), 'gzip'
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # the compressed bytes differ from the ones the etag was calculated for
+        if response.has_header('ETag') and not response['ETag'].startswith('W/'):
+            response['ETag'] = 'W/' + response['ETag']
+        return response
@@ -0,0 +1,191 @@
+"""
+Per request SQL and timing instrumentation, enabled by settings.REQUEST_INSTRUMENTATION_ENABLED.
+
+Every request records the number and total time of its SQL queries (through a database execute wrapper, so it works
+without DEBUG), its slowest statements, the time spent in serializer.data and in the view. The numbers are sent back as
+Server-Timing header, which the network tab of the browser shows, and logged as one json line. Requests above the query
+or latency budget of their url name (settings.REQUEST_BUDGETS, e.g. rental-list) are logged as warning with their DRF action.
+
+With settings.METRICS_ENABLED the latency and query count of every request are recorded in the histograms of base.metrics
+as well, labeled with the url name and DRF action. Both use the same execute wrapper, the header and log line are only
+written if the instrumentation itself is enabled.
+
+Serializer time is measured by InstrumentedViewMixin of the DRF views, for the serializers a view gets from get_serializer.
+Serializers a view builds itself are part of the view time. Nothing outside of the views is patched, celery tasks and
+management commands use the serializers unchanged.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework import serializers
+
+from base import metrics
+
+logger = logging.getLogger(name="django")
+
+# stats of the request handled by the current thread or task, None outside of instrumented requests
+current: ContextVar[Optional['RequestStats']] = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_ms = 0.0
+        # (ms, sql), the settings.REQUEST_INSTRUMENTATION_SLOWEST slowest statements
+        self.slowest: List[Tuple[float, str]] = []
+        self.serializer_ms = 0.0
+        self.view_started: Optional[float] = None
+        self.view_ms = 0.0
+        self.name = None
+        self.action = None
+        self.in_serializer = False
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        execute wrapper of the database connections
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.queries += 1
+            self.sql_ms += duration
+            if len(self.slowest) < settings.REQUEST_INSTRUMENTATION_SLOWEST or duration > self.slowest[-1][0]:
+                self.slowest = sorted(self.slowest + [(duration, sql[:500])], reverse=True)[:settings.REQUEST_INSTRUMENTATION_SLOWEST]
+
+
+def _timed_data(data):
+    """
+    wraps BaseSerializer.data, only the outermost serializer of a request is counted, nested ones are part of its time
+    """
+    def wrapper(serializer):
+        stats = current.get()
+        if stats is None or stats.in_serializer:
+            return data.fget(serializer)
+        stats.in_serializer = True
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            stats.in_serializer = False
+            stats.serializer_ms += (time.perf_counter() - start) * 1000
+    return property(wrapper)
+
+
+# serializer class: subclass with a timed data property, built once per class
+_timed_classes: Dict[type, type] = {}
+
+
+def _timed_class(serializer_class: type) -> type:
+    if serializer_class not in _timed_classes:
+        _timed_classes[serializer_class] = type(serializer_class.__name__, (serializer_class,), {
+            '__module__': serializer_class.__module__, 'data': _timed_data(serializer_class.data)})
+    return _timed_classes[serializer_class]
+
+
+class InstrumentedViewMixin:
+    """
+    counts serializer.data of the serializers from get_serializer as serializer time of the request. only the returned
+    instance is switched to a timed subclass of its class and only inside instrumented requests
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if settings.REQUEST_INSTRUMENTATION_ENABLED and current.get() is not None and isinstance(serializer, serializers.BaseSerializer):
+            serializer.__class__ = _timed_class(type(serializer))
+        return serializer
+
+
+def budget(name: Optional[str]) -> Tuple[int, float]:
+    """
+    (max queries, max milliseconds) of an url name, e.g. rentalobjecttype-available
+    """
+    return settings.REQUEST_BUDGETS.get(name, settings.REQUEST_BUDGETS['default'])
+
+
+class RequestInstrumentationMiddleware:
+    """
+    should be the first middleware, so the queries of the other middlewares (sessions, authentication) are counted as well
+    """
+
+    def __init__(self, get_response) -> None:
+        if not settings.REQUEST_INSTRUMENTATION_ENABLED and not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        if stats.view_started is not None and stats.view_ms == 0:
+            # views without a template response
+            stats.view_ms = (time.perf_counter() - stats.view_started) * 1000
+        if settings.REQUEST_INSTRUMENTATION_ENABLED:
+            self.report(request, response, stats)
+        if settings.METRICS_ENABLED:
+            self.record(request, response, stats)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current.get()
+        if stats is None:
+            return None
+        stats.view_started = time.perf_counter()
+        stats.name = request.resolver_match.url_name if request.resolver_match else None
+        # viewsets map the http method to the action, the view class of an @api_view is named after the function
+        actions = getattr(view_func, 'actions', None) or {}
+        stats.action = actions.get(request.method.lower()) or getattr(getattr(view_func, 'cls', view_func), '__name__', None)
+        return None
+
+    def process_template_response(self, request, response):
+        # drf responses are rendered after this, the rendering is not part of the view time
+        stats = current.get()
+        if stats is not None and stats.view_started is not None:
+            stats.view_ms = (time.perf_counter() - stats.view_started) * 1000
+        return response
+
+    def report(self, request, response, stats: RequestStats) -> None:
+        total_ms = stats.total_ms()
+        response['Server-Timing'] = ", ".join([
+            f'db;dur={stats.sql_ms:.1f};desc="{stats.queries} queries"',
+            f'serializer;dur={stats.serializer_ms:.1f}',
+            f'view;dur={stats.view_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+        max_queries, max_ms = budget(stats.name)
+        over_budget = [exceeded for exceeded, over in [('queries', stats.queries > max_queries), ('latency', total_ms > max_ms)] if over]
+        line = {'method': request.method, 'path': request.path, 'status': response.status_code, 'name': stats.name,
+                'action': stats.action, 'queries': stats.queries, 'sql_ms': round(stats.sql_ms, 1),
+                'serializer_ms': round(stats.serializer_ms, 1), 'view_ms': round(stats.view_ms, 1), 'total_ms': round(total_ms, 1),
+                'slowest': [{'ms': round(duration, 1), 'sql': sql} for duration, sql in stats.slowest]}
+        if over_budget:
+            line['over_budget'] = over_budget
+            logger.warning("request over budget " + json.dumps(line))
+        else:
+            logger.info("request " + json.dumps(line))
+
+    def record(self, request, response, stats: RequestStats) -> None:
+        # unresolved paths (404) share one label, otherwise every scanned url would become its own series
+        labels = {'name': stats.name or 'unresolved', 'action': stats.action or ''}
+        metrics.record(
+            counters=[('http_requests_total', {**labels, 'method': request.method, 'status': response.status_code}, 1)],
+            histograms=[('http_request_duration_seconds', labels, stats.total_ms() / 1000),
+                        ('http_request_db_queries', labels, stats.queries)])
@@ -70,6 +70,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so the queries of every other middleware are counted as well
+    'backend.instrumentation.RequestInstrumentationMiddleware',
+    # before every middleware that reads the content of the response
+    'backend.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,14 +84,25 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# 'orjson' renders json with api.renderers.FastJSONRenderer (same json as DRF's, several times faster), 'drf' with DRF's JSONRenderer
+API_JSON_RENDERER = os.environ.get('API_JSON_RENDERER', 'orjson')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'knox.auth.TokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer' if API_JSON_RENDERER == 'orjson' else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'EXCEPTION_HANDLER': 'api.views.integrity_error_exception_handler'
 
 }
 
+# rows per page of the cursor paginated list endpoints (api.pagination), clients can ask for up to API_MAX_PAGE_SIZE with ?page_size=
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
 REST_KNOX = {
     'SECURE_HASH_ALGORITHM': 'cryptography.hazmat.primitives.hashes.SHA512',
     'AUTH_TOKEN_CHARACTER_LENGTH': 128,
@@ -199,6 +214,8 @@ CSRF_TRUSTED_ORIGINS = str(os.environ.get('API_HOST')).split(',')
 # Fix for django thinking connection is not secure and DRF providing http only links
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 EMAIL_VALIDATION_HASH_SALT = str(os.environ.get('EMAIL_VALIDATION_HASH_SALT'))
+# validation links expire together with the unvalidated accounts, see base.tasks.cleanup_accounts
+EMAIL_VALIDATION_EXPIRY = timedelta(weeks=2)
 
 # EMAIL
 EMAIL_TEST = str(os.environ.get('EMAIL_TEST')).lower() == 'true'
@@ -214,6 +231,11 @@ EMAIL_USE_TLS = str(os.environ.get('EMAIL_USE_TLS')).lower() == "true"
 EMAIL_USE_SSL = str(os.environ.get('EMAIL_USE_SSL')).lower() == "true"
 DEFAULT_FROM_EMAIL = str(os.environ.get('DEFAULT_FROM_EMAIL'))
 DEFAULT_NOTIFICATION_EMAIL = str(os.environ.get('DEFAULT_NOTIFICATION_EMAIL'))
+# mails are queued in base.models.OutgoingMail and sent by celery in batches over one connection (base.outbox)
+MAIL_OUTBOX_BATCH_SIZE = 50
+# a mail is retried with an exponential backoff starting at MAIL_OUTBOX_RETRY_DELAY, after MAIL_OUTBOX_MAX_ATTEMPTS it is marked failed
+MAIL_OUTBOX_MAX_ATTEMPTS = 6
+MAIL_OUTBOX_RETRY_DELAY = timedelta(minutes=1)
 
 
 # Settings for appointments
@@ -229,9 +251,58 @@ DEFAULT_RETURNING_END_HOUR = 12
 diff_in_days = 0
 DEFAULT_OFFSET_BETWEEN_RENTALS = timedelta(days=diff_in_days)
 
+# materialized availability per type and day (base.occupancy). run `python manage.py rebuild_occupancy` once after enabling it
+DAILY_OCCUPANCY_ENABLED = str(os.environ.get('DAILY_OCCUPANCY_ENABLED')).lower() == 'true'
+DAILY_OCCUPANCY_PAST_DAYS = 31
+DAILY_OCCUPANCY_FUTURE_DAYS = 365
+
 EMAIL_VALIDATION_REGEX = '\\S+@([a-zA-Z0-9]+\\.)?rwth-aachen\\.de'
 
 # celery broker and result
 CELERY_BROKER_URL = os.environ.get("BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get(
     "RESULT_BACKEND", "redis://redis:6379/0")
+
+# shared cache of all workers, used for the catalog endpoints (api.cache). a separate db than celery so flushing it keeps the queue
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get("CACHE_URL", "redis://redis:6379/1"),
+    }
+}
+# set CATALOG_CACHE_DISABLED=true to answer every catalog request from the database
+CATALOG_CACHE_ENABLED = str(os.environ.get('CATALOG_CACHE_DISABLED')).lower() != 'true'
+# changes are invalidated by signals, the timeout only limits stale entries if an invalidation could not reach redis
+CATALOG_CACHE_TIMEOUT = 60 * 60
+# seconds a worker uses its loaded Settings rows (base.config) before it checks the cache for changes of other workers
+CONFIG_CHECK_INTERVAL = 1
+
+# per request query count, sql, serializer and view time as Server-Timing header and log line (backend.instrumentation).
+# serializer time is measured for the viewsets with InstrumentedViewMixin, nothing is patched globally
+REQUEST_INSTRUMENTATION_ENABLED = str(os.environ.get('REQUEST_INSTRUMENTATION_ENABLED')).lower() == 'true'
+# number of the slowest statements in the log line
+REQUEST_INSTRUMENTATION_SLOWEST = 3
+# (max queries, max milliseconds) per url name, requests above are logged as warning
+REQUEST_BUDGETS = {
+    'default': (30, 500),
+    'rentalobjecttype-available-objects': (20, 300),
+    'rentalobjecttype-list': (10, 300),
+    'rental-list': (20, 500),
+    'reservation-list': (20, 500),
+    'onpremiseworkplace-get-slots': (10, 300),
+}
+
+# prometheus metrics at /metrics (base.metrics), aggregated in redis so every gunicorn worker and celery add to the same numbers.
+# opt-in, the endpoint answers 404 otherwise
+METRICS_ENABLED = str(os.environ.get('METRICS_ENABLED')).lower() == 'true'
+METRICS_URL = os.environ.get("METRICS_URL", os.environ.get("CACHE_URL", "redis://redis:6379/1"))
+# if set, the scraper has to send it as bearer token
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# celery queues whose length is reported
+METRICS_CELERY_QUEUES = ['celery']
+
+# gzip or brotli (if the brotli package is installed) for responses of at least RESPONSE_COMPRESSION_MIN_SIZE bytes (backend.compression)
+RESPONSE_COMPRESSION_ENABLED = str(os.environ.get('RESPONSE_COMPRESSION_DISABLED')).lower() != 'true'
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+# 0-11, higher levels compress little better but a lot slower
+RESPONSE_COMPRESSION_BROTLI_QUALITY = 5
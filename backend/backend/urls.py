@@ -18,9 +18,11 @@ from django.urls import include,path, re_path
 from django.conf.urls.static import static 
 from django.conf import settings
 from django.views.static import serve
+from api.views import prometheusMetrics
 
 urlpatterns = [
     path('api/', include('api.urls')),
     path('django-admin/', admin.site.urls),
+    path('metrics', prometheusMetrics, name='metrics'),
     re_path(r'^media/(?P<path>.*)$', serve, kwargs={'document_root': settings.MEDIA_ROOT})
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
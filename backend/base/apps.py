@@ -100,10 +100,18 @@ def populate_models(sender:AppConfig, **kwargs)-> None:
         logger.info(f"creating lenting_day with {settings.DEFAULT_LENTING_DAY_OF_WEEK} in db")
         PeriodicTask.objects.create(name="Send Notifications about rentals and reservations", task="base.tasks.notify_about_rentals_and_reservations", args=[], kwargs={}, enabled=True, interval_id=IntervalSchedule.objects.get_or_create(every=30, period="minutes")[0].pk)
 
+    if not PeriodicTask.objects.filter(task="base.tasks.rebuild_occupancy").exists():
+        logger.info(f"creating rebuild_occupancy task in db")
+        PeriodicTask.objects.create(name="Move the materialized occupancy window forward", task="base.tasks.rebuild_occupancy", args=[], kwargs={}, enabled=True, interval_id=IntervalSchedule.objects.get_or_create(every=1, period="days")[0].pk)
+
     if not PeriodicTask.objects.filter(task="base.tasks.cleanup_accounts").exists():
         logger.info(f"creating lenting_day with {settings.DEFAULT_LENTING_DAY_OF_WEEK} in db")
         PeriodicTask.objects.create(name="Delete created, but never activated accounts", task="base.tasks.cleanup_accounts", args=[], kwargs={}, enabled=True, interval_id=IntervalSchedule.objects.get_or_create(every=1, period="days")[0].pk)
 
+    if not PeriodicTask.objects.filter(task="base.tasks.send_outbox").exists():
+        logger.info(f"creating send_outbox task in db")
+        PeriodicTask.objects.create(name="Send queued and retried mails of the outbox", task="base.tasks.send_outbox", args=[], kwargs={}, enabled=True, interval_id=IntervalSchedule.objects.get_or_create(every=1, period="minutes")[0].pk)
+
 
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -115,5 +123,7 @@ class BaseConfig(AppConfig):
         """
         # deprecated
         post_migrate.connect(populate_models, sender=self)
+        # keeps the DailyOccupancy rows and the loaded settings (base.config) up to date
+        from base import signals
 
     
\ No newline at end of file
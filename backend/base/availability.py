@@ -0,0 +1,197 @@
+"""
+Availability engine for RentalObjectTypes.
+
+Every reservation and rental of a type is turned into a blocked interval [start, end) with a number of blocked units.
+Instead of scanning every interval for every requested day, the intervals are written into a difference array once and
+the blocked units per day are the running sum over that array. The cost is O(days + intervals) instead of O(days * units).
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Tuple, Union
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+import logging
+
+from base import metrics
+
+logger = logging.getLogger(name="django")
+
+# (first blocked day, first free day again, number of blocked units)
+BlockedInterval = Tuple[date, date, int]
+
+
+def normalize_range(from_date: Union[date, datetime], until_date: Union[date, datetime]) -> Tuple[date, date]:
+    """
+    both dates are rounded down to the start of the day in the current timezone, like the api always did
+    """
+    from_date = datetime.combine(
+        from_date, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+    until_date = datetime.combine(
+        until_date, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+    return from_date.date(), until_date.date()
+
+
+def blocked_end(until_date: date) -> date:
+    """
+    first day an object is free again after a reservation or rental ending on until_date.
+
+    NOTE the old per day loop also calculated the next lenting day after until_date + offset, but never used it for the
+    comparison, so it had no effect on the result. we keep it that way, objects are blocked until until_date + offset.
+    """
+    return until_date + settings.DEFAULT_OFFSET_BETWEEN_RENTALS
+
+
+def blocked_per_day(intervals: Iterable[BlockedInterval], first_day: date, last_day: date) -> List[int]:
+    """
+    sweep over all intervals and return the number of blocked units for every day between first_day and last_day (both included)
+    """
+    days = (last_day - first_day).days + 1
+    if days <= 0:
+        return []
+    diff = [0] * (days + 1)
+    for start, end, units in intervals:
+        start_index = max((start - first_day).days, 0)
+        end_index = min((end - first_day).days, days)
+        if start_index >= end_index:
+            continue
+        diff[start_index] += units
+        diff[end_index] -= units
+    blocked = []
+    running = 0
+    for day_index in range(days):
+        running += diff[day_index]
+        blocked.append(running)
+    return blocked
+
+
+def summarize(capacity: int, blocked: List[int], first_day: date) -> Dict[str, int]:
+    """
+    build the availability dict the api returns: {'YYYY-MM-DD': free objects on that day, ..., 'available': free objects over the whole range}
+    """
+    ret = {}
+    for day_index, blocked_units in enumerate(blocked):
+        ret[str(first_day + timedelta(days=day_index))] = capacity - blocked_units
+    ret['available'] = capacity - max(blocked, default=0)
+    return ret
+
+
+def midnight(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+
+
+class Inventory:
+    """
+    all rows the availability of some types between first_day and last_day depends on, loaded with four grouped queries.
+    answers availability questions for any range between those days without touching the database again, e.g. the
+    extendability of every rental in a list.
+    """
+
+    def __init__(self, pks: Iterable[int], first_day: date, last_day: date) -> None:
+        from base import models
+        self.pks = [int(getattr(pk, 'pk', pk)) for pk in pks]
+        self.first_day = first_day
+        self.last_day = last_day
+        offset = settings.DEFAULT_OFFSET_BETWEEN_RENTALS
+
+        self.objects = {pk: [] for pk in self.pks}
+        for object_pk, type_pk in models.RentalObject.objects.filter(type__in=self.pks, rentable=True).values_list('pk', 'type'):
+            self.objects[type_pk].append(object_pk)
+
+        # "defect" status of each object
+        self.status = {}
+        for object_pk, from_date, until_date in models.RentalObjectStatus.objects.filter(
+                rental_object__type__in=self.pks, rentable=False, from_date__lte=last_day, until_date__gte=first_day).values_list(
+                'rental_object', 'from_date', 'until_date'):
+            self.status.setdefault(object_pk, []).append((from_date, until_date))
+
+        # reservations that already got a rental are counted through their rentals, canceled reservations do not block anything
+        self.reservations = {pk: [] for pk in self.pks}
+        for type_pk, reserved_from, reserved_until, count in models.Reservation.objects.filter(
+                objecttype_id__in=self.pks, reserved_from__lte=last_day, reserved_until__gte=first_day, canceled__isnull=True).exclude(
+                Exists(models.Rental.objects.filter(reservation=OuterRef('pk'), rented_object__type=OuterRef('objecttype')))).values_list(
+                'objecttype_id', 'reserved_from', 'reserved_until', 'count'):
+            self.reservations[type_pk].append((reserved_from, reserved_until, count))
+
+        # rentals ending before first_day - offset can not block any of the days
+        self.rentals = {pk: [] for pk in self.pks}
+        for type_pk, object_pk, handed_out_at, current_until in models.Rental.objects.filter(
+                rented_object__type__in=self.pks, rented_object__rentable=True, handed_out_at__lte=midnight(last_day),
+                current_until__lte=last_day, current_until__gt=first_day - offset).values_list(
+                'rented_object__type_id', 'rented_object', 'handed_out_at', 'current_until'):
+            self.rentals[type_pk].append((object_pk, handed_out_at, current_until))
+
+    def rentable_objects(self, pk: int, from_day: date, until_day: date) -> List[int]:
+        """
+        all rentable objects of a type without a "defect" status somewhere in the range
+        """
+        return [object_pk for object_pk in self.objects[pk] if not any(
+            from_date <= until_day and until_date >= from_day for from_date, until_date in self.status.get(object_pk, []))]
+
+    def blocked_intervals(self, pk: int, objects: Iterable[int], from_day: date, until_day: date) -> List[BlockedInterval]:
+        """
+        the blocked intervals of all reservations and rentals of a type that touch the range
+        """
+        objects = set(objects)
+        intervals = [(reserved_from, blocked_end(reserved_until), count) for reserved_from, reserved_until, count in self.reservations[pk]
+                     if reserved_from <= until_day and reserved_until >= from_day]
+        intervals += [(handed_out_at.date(), blocked_end(current_until), 1) for object_pk, handed_out_at, current_until in self.rentals[pk]
+                      if object_pk in objects and handed_out_at <= midnight(until_day) and current_until <= from_day]
+        return intervals
+
+    def available(self, pk: int, from_date: Union[date, datetime], until_date: Union[date, datetime]) -> Dict[str, int]:
+        """
+        same result as RentalObjectType.available, the range has to be between first_day and last_day
+        """
+        pk = int(getattr(pk, 'pk', pk))
+        from_day, until_day = normalize_range(from_date, until_date)
+        if from_day <= until_day and (from_day < self.first_day or until_day > self.last_day):
+            raise ValueError(f"{from_day} - {until_day} is not inside the loaded range {self.first_day} - {self.last_day}")
+        objects = self.rentable_objects(pk, from_day, until_day)
+        intervals = self.blocked_intervals(pk, objects, from_day, until_day)
+        return summarize(len(objects), blocked_per_day(intervals, from_day, until_day), from_day)
+
+
+def available_for_types(pks: Iterable[int], from_date: Union[date, datetime], until_date: Union[date, datetime], live: bool = False) -> Dict[int, Dict[str, int]]:
+    """
+    calculates the availability of many types at once. objects, status, reservations and rentals of all types are
+    fetched in four grouped queries, no matter how many types are requested. returns {type pk: availability dict}
+    if settings.DAILY_OCCUPANCY_ENABLED is set, single day requests are read from the materialized rows of base.occupancy.
+    a range can not be put together from those rows, e.g. an object with a defect on one day of the range is missing for the
+    whole range, so ranges are always calculated. live=True always calculates from the rows, the materialized ones are only
+    refreshed after the commit of a change, so everything validating a write has to use it
+    """
+    pks = [int(getattr(pk, 'pk', pk)) for pk in pks]
+    from_day, until_day = normalize_range(from_date, until_date)
+    ret = {}
+    if settings.DAILY_OCCUPANCY_ENABLED and not live and from_day == until_day:
+        from base import occupancy
+        ret = occupancy.available_for_types(pks, from_day, until_day)
+        pks = [pk for pk in pks if pk not in ret]
+    if len(pks) > 0:
+        inventory = Inventory(pks, from_day, until_day)
+        for pk in pks:
+            ret[pk] = inventory.available(pk, from_day, until_day)
+    metrics.record(counters=[('availability_computations_total', {'source': source}, count)
+                             for source, count in [('materialized', len(ret) - len(pks)), ('live', len(pks))] if count > 0])
+    return ret
+
+
+def available(pk: int, from_date: Union[date, datetime], until_date: Union[date, datetime], live: bool = False) -> Dict[str, int]:
+    """
+    calculates how many objects of a type are free on each day between from_date and until_date and over the whole range
+    """
+    pk = int(getattr(pk, 'pk', pk))
+    return available_for_types([pk], from_date, until_date, live=live)[pk]
+
+
+def lock_types(pks: Iterable[int]) -> None:
+    """
+    lock the rows of the given types until the end of the current transaction (select for update), so availability checks
+    and the reservations created afterwards can not interleave with other transactions booking the same types.
+    the rows are locked in pk order, two carts with the same types can not deadlock
+    """
+    from base import models
+    list(models.RentalObjectType.objects.select_for_update().filter(
+        pk__in=[int(getattr(pk, 'pk', pk)) for pk in pks]).order_by('pk').values_list('pk', flat=True))
@@ -0,0 +1,112 @@
+"""
+Validation of a whole reservation cart, see ReservationViewSet.bulk_create.
+
+Everything the items need is loaded up front with a fixed number of queries, no matter how many items the cart holds:
+the types, the open reservations of the reserver the items are merged into and the availability, which is calculated
+once per distinct date range for all types of that range. The max rent durations come from the matrix in base.durations.
+Items asking for the same type and range are checked against the availability together, so a cart can not reserve an
+object twice.
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from base import availability
+from base import config
+from base import durations
+
+import logging
+
+logger = logging.getLogger(name="django")
+
+
+class Cart:
+    """
+    the validated items of a cart. items is the posted list of {objecttype, count, reserved_from, reserved_until}
+    """
+
+    def __init__(self, items: List[dict], profile) -> None:
+        self.items = items
+        self.profile = profile
+        # (type pk, reserved_from, reserved_until, count) per item, None if the item could not be parsed
+        self.parsed: List[Optional[Tuple[int, date, date, int]]] = [self.parse(item) for item in items]
+        self.errors: List[Optional[str]] = []
+        # the open reservation every item is merged into, if there is one
+        self.merge_into: Dict[Tuple[int, date, date], object] = {}
+        self.types = {}
+
+    def parse(self, item: dict) -> Optional[Tuple[int, date, date, int]]:
+        try:
+            return (int(item['objecttype']), date.fromisoformat(str(item['reserved_from'])[:10]),
+                    date.fromisoformat(str(item['reserved_until'])[:10]), int(item['count']))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def type_pks(self) -> set:
+        """
+        the types of all items that could be parsed
+        """
+        return {parsed[0] for parsed in self.parsed if parsed is not None}
+
+    def validate(self) -> List[Optional[str]]:
+        """
+        returns one error message or None per item. every call checks the items again
+        """
+        from base import models
+        self.errors = []
+        self.merge_into = {}
+        type_pks = self.type_pks()
+        self.types = models.RentalObjectType.objects.in_bulk(type_pks)
+        max_durations = durations.for_types(self.types.keys(), self.profile.prio)
+        lenting_day, returning_day = config.integer('lenting_day'), config.integer('returning_day')
+
+        # reservations without rentals of the same type and range are extended by the item instead of creating a new one
+        ranges = {(pk, reserved_from, reserved_until) for pk, reserved_from, reserved_until, _ in filter(None, self.parsed)}
+        for reservation in models.Reservation.objects.filter(
+                reserver=self.profile, objecttype__in=type_pks, canceled__isnull=True, rental__isnull=True,
+                reserved_from__in={reserved_from for _, reserved_from, _ in ranges}).order_by('pk'):
+            key = (reservation.objecttype_id, reservation.reserved_from, reservation.reserved_until)
+            if key in ranges:
+                self.merge_into.setdefault(key, reservation)
+
+        # availability once per distinct range for all types of that range
+        types_per_range = {}
+        for pk, reserved_from, reserved_until in ranges:
+            if pk in self.types and reserved_from < reserved_until:
+                types_per_range.setdefault((reserved_from, reserved_until), set()).add(pk)
+        available = {}
+        for (reserved_from, reserved_until), pks in types_per_range.items():
+            for pk, result in availability.available_for_types(pks, reserved_from, reserved_until, live=True).items():
+                available[(pk, reserved_from, reserved_until)] = result['available']
+        requested = {}
+        for parsed in filter(None, self.parsed):
+            requested[parsed[:3]] = requested.get(parsed[:3], 0) + parsed[3]
+
+        # type pk: range of the new reservation, every new reservation of the cart gets the same operation number
+        new_types = {}
+        for parsed in self.parsed:
+            if parsed is None:
+                self.errors.append("objecttype, count, reserved_from and reserved_until are required")
+                continue
+            pk, reserved_from, reserved_until, count = parsed
+            if pk not in self.types:
+                self.errors.append(f"Invalid pk \"{pk}\" - object does not exist.")
+            elif max_durations[pk] is not None and max_durations[pk] + timedelta(days=7) < reserved_until - reserved_from:
+                self.errors.append("the rent duration exceeds max_rent_duration.")
+            elif reserved_from.isoweekday() != lenting_day:
+                self.errors.append("this day is not a lenting day therefore a reservation can not start here")
+            elif reserved_until.isoweekday() != returning_day:
+                self.errors.append("this day is not a returning day therefore a reservation can not end here")
+            elif reserved_from >= reserved_until:
+                self.errors.append("reserved_from must be before reserved_until")
+            elif count <= 0 or requested[parsed[:3]] > available[parsed[:3]]:
+                self.errors.append("There are not enough objects of this type to fullfill your reservation")
+            elif parsed[:3] not in self.merge_into and new_types.get(pk, parsed[:3]) != parsed[:3]:
+                self.errors.append("This Combination of reserver, operation_number and object_type already exists")
+            else:
+                self.errors.append(None)
+                if parsed[:3] not in self.merge_into:
+                    new_types[pk] = parsed[:3]
+        return self.errors
+
+    def is_valid(self) -> bool:
+        return not any(self.validate())
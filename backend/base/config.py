@@ -0,0 +1,56 @@
+"""
+Typed, process-local access to the Settings rows, e.g. config.integer('lenting_day') or config.weekdays('onpremise_weekdays').
+
+All rows are loaded with one query and kept in the process by a base.localcache.VersionedLocalCache, saving or deleting a
+Settings row makes every worker load them again.
+"""
+from datetime import time, timedelta
+from typing import Dict, List
+
+from base.localcache import VersionedLocalCache
+
+
+def _rows() -> Dict[str, str]:
+    from base import models
+    return dict(models.Settings.objects.values_list('type', 'value'))
+
+
+local_cache: VersionedLocalCache[Dict[str, str]] = VersionedLocalCache("config:settings:version", _rows)
+
+
+def value(setting_type: str) -> str:
+    """
+    the raw value, raises Settings.DoesNotExist like Settings.objects.get if there is no such row
+    """
+    values = local_cache.get()
+    if setting_type not in values:
+        from base import models
+        raise models.Settings.DoesNotExist(f"Settings matching type {setting_type} does not exist.")
+    return values[setting_type]
+
+
+def integer(setting_type: str) -> int:
+    return int(value(setting_type).replace(' ', ''))
+
+
+def boolean(setting_type: str) -> bool:
+    return value(setting_type).strip().lower() == 'true'
+
+
+def minutes(setting_type: str) -> timedelta:
+    return timedelta(minutes=integer(setting_type))
+
+
+def time_of_day(setting_type: str) -> time:
+    """
+    values like 10:30 or only the hour like 18
+    """
+    parts = value(setting_type).replace(' ', '').split(':')
+    return time(hour=int(parts[0]), minute=int(parts[1]) if len(parts) > 1 else 0)
+
+
+def weekdays(setting_type: str) -> List[int]:
+    """
+    comma separated iso weekdays like 1,2,3,4,5
+    """
+    return [int(day) for day in value(setting_type).replace(' ', '').split(',') if day != '']
@@ -0,0 +1,65 @@
+"""
+Resolved max rent durations per (priority, rental object type), e.g. durations.resolve(type_pk, request.user.profile.prio).
+
+The MaxRentDuration and Priority rows are loaded with two queries and every combination is resolved once with the rules of
+RentalObjectType.max_rent_duration: the duration of the priority itself, else the one of the next lower priority (the
+next higher prio value). The matrix is kept in the process by a base.localcache.VersionedLocalCache like the rows of
+base.config, saving or deleting a MaxRentDuration or Priority makes every worker rebuild it.
+"""
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from base.localcache import VersionedLocalCache
+
+# used if there is no duration for the priority or a lower one
+DEFAULT_DURATION = timedelta(weeks=1)
+
+
+def build() -> Dict[Tuple[int, int], Tuple[int, int, timedelta]]:
+    """
+    resolve every (priority, type) combination that has a duration for the priority itself or a lower one
+    """
+    from base import models
+    priorities = dict(models.Priority.objects.values_list('pk', 'prio'))
+    rows = {}
+    for pk, prio_pk, type_pk, duration in models.MaxRentDuration.objects.order_by('pk').values_list(
+            'pk', 'prio', 'rental_object_type', 'duration'):
+        rows.setdefault(type_pk, []).append((pk, prio_pk, duration))
+    matrix = {}
+    for priority_pk, prio in priorities.items():
+        for type_pk, type_rows in rows.items():
+            own = [row for row in type_rows if row[1] == priority_pk]
+            lower = sorted((priorities[row[1]], row) for row in type_rows if priorities[row[1]] > prio)
+            if own:
+                matrix[(priority_pk, type_pk)] = own[0]
+            elif lower:
+                matrix[(priority_pk, type_pk)] = lower[0][1]
+    return matrix
+
+
+# (priority pk, type pk): (MaxRentDuration pk, priority pk of the row, duration)
+local_cache: VersionedLocalCache[Dict[Tuple[int, int], Tuple[int, int, timedelta]]] = VersionedLocalCache("durations:version", build)
+
+
+def resolve(type_pk: int, priority):
+    """
+    the MaxRentDuration that applies to the type for the priority (not fetched from the database, the relations are only set
+    by pk) or None if neither the priority nor a lower one has a duration for the type
+    """
+    from base import models
+    row = local_cache.get().get((getattr(priority, 'pk', priority), int(getattr(type_pk, 'pk', type_pk))))
+    if row is None:
+        return None
+    pk, prio_pk, duration = row
+    return models.MaxRentDuration(pk=pk, prio_id=prio_pk, rental_object_type_id=int(getattr(type_pk, 'pk', type_pk)), duration=duration)
+
+
+def for_types(type_pks: Iterable[int], priority) -> Dict[int, Optional[timedelta]]:
+    """
+    the resolved duration of every type for the priority, None if there is none
+    """
+    ret = {}
+    for pk in type_pks:
+        instance = resolve(pk, priority)
+        ret[int(getattr(pk, 'pk', pk))] = instance.duration if instance is not None else None
+    return ret
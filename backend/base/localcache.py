@@ -0,0 +1,67 @@
+"""
+Process-local copies of rarely changing rows, shared by base.config, base.texts and base.durations.
+
+The value is built once per process by a loader, e.g. all Settings rows with one query. Instead of reading the rows again,
+every gunicorn and celery worker only checks a version number in the shared cache (redis), at most every
+settings.CONFIG_CHECK_INTERVAL seconds, and loads the value again if it changed. Saving or deleting one of the rows bumps
+the version, base.signals connects invalidate_on_commit to the models of every cache.
+"""
+import logging
+import time
+from typing import Callable, Generic, TypeVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(name="django")
+
+T = TypeVar('T')
+
+
+class VersionedLocalCache(Generic[T]):
+
+    def __init__(self, key: str, loader: Callable[[], T]) -> None:
+        self.key = key
+        self.loader = loader
+        self._value = None
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+
+    def _shared_version(self):
+        try:
+            return cache.get_or_set(self.key, 1, timeout=None)
+        except Exception:
+            # without redis changes of other workers are not noticed, the local value is used until the next check
+            logger.exception(f"could not read {self.key} from the cache")
+            return self._version
+
+    def get(self) -> T:
+        now = time.monotonic()
+        if not self._loaded or now - self._checked_at >= settings.CONFIG_CHECK_INTERVAL:
+            version = self._shared_version()
+            if not self._loaded or version != self._version:
+                self._value = self.loader()
+                self._loaded = True
+                self._version = version
+            self._checked_at = now
+        return self._value
+
+    def invalidate(self) -> None:
+        """
+        load the value in this process again with the next access and tell every other worker to do the same
+        """
+        self._value = None
+        self._loaded = False
+        try:
+            cache.add(self.key, 1, timeout=None)
+            cache.incr(self.key)
+        except Exception:
+            logger.exception(f"could not increment {self.key} for the other workers")
+
+    def invalidate_on_commit(self, sender=None, **kwargs) -> None:
+        """
+        receiver of post_save and post_delete, the other workers can only load the change once it is committed
+        """
+        transaction.on_commit(self.invalidate)
@@ -0,0 +1,102 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.renderers import FastJSONRenderer
+from base import config
+from base.management.commands.run_benchmarks import Rollback, measure
+from base.management.commands.seed_benchmark_data import PREFIX, SCALES, weekdays_between
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = ("Seeds benchmark data and compares the render time of DRF's JSONRenderer and the orjson renderer and the size "
+            "of the raw, gzip and brotli compressed json on the largest responses. the data is rolled back afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES.keys(), default='medium')
+        parser.add_argument('--repeat', type=int, default=20, help="renders per payload, median, min and max are reported")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="write the results to this json file instead of stdout")
+
+    def handle(self, *args, **options):
+        results = {}
+        with override_settings(CATALOG_CACHE_ENABLED=False, ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            try:
+                with transaction.atomic():
+                    call_command('seed_benchmark_data', scale=options['scale'], seed=options['seed'], stdout=self.stderr)
+                    for name, data in self.payloads().items():
+                        results[name] = self.compare(data, options['repeat'])
+                        self.stderr.write(f"{name}: {results[name]}")
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+            self.stdout.write(self.style.SUCCESS(f"wrote results to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def payloads(self) -> dict:
+        """
+        the serialized data of the responses, before rendering
+        """
+        lender = User.objects.filter(username__startswith=PREFIX, username__endswith='_lender').order_by('-pk').first()
+        if lender is None:
+            raise CommandError("the benchmark data needs a lender")
+        staff = APIClient()
+        staff.force_authenticate(lender)
+        today = timezone.localdate()
+        lenting_day = next(weekdays_between(today + timedelta(days=1), today + timedelta(weeks=1), config.integer('lenting_day')))
+        until = lenting_day + timedelta(weeks=4)
+
+        requests = {
+            'available_objects': ('/api/rentalobjecttypes/available/', {'from_date': str(lenting_day), 'until_date': str(until)}),
+            'rentalobjecttypes_list': ('/api/rentalobjecttypes/', {}),
+            'rentals_list': ('/api/rentals/', {}),
+            'reservations_list': ('/api/reservations/', {}),
+        }
+        ret = {}
+        for name, (path, params) in requests.items():
+            response = staff.get(path, params)
+            if response.status_code != 200:
+                raise CommandError(f"{path} answered with {response.status_code}")
+            ret[name] = response.data
+        return ret
+
+    def compare(self, data, repeat: int) -> dict:
+        drf, fast = JSONRenderer(), FastJSONRenderer()
+        rendered = drf.render(data)
+        compressions = {'gzip': compress_string}
+        if brotli is not None:
+            compressions['br'] = lambda content: brotli.compress(content, quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)
+        ret = {'bytes': len(rendered),
+               # the orjson renderer has to be a drop-in replacement, the same json value as DRF's
+               'identical': json.loads(fast.render(data)) == json.loads(rendered)}
+        for name, renderer in [('drf', drf), ('orjson', fast)]:
+            ret[name] = measure(lambda: renderer.render(data), repeat)
+        for name, compress in compressions.items():
+            ret[name] = measure(lambda: compress(rendered), repeat)
+        for name in ['drf', 'orjson', *compressions]:
+            # rendering and compressing run no queries, the status is the output
+            ret[name].pop('queries')
+            ret[name]['bytes'] = len(ret[name].pop('status'))
+        ret['speedup'] = round(ret['drf']['median_ms'] / ret['orjson']['median_ms'], 2) if ret['orjson']['median_ms'] > 0 else None
+        return ret
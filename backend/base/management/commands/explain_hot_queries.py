@@ -0,0 +1,70 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from base import models
+from base.management.commands.run_benchmarks import Rollback
+from base.management.commands.seed_benchmark_data import PREFIX, SCALES
+
+
+class Command(BaseCommand):
+    help = ("Seeds benchmark data, prints the query plans (EXPLAIN ANALYZE on postgres) of the hot queries and which indexes "
+            "they use. the data is rolled back afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES.keys(), default='medium')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--verbose-plans', action='store_true', help="print the whole plans, not only the used indexes")
+
+    def handle(self, *args, **options):
+        indexes = {index.name for model in [models.Reservation, models.Rental, models.RentalObjectStatus,
+                                            models.OnPremiseBooking, models.OnPremiseWorkplaceStatus] for index in model._meta.indexes}
+        try:
+            with transaction.atomic():
+                call_command('seed_benchmark_data', scale=options['scale'], seed=options['seed'], stdout=self.stderr)
+                if connection.vendor == 'postgresql':
+                    # fresh statistics, otherwise the planner does not know the seeded rows
+                    with connection.cursor() as cursor:
+                        cursor.execute("ANALYZE")
+                for name, queryset in self.hot_queries().items():
+                    plan = queryset.explain(analyze=True) if connection.vendor == 'postgresql' else queryset.explain()
+                    used = sorted(index for index in indexes if re.search(rf'\b{index}\b', plan))
+                    self.stdout.write(self.style.SUCCESS(f"{name}: ") + (", ".join(used) if used else "no hot path index"))
+                    if options['verbose_plans']:
+                        self.stdout.write(plan + "\n")
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def hot_queries(self) -> dict:
+        """
+        the same filters as the code paths named in the index comments of base.models
+        """
+        today = timezone.localdate()
+        first, last = today, today + timedelta(weeks=4)
+        now = timezone.now()
+        types = list(models.RentalObjectType.objects.filter(name__startswith=PREFIX).values_list('pk', flat=True)[:10])
+        workplaces = list(models.OnPremiseWorkplace.objects.filter(name__startswith=PREFIX).values_list('pk', flat=True))
+        return {
+            'inventory reservations': models.Reservation.objects.filter(
+                objecttype_id__in=types, reserved_from__lte=last, reserved_until__gte=first, canceled__isnull=True),
+            'inventory rentals': models.Rental.objects.filter(
+                rented_object__type__in=types, rented_object__rentable=True, handed_out_at__lte=now,
+                current_until__lte=last, current_until__gt=first - settings.DEFAULT_OFFSET_BETWEEN_RENTALS),
+            'inventory status': models.RentalObjectStatus.objects.filter(
+                rental_object__type__in=types, rentable=False, from_date__lte=last, until_date__gte=first),
+            'currently free objects': models.RentalObject.currently_free(models.RentalObject.objects.filter(type__in=types)),
+            'notification reservations': models.Reservation.objects.filter(
+                reserved_from__lte=today + timedelta(days=1), reserved_from__gte=today, canceled__isnull=True, notified__isnull=True),
+            'notification rentals': models.Rental.objects.filter(
+                received_back_at__isnull=True, notified__isnull=True, current_until=today + timedelta(days=2)),
+            'slot bookings': models.OnPremiseBooking.objects.filter(
+                workplace__in=workplaces, slot_start__lte=now + timedelta(days=14), slot_end__gte=now),
+            'slot workplace status': models.OnPremiseWorkplaceStatus.objects.filter(
+                workplace__in=workplaces, from_date__lte=now + timedelta(days=14), until_date__gte=now),
+        }
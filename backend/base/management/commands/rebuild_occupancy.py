@@ -0,0 +1,56 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from base import models
+from base import occupancy
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the DailyOccupancy rows or checks them for drift against a fresh calculation and for parity with the live "
+            "availability calculation")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="only compare the stored rows with a fresh calculation, fails if they drifted")
+        parser.add_argument('--from', dest='from_date', help="first day (YYYY-MM-DD), defaults to the start of the window")
+        parser.add_argument('--until', dest='until_date', help="last day (YYYY-MM-DD), defaults to the end of the window")
+        parser.add_argument('--types', nargs='+', type=int, help="only these RentalObjectType ids")
+        parser.add_argument('--ranges', type=int, default=50, help="random ranges compared with the live calculation by --check")
+        parser.add_argument('--seed', type=int, help="seed of the random ranges")
+
+    def handle(self, *args, **options):
+        window_start, window_end = occupancy.window()
+        first_day, last_day = window_start, window_end
+        # rows outside of the window are neither written nor maintained
+        if options['from_date']:
+            first_day = max(datetime.strptime(options['from_date'], "%Y-%m-%d").date(), window_start)
+        if options['until_date']:
+            last_day = min(datetime.strptime(options['until_date'], "%Y-%m-%d").date(), window_end)
+        types = models.RentalObjectType.objects.all()
+        if options['types']:
+            types = types.filter(pk__in=options['types'])
+        pks = list(types.values_list('pk', flat=True))
+
+        if options['check']:
+            drift = occupancy.check(pks, first_day, last_day)
+            for pk, day, stored, expected in drift[:50]:
+                self.stdout.write(
+                    f"type {pk} {day}: stored (rentable, blocked) {stored}, expected {expected}")
+            if len(drift) > 0:
+                raise CommandError(f"{len(drift)} occupancy rows drifted between {first_day} and {last_day}")
+            differences = occupancy.parity(pks, first_day, last_day, options['ranges'], options['seed'])
+            for pk, from_day, until_day, read, live in differences[:50]:
+                self.stdout.write(f"type {pk} {from_day} - {until_day}: read available {read}, live {live}")
+            if len(differences) > 0:
+                raise CommandError(f"{len(differences)} availabilities differ from the live calculation between {first_day} and {last_day}")
+            self.stdout.write(self.style.SUCCESS(
+                f"no drift and no difference to the live calculation for {len(pks)} types between {first_day} and {last_day}"))
+            return
+
+        with transaction.atomic():
+            models.DailyOccupancy.objects.filter(date__lt=window_start).delete()
+            written = occupancy.refresh(pks, first_day, last_day)
+        self.stdout.write(self.style.SUCCESS(
+            f"wrote {written} occupancy rows for {len(pks)} types between {first_day} and {last_day}"))
@@ -0,0 +1,179 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from base import availability
+from base import config
+from base import models
+from base import tasks
+from base.management.commands.seed_benchmark_data import PREFIX, SCALES, weekdays_between
+
+
+class Rollback(Exception):
+    """
+    raised to roll back the data of a benchmark scale
+    """
+
+
+def measure(function, repeat: int) -> dict:
+    """
+    run function repeat times, returns the timings in milliseconds and the queries of the last run
+    """
+    timings = []
+    for _ in range(repeat):
+        # the query log is capped, a full log would hide the queries of this run
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            status = function()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {'status': status, 'queries': len(queries), 'min_ms': round(min(timings), 3),
+            'median_ms': round(statistics.median(timings), 3), 'max_ms': round(max(timings), 3)}
+
+
+def in_savepoint(function):
+    """
+    undo the writes of function after every run, so every repetition starts with the same data
+    """
+    def run():
+        savepoint = transaction.savepoint()
+        try:
+            return function()
+        finally:
+            transaction.savepoint_rollback(savepoint)
+    return run
+
+
+class Command(BaseCommand):
+    help = ("Seeds benchmark data at several scales and times and query-counts the hot paths. the data is rolled back afterwards. "
+            "writes machine-readable json to compare versions")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', choices=SCALES.keys(), default=['small', 'medium'])
+        parser.add_argument('--repeat', type=int, default=5, help="runs per benchmark, median, min and max are reported")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="write the results to this json file instead of stdout")
+        parser.add_argument('--compare', help="json file of an earlier run, prints the change of median and queries per benchmark")
+
+    def handle(self, *args, **options):
+        results = {'meta': self.meta(options), 'scales': {}}
+        # no real mails, no cached responses, the test client host has to be allowed
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', CATALOG_CACHE_ENABLED=False,
+                               ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            for scale in options['scales']:
+                results['scales'][scale] = self.run_scale(scale, options)
+
+        output = json.dumps(results, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+            self.stdout.write(self.style.SUCCESS(f"wrote results to {options['output']}"))
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def meta(self, options) -> dict:
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR).stdout.strip()
+        except OSError:
+            commit = ''
+        return {'commit': commit, 'created': timezone.now().isoformat(), 'database': connection.vendor,
+                'python': sys.version.split()[0], 'repeat': options['repeat'], 'seed': options['seed']}
+
+    def run_scale(self, scale: str, options) -> dict:
+        ret = {}
+        try:
+            with transaction.atomic():
+                call_command('seed_benchmark_data', scale=scale, seed=options['seed'], stdout=self.stderr)
+                for name, function in self.benchmarks().items():
+                    ret[name] = measure(function, options['repeat'])
+                    self.stderr.write(f"{scale} {name}: {ret[name]}")
+                raise Rollback()
+        except Rollback:
+            pass
+        return ret
+
+    def benchmarks(self) -> dict:
+        """
+        every benchmark is a function returning a status, e.g. the http status code of the request
+        """
+        lender = User.objects.filter(username__startswith=PREFIX, username__endswith='_lender').latest('pk')
+        user = User.objects.filter(username__startswith=PREFIX, profile__isnull=False).first()
+        types = list(models.RentalObjectType.objects.filter(name__startswith=PREFIX, visible=True).values_list('pk', flat=True))
+        if len(types) == 0 or user is None:
+            raise CommandError("the benchmark data needs at least one visible type and one user")
+        workplace = models.OnPremiseWorkplace.objects.filter(name__startswith=PREFIX).first()
+        staff = APIClient(raise_request_exception=False)
+        staff.force_authenticate(lender)
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(user)
+
+        today = timezone.localdate()
+        lenting_day = next(weekdays_between(today + timedelta(days=1), today + timedelta(weeks=1), config.integer('lenting_day')))
+        returning_day = lenting_day + timedelta(weeks=1)
+        returning_day -= timedelta(days=(returning_day.isoweekday() - config.integer('returning_day')) % 7)
+        until = lenting_day + timedelta(weeks=4)
+
+        def available():
+            for pk in types[:10]:
+                models.RentalObjectType.available(pk, lenting_day, until)
+            return 200
+
+        # the task only works on reservations starting tomorrow and rentals due in two days, which depends on the weekday of the run
+        tomorrow = today + timedelta(days=1)
+        due = list(models.Reservation.objects.filter(objecttype__in=types, canceled__isnull=True, reserved_from__gt=today).values_list('pk', flat=True))
+        models.Reservation.objects.filter(pk__in=due[::10]).update(reserved_from=tomorrow)
+        due = list(models.Rental.objects.filter(rented_object__type__in=types, received_back_at__isnull=True).values_list('pk', flat=True))
+        models.Rental.objects.filter(pk__in=due[::5]).update(current_until=today + timedelta(days=2))
+
+        # a cart of three types that are still available, so bulk_create runs the whole way
+        free = availability.available_for_types(types, lenting_day, returning_day)
+        cart = [{'objecttype': pk, 'count': 1, 'reserved_from': str(lenting_day), 'reserved_until': str(returning_day)}
+                for pk in types if free[pk]['available'] > 0][:3]
+
+        def notify():
+            mail.outbox = []
+            tasks.notify_about_rentals_and_reservations()
+            return len(mail.outbox)
+
+        ret = {
+            'available_10_types': available,
+            'available_objects': lambda: client.get('/api/rentalobjecttypes/available/', {'from_date': str(lenting_day), 'until_date': str(until)}).status_code,
+            'rentalobjecttypes_list': lambda: client.get('/api/rentalobjecttypes/').status_code,
+            'rentals_list': lambda: staff.get('/api/rentals/').status_code,
+            'open_rentals_list': lambda: staff.get('/api/rentals/', {'open': 'true'}).status_code,
+            'reservations_list': lambda: staff.get('/api/reservations/').status_code,
+            'bulk_create': in_savepoint(lambda: client.post('/api/reservations/bulk/', {'data': cart}, format='json').status_code),
+            'notification_task': in_savepoint(notify),
+        }
+        if workplace is not None:
+            ret['get_slots'] = lambda: client.get(f'/api/workplace/{workplace.pk}/slots/').status_code
+        return ret
+
+    def compare(self, path: str, results: dict) -> None:
+        with open(path) as file:
+            previous = json.load(file)
+        self.stdout.write(f"compared to {previous['meta'].get('commit') or path}:")
+        for scale, benchmarks in results['scales'].items():
+            for name, result in benchmarks.items():
+                old = previous['scales'].get(scale, {}).get(name)
+                if old is None:
+                    self.stdout.write(f"  {scale} {name}: new")
+                    continue
+                ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] > 0 else float('inf')
+                self.stdout.write(f"  {scale} {name}: median {old['median_ms']} -> {result['median_ms']} ms ({ratio:.2f}x), "
+                                  f"queries {old['queries']} -> {result['queries']}")
@@ -0,0 +1,194 @@
+import random
+from datetime import date, datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from base import config
+from base import models
+from base import numbers
+from base import occupancy
+
+# everything created by this command is named with this prefix so --flush can find it again
+PREFIX = 'benchmark'
+
+SCALES = {
+    'small': {'categories': 3, 'types': 20, 'objects': 5, 'users': 50, 'reservations': 300, 'workplaces': 3, 'bookings': 100},
+    'medium': {'categories': 8, 'types': 100, 'objects': 10, 'users': 500, 'reservations': 3000, 'workplaces': 6, 'bookings': 1000},
+    'large': {'categories': 15, 'types': 400, 'objects': 20, 'users': 3000, 'reservations': 20000, 'workplaces': 10, 'bookings': 5000},
+}
+
+# texts the benchmarked paths render, only created if they do not exist yet
+TEXTS = {
+    'reservation_confirmation_mail': "Hallo, du hast {{reservations|length}} Reservierungen. Abholung {{lenting_start_hour}} - {{lenting_end_hour}} Uhr",
+    'reservation_cancel_mail': "Deine Reservierung wurde storniert",
+    'reservation_lender_notification': "{% for reservation in reservations %}{{reservation.objecttype.name}} {% endfor %}",
+    'rental_expiration_notification': "{% for rental in rentals %}{{rental.rented_object.merged_identifier}} {% endfor %} bis {{return_date_info.date}}",
+}
+
+
+def flush() -> None:
+    """
+    delete everything a previous run created, cascading to objects, reservations, rentals, extensions and bookings
+    """
+    models.RentalObjectType.objects.filter(name__startswith=PREFIX).delete()
+    models.Category.objects.filter(name__startswith=PREFIX).delete()
+    models.OnPremiseWorkplace.objects.filter(name__startswith=PREFIX).delete()
+    User.objects.filter(username__startswith=PREFIX).delete()
+
+
+def weekdays_between(first: date, last: date, isoweekday: int):
+    day = first + timedelta(days=(isoweekday - first.isoweekday()) % 7)
+    while day <= last:
+        yield day
+        day += timedelta(weeks=1)
+
+
+def at(day: date, hour: int, minute: int = 0) -> datetime:
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.get_current_timezone()).replace(hour=hour, minute=minute)
+
+
+class Command(BaseCommand):
+    help = "Creates synthetic categories, types, objects, users, reservations, rentals, extensions and workplace bookings for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES.keys(), default='small', help="preset for all volumes, single volumes can be overwritten")
+        for volume, description in [('categories', "categories"), ('types', "rental object types"), ('objects', "objects per type"),
+                                    ('users', "users with profiles"), ('reservations', "reservations, past ones get rentals and extensions"),
+                                    ('workplaces', "on premise workplaces"), ('bookings', "on premise bookings")]:
+            parser.add_argument(f'--{volume}', type=int, help=f"number of {description}")
+        parser.add_argument('--seed', type=int, default=1, help="seed of the random generator, the same seed creates the same data")
+        parser.add_argument('--flush', action='store_true', help=f"delete all data of previous runs (named {PREFIX}...) first")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        volumes = {volume: options[volume] if options[volume] is not None else default for volume, default in SCALES[options['scale']].items()}
+        rng = random.Random(options['seed'])
+        if options['flush']:
+            flush()
+        for name, content in TEXTS.items():
+            models.Text.objects.get_or_create(name=name, defaults={'content': content})
+
+        today = timezone.localdate()
+        # a run offset keeps usernames and prefix identifiers unique if the command is run several times without --flush
+        run = User.objects.filter(username__startswith=PREFIX, username__endswith='_lender').count()
+        lender = User.objects.create(username=f"{PREFIX}_{run}_lender", email=f"{PREFIX}_{run}_lender@example.com", is_staff=True)
+
+        categories = models.Category.objects.bulk_create([models.Category(
+            name=f"{PREFIX} category {run}-{index}") for index in range(volumes['categories'])])
+        types = models.RentalObjectType.objects.bulk_create([models.RentalObjectType(
+            name=f"{PREFIX} type {run}-{index}", category=rng.choice(categories), visible=rng.random() < 0.9,
+            prefix_identifier=f"B{run}T{index}") for index in range(volumes['types'])])
+        objects = models.RentalObject.objects.bulk_create([models.RentalObject(
+            type=object_type, internal_identifier=index, rentable=rng.random() < 0.95)
+            for object_type in types for index in range(volumes['objects'])], batch_size=1000)
+        objects_per_type = {object_type.pk: [rental_object for rental_object in objects if rental_object.type_id == object_type.pk and rental_object.rentable]
+                            for object_type in types}
+        # a few objects are defect for some weeks
+        models.RentalObjectStatus.objects.bulk_create([models.RentalObjectStatus(
+            rental_object=rental_object, from_date=start, until_date=start + timedelta(days=rng.randint(3, 30)))
+            for rental_object in objects if rng.random() < 0.05 for start in [today + timedelta(days=rng.randint(-60, 60))]], batch_size=1000)
+
+        priorities = list(models.Priority.objects.all())
+        users = User.objects.bulk_create([User(
+            username=f"{PREFIX}_{run}_{index}", email=f"{PREFIX}_{run}_{index}@example.com", first_name="Bench", last_name=str(index))
+            for index in range(volumes['users'])], batch_size=1000)
+        profiles = models.Profile.objects.bulk_create([models.Profile(
+            user=user, prio=rng.choice(priorities), verified=rng.random() < 0.7) for user in users], batch_size=1000)
+
+        self.reservations_and_rentals(rng, volumes['reservations'], types, objects_per_type, profiles, lender, today)
+        self.workplaces_and_bookings(rng, volumes['workplaces'], volumes['bookings'], users, today)
+
+        # bulk_create skips the signals, so the materialized occupancy is refreshed once at the end
+        occupancy.schedule_refresh([(object_type.pk, *occupancy.window()) for object_type in types])
+        self.stdout.write(self.style.SUCCESS(f"created benchmark data run {run} with " + ", ".join(
+            f"{count} {volume}" for volume, count in volumes.items())))
+
+    def reservations_and_rentals(self, rng: random.Random, count: int, types, objects_per_type, profiles, lender, today: date):
+        """
+        reservations start on lenting days and end on returning days. most of them are close to today, durations are mostly one
+        or two weeks. reservations that already started are handed out like at the counter, ended ones mostly came back.
+        """
+        lenting_day, returning_day = config.integer('lenting_day'), config.integer('returning_day')
+        lenting_hour, returning_hour = config.integer('lenting_start_hour'), config.integer('returning_start_hour')
+        lenting_days = list(weekdays_between(today - timedelta(weeks=12), today + timedelta(weeks=16), lenting_day))
+        # more reservations around today than far in the past or future
+        day_weights = [1 / (1 + abs((day - today).days) / 21) for day in lenting_days]
+        operation_numbers = numbers.next_numbers('operation_number', (count + 2) // 3)
+
+        reservations = []
+        for index in range(count):
+            reserved_from = rng.choices(lenting_days, day_weights)[0]
+            reserved_until = reserved_from + timedelta(weeks=rng.choices([1, 2, 3, 4, 6], [40, 25, 15, 12, 8])[0])
+            reserved_until -= timedelta(days=(reserved_until.isoweekday() - returning_day) % 7)
+            if reserved_until <= reserved_from:
+                reserved_until += timedelta(weeks=1)
+            reservations.append(models.Reservation(
+                reserver=rng.choice(profiles), reserved_from=reserved_from, reserved_until=reserved_until, objecttype=rng.choice(types),
+                operation_number=operation_numbers[index // 3], count=rng.choices([1, 2, 3], [70, 20, 10])[0],
+                canceled=at(reserved_from, 9) - timedelta(days=rng.randint(1, 10)) if rng.random() < 0.08 else None))
+        reservations.sort(key=lambda reservation: reservation.reserved_from)
+        reservations = models.Reservation.objects.bulk_create(reservations, batch_size=1000)
+
+        # objects are only handed out if they are back from their previous rental
+        rental_numbers = iter(numbers.next_numbers('rental_number', sum(reservation.count for reservation in reservations
+                                                                         if reservation.canceled is None and reservation.reserved_from <= today)))
+        busy_until = {}
+        rentals = []
+        extensions = []
+        for reservation in reservations:
+            if reservation.canceled is not None or reservation.reserved_from > today:
+                continue
+            free = [rental_object for rental_object in objects_per_type[reservation.objecttype_id]
+                    if busy_until.get(rental_object.pk, date.min) < reservation.reserved_from]
+            for rental_object in rng.sample(free, min(reservation.count, len(free))):
+                handed_out_at = at(reservation.reserved_from, lenting_hour, rng.randint(0, 59))
+                current_until = reservation.reserved_until
+                if rng.random() < 0.15:
+                    extended_until = current_until + timedelta(weeks=rng.randint(1, 2))
+                    extensions.append((len(rentals), models.Extension(
+                        extended_from=current_until, extended_until=extended_until, extended_at=at(current_until, 10), extended_by=lender)))
+                    current_until = extended_until
+                received_back_at = None
+                if current_until < today and rng.random() < 0.9:
+                    received_back_at = at(current_until, returning_hour, rng.randint(0, 59))
+                busy_until[rental_object.pk] = current_until if received_back_at is not None else date.max
+                rentals.append(models.Rental(
+                    rented_object=rental_object, reservation=reservation, lender=lender, rental_number=next(rental_numbers),
+                    handed_out_at=handed_out_at, received_back_at=received_back_at, return_processor=lender if received_back_at else None,
+                    current_until=current_until))
+        rentals = models.Rental.objects.bulk_create(rentals, batch_size=1000)
+        for rental_index, extension in extensions:
+            extension.extended_rental = rentals[rental_index]
+        models.Extension.objects.bulk_create([extension for _, extension in extensions], batch_size=1000)
+
+    def workplaces_and_bookings(self, rng: random.Random, workplace_count: int, booking_count: int, users, today: date):
+        """
+        bookings are placed on the slot grid of the onpremise_* settings within two weeks around today
+        """
+        workplaces = models.OnPremiseWorkplace.objects.bulk_create([models.OnPremiseWorkplace(
+            name=f"{PREFIX} workplace {index}") for index in range(workplace_count)])
+        # neighbouring workplaces share equipment and exclude each other
+        for workplace, neighbour in zip(workplaces[::2], workplaces[1::2]):
+            workplace.exclusions.add(neighbour)
+        if len(workplaces) == 0:
+            return
+        weekdays = config.weekdays('onpremise_weekdays')
+        start_time, end_time = config.time_of_day('onpremise_starttime'), config.time_of_day('onpremise_endtime')
+        duration, onpremise_break = config.minutes('onepremise_slotduration'), config.minutes('onpremise_breakinbetween_in_min')
+        days = [today + timedelta(days=diff) for diff in range(-14, 15) if (today + timedelta(days=diff)).isoweekday() in weekdays]
+        slot_starts = []
+        for day in days:
+            start = at(day, start_time.hour, start_time.minute)
+            while start + duration <= at(day, end_time.hour, end_time.minute):
+                slot_starts.append(start)
+                start += duration + onpremise_break
+        if len(slot_starts) == 0:
+            return
+        now = timezone.now()
+        models.OnPremiseBooking.objects.bulk_create([models.OnPremiseBooking(
+            user=rng.choice(users), workplace=rng.choice(workplaces), slot_start=slot_start, slot_end=slot_start + duration,
+            showed_up=slot_start < now and rng.random() < 0.8, canceled=now if rng.random() < 0.1 else None)
+            for slot_start in (rng.choice(slot_starts) for _ in range(booking_count))], batch_size=1000)
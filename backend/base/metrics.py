@@ -0,0 +1,171 @@
+"""
+Prometheus metrics of the api, the celery tasks and the availability engine, served in the text format by /metrics.
+
+gunicorn runs several worker processes and celery runs in its own container, counters in the memory of a process would
+only show the part of that process. Every observation is written to redis instead, one hash per metric with a field per
+label set, and all observations of a request go out in one pipeline. Every process adds to the same numbers, so a scrape
+of any worker returns the totals of all of them. A histogram stores the count of the bucket an observation falls into and
+its sum, the buckets are accumulated when the metrics are rendered. Gauges like the depth of the celery queues or the
+number of mails in the outbox are read when scraped.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(name="django")
+
+KEY_PREFIX = "metrics:"
+
+# name: help
+COUNTERS = {
+    'http_requests_total': "handled requests per url name, DRF action, method and status",
+    'availability_computations_total': "availabilities of a type computed from the rows (live) or read from the daily occupancy (materialized)",
+    'mails_total': "mails handed to the mail server per kind (outbox, notification) and result (sent, retried, failed)",
+}
+
+# name: (help, upper bounds of the buckets)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ("request latency per url name and DRF action",
+                                      (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'http_request_db_queries': ("database queries of a request per url name and DRF action",
+                                (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)),
+    'celery_task_duration_seconds': ("runtime of the celery tasks per task and state",
+                                     (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)),
+}
+
+# (name, labels, value)
+Observation = Tuple[str, Dict[str, object], float]
+
+_client = None
+
+
+def client():
+    """
+    the redis client of this process, it is thread safe and keeps its own connection pool
+    """
+    global _client
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(settings.METRICS_URL)
+    return _client
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def series(labels: Dict[str, object]) -> str:
+    """
+    the labels as written between the braces, e.g. name="rental-list",action="list"
+    """
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def _number(value) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def record(counters: Iterable[Observation] = (), histograms: Iterable[Observation] = ()) -> None:
+    """
+    add to counters and observe values of histograms with one round trip to redis.
+    metrics must never break a request or a task, errors are only logged
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    try:
+        pipeline = client().pipeline(transaction=False)
+        for name, labels, value in counters:
+            pipeline.hincrbyfloat(KEY_PREFIX + name, series(labels), value)
+        for name, labels, value in histograms:
+            rendered = series(labels)
+            bucket = next((_number(bound) for bound in HISTOGRAMS[name][1] if value <= bound), '+Inf')
+            pipeline.hincrby(KEY_PREFIX + name, f"{rendered}|{bucket}", 1)
+            pipeline.hincrbyfloat(KEY_PREFIX + name, f"{rendered}|sum", value)
+        pipeline.execute()
+    except Exception:
+        logger.exception("could not record metrics")
+
+
+def inc(name: str, labels: Dict[str, object], value: float = 1) -> None:
+    record(counters=[(name, labels, value)])
+
+
+def observe(name: str, labels: Dict[str, object], value: float) -> None:
+    record(histograms=[(name, labels, value)])
+
+
+def family(name: str, kind: str, help: str, samples: Iterable[Tuple[str, str, object]]) -> List[str]:
+    """
+    the lines of one metric family, samples are (name suffix, rendered labels, value)
+    """
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for suffix, rendered, value in samples:
+        lines.append(f"{name}{suffix}{{{rendered}}} {_number(value)}" if rendered else f"{name}{suffix} {_number(value)}")
+    return lines
+
+
+def _histogram_samples(name: str, fields: Dict[str, str]) -> List[Tuple[str, str, object]]:
+    bounds = [_number(bound) for bound in HISTOGRAMS[name][1]] + ['+Inf']
+    counts: Dict[str, Dict[str, float]] = {}
+    for field, value in fields.items():
+        rendered, suffix = field.rsplit('|', 1)
+        counts.setdefault(rendered, {})[suffix] = float(value)
+    samples = []
+    for rendered, values in sorted(counts.items()):
+        cumulative = 0.0
+        for bound in bounds:
+            cumulative += values.get(bound, 0)
+            samples.append(('_bucket', ",".join(part for part in [rendered, f'le="{bound}"'] if part), cumulative))
+        samples.append(('_sum', rendered, values.get('sum', 0)))
+        samples.append(('_count', rendered, cumulative))
+    return samples
+
+
+def _celery_queues() -> List[str]:
+    """
+    number of waiting messages per queue, only known for a redis broker where every queue is a list
+    """
+    if not settings.CELERY_BROKER_URL.startswith('redis'):
+        return []
+    import redis
+    broker = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    try:
+        samples = [('', series({'queue': queue}), broker.llen(queue)) for queue in settings.METRICS_CELERY_QUEUES]
+    finally:
+        broker.close()
+    return family('celery_queue_length', 'gauge', "messages waiting in the celery queues", samples)
+
+
+def _outbox() -> List[str]:
+    from django.db.models import Count
+    from base import models
+    counts = dict(models.OutgoingMail.objects.order_by().values_list('status').annotate(Count('pk')))
+    samples = [('', series({'status': status}), counts.get(status, 0)) for status, _ in models.OutgoingMail._meta.get_field('status').choices]
+    return family('mail_outbox', 'gauge', "mails in the outbox per status", samples)
+
+
+def render(extra: Optional[List[str]] = None) -> str:
+    """
+    every metric in the prometheus text format. extra are lines of other families, e.g. the catalog cache counters of the api
+    """
+    names = list(COUNTERS) + list(HISTOGRAMS)
+    pipeline = client().pipeline(transaction=False)
+    for name in names:
+        pipeline.hgetall(KEY_PREFIX + name)
+    stored = {name: {field.decode(): value.decode() for field, value in fields.items()}
+              for name, fields in zip(names, pipeline.execute())}
+    lines = []
+    for name, help in COUNTERS.items():
+        lines += family(name, 'counter', help, [('', rendered, value) for rendered, value in sorted(stored[name].items())])
+    for name, (help, _) in HISTOGRAMS.items():
+        lines += family(name, 'histogram', help, _histogram_samples(name, stored[name]))
+    for collector in [_celery_queues, _outbox]:
+        try:
+            lines += collector()
+        except Exception:
+            # a missing gauge is better than no metrics at all
+            logger.exception(f"could not collect {collector.__name__}")
+    lines += extra or []
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_auto_20240226_0138'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('blocked', models.PositiveIntegerField(default=0)),
+                ('rentable', models.PositiveIntegerField(default=0)),
+                ('rental_object_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='base.rentalobjecttype')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyoccupancy',
+            constraint=models.UniqueConstraint(fields=('rental_object_type', 'date'), name='unique_occupancy_type_date'),
+        ),
+    ]
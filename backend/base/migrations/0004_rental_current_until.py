@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_current_until(apps, schema_editor):
+    """
+    current_until is the latest extension of a rental or the end of its reservation if it was never extended
+    """
+    Rental = apps.get_model('base', 'Rental')
+    Extension = apps.get_model('base', 'Extension')
+    Reservation = apps.get_model('base', 'Reservation')
+    Rental.objects.update(current_until=Coalesce(
+        Subquery(Extension.objects.filter(extended_rental=OuterRef('pk')).order_by(
+            '-extended_until').values('extended_until')[:1]),
+        Subquery(Reservation.objects.filter(pk=OuterRef('reservation')).values('reserved_until')[:1]),
+        output_field=models.DateField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_dailyoccupancy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='current_until',
+            field=models.DateField(editable=False, null=True, verbose_name='rented until including all extensions'),
+        ),
+        migrations.RunPython(backfill_current_until, migrations.RunPython.noop),
+    ]
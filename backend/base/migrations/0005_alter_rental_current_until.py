@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_rental_current_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rental',
+            name='current_until',
+            field=models.DateField(editable=False, verbose_name='rented until including all extensions'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import hashlib
+
+
+def tokens_for_sent_links(apps, schema_editor):
+    """
+    links sent before this migration contain sha256(date_joined + username + salt), store them as tokens so they keep working
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    EmailValidation = apps.get_model('base', 'EmailValidation')
+    EmailValidation.objects.bulk_create([EmailValidation(
+        user=user, token=hashlib.sha256((str(user.date_joined) + user.username + settings.EMAIL_VALIDATION_HASH_SALT).encode("utf-8")).hexdigest(),
+        creation_date=user.date_joined, expires=user.date_joined + settings.EMAIL_VALIDATION_EXPIRY)
+        for user in User.objects.filter(is_active=False, last_login__isnull=True)], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('base', '0005_alter_rental_current_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailValidation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, unique=True)),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(tokens_for_sent_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# (sequence, table, column), see base.numbers
+SEQUENCES = [
+    ('base_reservation_operation_number_seq', 'base_reservation', 'operation_number'),
+    ('base_rental_rental_number_seq', 'base_rental', 'rental_number'),
+]
+
+
+def create_sequences(apps, schema_editor):
+    """
+    the sequences continue after the highest number handed out so far. other databases allocate with max + 1
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sequence, table, column in SEQUENCES:
+        schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {sequence} OWNED BY {table}.{column}")
+        schema_editor.execute(f"SELECT setval('{sequence}', COALESCE(MAX({column}), 0) + 1, false) FROM {table}")
+
+
+def drop_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sequence, _, _ in SEQUENCES:
+        schema_editor.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_outgoingmail'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequences, drop_sequences),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_number_sequences'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='onpremisebooking',
+            index=models.Index(fields=['workplace', 'slot_start', 'slot_end'], name='booking_workplace_slot'),
+        ),
+        migrations.AddIndex(
+            model_name='onpremiseworkplacestatus',
+            index=models.Index(fields=['workplace', 'from_date', 'until_date'], name='workplacestatus_range'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['rented_object', 'current_until'], name='rental_object_until'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('received_back_at__isnull', True)), fields=['current_until'], name='rental_open_until'),
+        ),
+        migrations.AddIndex(
+            model_name='rentalobjectstatus',
+            index=models.Index(condition=models.Q(('rentable', False)), fields=['rental_object', 'from_date', 'until_date'], name='objectstatus_unrentable'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('canceled__isnull', True)), fields=['objecttype', 'reserved_from', 'reserved_until'], name='reservation_open_type_range'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('canceled__isnull', True), ('notified__isnull', True)), fields=['reserved_from'], name='reservation_unnotified'),
+        ),
+    ]
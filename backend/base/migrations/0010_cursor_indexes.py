@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='onpremisebooking',
+            index=models.Index(fields=['user', '-id'], name='booking_user_cursor'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['reserver', '-id'], name='reservation_reserver_cursor'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['-operation_number'], name='reservation_operation_number'),
+        ),
+    ]
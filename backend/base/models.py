@@ -1,14 +1,17 @@
 from typing import Iterable, Optional
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from datetime import datetime
 from django.utils import timezone
 from django.conf import settings
 from datetime import timedelta, date
-from django.forms import model_to_dict
 import logging
 
+from base import availability
+from base import durations
+
 
 logger = logging.getLogger(name="django")
 
@@ -102,74 +105,21 @@ class RentalObjectType(models.Model):
     def __str__(self) -> str:
         return self.name
 
-    def available(pk: int, from_date: datetime, until_date: datetime):
-        if isinstance(from_date, date):
-            from_date = datetime.combine(
-                from_date, datetime.min.time(), tzinfo=timezone.get_current_timezone())
-        if isinstance(until_date, date):
-            until_date = datetime.combine(
-                until_date, datetime.min.time(), tzinfo=timezone.get_current_timezone())
-        delta = until_date - from_date
-        offset = settings.DEFAULT_OFFSET_BETWEEN_RENTALS
-        # get all "defect" status for this type
-        object_status = RentalObjectStatus.objects.all().filter(from_date__lte=until_date, until_date__gte=from_date,
-                                                                rentable=False, rental_object__in=RentalObject.objects.filter(type=pk))
-        # remove all objects with an status from objects
-        objects = RentalObject.objects.all().filter(
-            type=pk).exclude(rentable=False).exclude(rentalobjectstatus__in=object_status)
-        # exclude reservations that are already related to an rental also exclude them from counting if they are canceled
-        reservations = Reservation.objects.filter(
-            objecttype_id=pk, reserved_from__lte=until_date.date(), reserved_until__gte=from_date.date()).exclude(rental__in=Rental.objects.filter(rented_object__type=pk)).exclude(canceled__isnull=False)
-        rentals = Rental.objects.filter(
-            rented_object__in=objects, handed_out_at__lte=until_date)
-        rentals = [r for r in rentals if r.extended_until() <= from_date.date()]
-        count = len(objects)
-
-        # give reservations + rentals them common keys for the dates
-        normalized_list = [{**model_to_dict(x), 'from_date': x.handed_out_at.date(
-        ), 'until_date': x.extended_until()} for x in rentals]
-        # normalized_list = [ for x in reservations]
-        for reservation in reservations:
-            for _ in range(reservation.count):
-                normalized_list.append(
-                    {**model_to_dict(reservation), 'from_date': reservation.reserved_from, 'until_date': reservation.reserved_until})
-        ret = {}
-        max_value = 0
-        for day_diff in range(delta.days+1):
-            current_date = (from_date + timedelta(days=day_diff)).date()
-            temp_value = 0
-            for blocked_timerange in normalized_list:
-                # calculate offset
-                until_date_with_offset = (
-                    blocked_timerange['until_date']+offset)
-                if until_date_with_offset.isoweekday() != settings.DEFAULT_LENTING_DAY_OF_WEEK:
-                    # since weekday is not a Lenting day we extend the "occupied/lended" state until the next lenting day
-                    until_date_with_offset += timedelta(days=7-abs(
-                        until_date_with_offset.isoweekday()-settings.DEFAULT_LENTING_DAY_OF_WEEK))
-                if blocked_timerange['from_date'] <= current_date < blocked_timerange['until_date'] + offset:
-                    temp_value += 1
-            max_value = temp_value if temp_value > max_value else max_value
-            ret[str(current_date)] = count-temp_value
-        ret['available'] = count-max_value
-        return ret
+    def available(pk: int, from_date: datetime, until_date: datetime, live: bool = False):
+        """
+        returns the number of free objects for every day in the range and the minimum over the range as 'available'. see base.availability
+        """
+        return availability.available(pk, from_date, until_date, live=live)
 
     def max_rent_duration(pk, prio: Priority):
-        object_type = RentalObjectType.objects.get(id=pk)
-        user_priority = prio
-        if MaxRentDuration.objects.filter(
-                prio=prio, rental_object_type=object_type).exists():
-            instance = MaxRentDuration.objects.get(
-                prio=user_priority, rental_object_type=object_type)
-        elif MaxRentDuration.objects.filter(
-                rental_object_type=object_type, prio__prio__gte=user_priority.prio).order_by('prio__prio').exists():
-            # fallback to default duration
-            instance = MaxRentDuration.objects.filter(
-                rental_object_type=object_type, prio__prio__gt=user_priority.prio).order_by('prio__prio').first()
-        else:
+        """
+        the MaxRentDuration of the priority or the next lower one, resolved in memory by base.durations
+        """
+        instance = durations.resolve(pk, prio)
+        if instance is None:
             # fallback fallback to 1 week
             instance = {
-                'prio': None, 'rental_object_type': object_type, 'duration': timedelta(weeks=1)}
-
+                'prio': None, 'rental_object_type': RentalObjectType.objects.get(id=pk), 'duration': durations.DEFAULT_DURATION}
         return instance
 
 
@@ -192,6 +142,25 @@ class RentalObject(models.Model):
     def __str__(self) -> str:
         return self.type.name + " " + str(self.type.prefix_identifier) + str(self.internal_identifier)
 
+    def annotate_in_house(queryset):
+        """
+        annotates in_house to every object of the queryset, True if the object is not handed out right now.
+        saves one rental query per object
+        """
+        now = timezone.now()
+        return queryset.annotate(in_house=~models.Exists(Rental.objects.filter(
+            models.Q(received_back_at__gte=now) | models.Q(received_back_at__isnull=True), rented_object=models.OuterRef('pk'), handed_out_at__lte=now)))
+
+    def currently_free(queryset):
+        """
+        filters the queryset to objects on the shelf: rentable, no "defect" status today and not part of an open rental.
+        one query for any number of objects
+        """
+        now = timezone.now()
+        return queryset.filter(rentable=True).exclude(models.Exists(RentalObjectStatus.objects.filter(
+            rental_object=models.OuterRef('pk'), from_date__lte=now, until_date__gte=now, rentable=False))).exclude(models.Exists(Rental.objects.filter(
+                models.Q(handed_out_at__lte=now) | models.Q(handed_out_at__isnull=True), rented_object=models.OuterRef('pk'), received_back_at__isnull=True)))
+
 
 class RentalObjectStatus(models.Model):
     """
@@ -204,6 +173,10 @@ class RentalObjectStatus(models.Model):
                 name="object_status_enforce_from_date_lte_until_date"
             )
         ]
+        indexes = [
+            # "defect" status of the objects in a range, see availability.Inventory and RentalObject.currently_free
+            models.Index(name='objectstatus_unrentable', fields=['rental_object', 'from_date', 'until_date'], condition=models.Q(rentable=False)),
+        ]
     rental_object = models.ForeignKey(
         RentalObject, verbose_name="Rentalobject", on_delete=models.CASCADE)
     reason = models.TextField(default="defekt")
@@ -223,6 +196,17 @@ class Reservation(models.Model):
                 name="reservation_reserved_from_date_lte_reserved_until"
             )
         ]
+        indexes = [
+            # reservations of some types touching a range, see availability.Inventory
+            models.Index(name='reservation_open_type_range', fields=['objecttype', 'reserved_from', 'reserved_until'],
+                         condition=models.Q(canceled__isnull=True)),
+            # reservations starting tomorrow the lenders were not notified about yet, see tasks.notify_about_rentals_and_reservations
+            models.Index(name='reservation_unnotified', fields=['reserved_from'], condition=models.Q(canceled__isnull=True, notified__isnull=True)),
+            # own reservations (?self=true) page by page, newest first, see api.pagination
+            models.Index(name='reservation_reserver_cursor', fields=['reserver', '-id']),
+            # lookups by operation number and the pages of ?unique=true
+            models.Index(name='reservation_operation_number', fields=['-operation_number']),
+        ]
     reserver = models.ForeignKey(
         Profile, on_delete=models.CASCADE, related_name='reserver')
     reserved_at = models.DateTimeField(auto_now_add=True)
@@ -247,6 +231,12 @@ class Rental(models.Model):
                 name="rental_handed_out_lte_received_date"
             ),
         ]
+        indexes = [
+            # rentals of some objects ending in a range, see availability.Inventory
+            models.Index(name='rental_object_until', fields=['rented_object', 'current_until']),
+            # open rentals, e.g. due on a day (tasks.notify_about_rentals_and_reservations) or not back yet (RentalObject.currently_free)
+            models.Index(name='rental_open_until', fields=['current_until'], condition=models.Q(received_back_at__isnull=True)),
+        ]
     rented_object = models.ForeignKey(RentalObject, on_delete=models.CASCADE)
     lender = models.ForeignKey(User, blank=True, null=True,
                                default=None, on_delete=models.CASCADE, related_name='lender')
@@ -258,18 +248,32 @@ class Rental(models.Model):
         null=True, default=None, blank=True)
     reservation = models.ForeignKey(Reservation, on_delete=models.CASCADE)
     notified = models.DateTimeField(null=True, blank=True, default=None)
+    # denormalized end of the rental including all extensions, kept in sync by Rental.sync_current_until
+    current_until = models.DateField(editable=False, verbose_name="rented until including all extensions")
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None) -> None:
         # check if the inserted rented object is the same type as the type required from the reservation
         if self.reservation.objecttype.pk != self.rented_object.type.pk:
             raise ValueError("Reservationtype and type of inserted rented object have to be equal")
+        if self.current_until is None:
+            # a new rental is not extended yet
+            self.current_until = self.reservation.reserved_until
         return super().save(force_insert, force_update, using, update_fields)
 
     def extended_until(self) -> date:
-        currentend = self.reservation.reserved_until
-        if self.extension_set.count()>0:
-            currentend = self.extension_set.order_by('-extended_until').first().extended_until
-        return currentend     
+        return self.current_until
+
+    @staticmethod
+    def sync_current_until(rentals: 'models.QuerySet[Rental]') -> None:
+        """
+        recalculates current_until of the given rentals with one update: the latest extension or the end of the reservation.
+        called when an extension is saved or deleted and when the end of a reservation changes, see base.signals
+        """
+        rentals.update(current_until=Coalesce(
+            models.Subquery(Extension.objects.filter(extended_rental=models.OuterRef('pk')).order_by(
+                '-extended_until').values('extended_until')[:1]),
+            models.Subquery(Reservation.objects.filter(pk=models.OuterRef('reservation')).values('reserved_until')[:1]),
+            output_field=models.DateField()))
 
     def __str__(self) -> str:
         return 'Rental: ' + str(self.rental_number)
@@ -284,6 +288,35 @@ class Extension(models.Model):
     extended_by = models.ForeignKey(User, on_delete=models.CASCADE)
     extended_rental = models.ForeignKey(Rental, on_delete=models.CASCADE)
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None) -> None:
+        with transaction.atomic():
+            super().save(force_insert, force_update, using, update_fields)
+            # the latest extension defines the end of the rental
+            Rental.sync_current_until(Rental.objects.filter(pk=self.extended_rental_id))
+            self.extended_rental.refresh_from_db(fields=['current_until'])
+
+class DailyOccupancy(models.Model):
+    """
+    materialized availability of a RentalObjectType per day. rentable and blocked hold what RentalObjectType.available(type, date, date)
+    would calculate for that single day. maintained by base.occupancy and only used if settings.DAILY_OCCUPANCY_ENABLED is set
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                name='unique_occupancy_type_date',
+                fields=['rental_object_type', 'date']
+            )
+        ]
+    rental_object_type = models.ForeignKey(
+        RentalObjectType, on_delete=models.CASCADE, related_name='occupancy')
+    date = models.DateField()
+    blocked = models.PositiveIntegerField(default=0)
+    rentable = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return str(self.rental_object_type_id) + " " + str(self.date) + ": " + str(self.rentable - self.blocked)
+
+
 class OnPremiseBlockedTimes(models.Model):
     """
     To block specific days e.g. someone is ill
@@ -306,6 +339,13 @@ class OnPremiseWorkplace(models.Model):
 
 
 class OnPremiseBooking(models.Model):
+    class Meta:
+        indexes = [
+            # bookings of some workplaces touching the slot window, see slots.slots_for_workplaces
+            models.Index(name='booking_workplace_slot', fields=['workplace', 'slot_start', 'slot_end']),
+            # own bookings (?self=true) page by page, newest first, see api.pagination
+            models.Index(name='booking_user_cursor', fields=['user', '-id']),
+        ]
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     showed_up = models.BooleanField(blank=True, default=False)
     workplace = models.ForeignKey(OnPremiseWorkplace, on_delete=models.CASCADE)
@@ -320,6 +360,10 @@ class OnPremiseWorkplaceStatus(models.Model):
     """
     Disable workplace for a Period of time
     """
+    class Meta:
+        indexes = [
+            models.Index(name='workplacestatus_range', fields=['workplace', 'from_date', 'until_date']),
+        ]
     workplace = models.ForeignKey(OnPremiseWorkplace, on_delete=models.CASCADE, related_name="status")
     from_date = models.DateTimeField()
     until_date = models.DateTimeField()
@@ -382,6 +426,47 @@ class PasswordReset(models.Model):
     hash = models.CharField(max_length=1024)
     creation_date = models.DateTimeField(default=timezone.now)
 
+
+class OutgoingMail(models.Model):
+    """
+    mail written in the same transaction as the change it belongs to and sent by base.tasks.send_outbox, see base.outbox
+    """
+    class Meta:
+        indexes = [
+            models.Index(name='outgoingmail_ready', fields=['status', 'next_attempt'])
+        ]
+    PENDING = 'pending'
+    SENT = 'sent'
+    # dead letter, gave up after settings.MAIL_OUTBOX_MAX_ATTEMPTS
+    FAILED = 'failed'
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    html_message = models.TextField(null=True, blank=True)
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, default=PENDING, choices=[(PENDING, 'pending'), (SENT, 'sent'), (FAILED, 'failed')])
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return self.subject + " to " + ", ".join(self.recipients) + ": " + self.status
+
+
+class EmailValidation(models.Model):
+    """
+    token of the validation link that is sent on signup. validating a link is a lookup of the unique token
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    token = models.CharField(max_length=64, unique=True)
+    creation_date = models.DateTimeField(default=timezone.now)
+    expires = models.DateTimeField()
+
+    def __str__(self) -> str:
+        return self.user.username + ": " + str(self.expires)
+
 class MaxRentDuration(models.Model):
     class Meta:
         constraints = [
@@ -0,0 +1,41 @@
+"""
+Allocator for the operation_number of reservations and the rental_number of rentals.
+
+On postgres both numbers come from their own sequence (created and seeded with the current maxima by migration 0008), so
+allocating is O(1) and two desks never get the same number, even in parallel transactions. Sequences are not rolled back,
+numbers of failed requests are skipped. Other databases fall back to the maximum + 1 like before.
+"""
+from typing import List
+
+from django.db import connection
+from django.db.models import Max
+
+import logging
+
+logger = logging.getLogger(name="django")
+
+# name: (sequence, model name, field)
+SEQUENCES = {
+    'operation_number': ('base_reservation_operation_number_seq', 'Reservation', 'operation_number'),
+    'rental_number': ('base_rental_rental_number_seq', 'Rental', 'rental_number'),
+}
+
+
+def next_numbers(name: str, count: int) -> List[int]:
+    """
+    count unused numbers, ascending but not necessarily without gaps
+    """
+    sequence, model_name, field = SEQUENCES[name]
+    if count <= 0:
+        return []
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", [sequence, count])
+            return sorted(row[0] for row in cursor.fetchall())
+    from base import models
+    first = (getattr(models, model_name).objects.aggregate(Max(field))[f'{field}__max'] or 0) + 1
+    return list(range(first, first + count))
+
+
+def next_number(name: str) -> int:
+    return next_numbers(name, 1)[0]
@@ -0,0 +1,233 @@
+"""
+Maintains the DailyOccupancy table, the materialized availability per RentalObjectType and day.
+
+Every row holds what RentalObjectType.available(type, day, day) would calculate for that single day. The rows inside the
+window from settings.DAILY_OCCUPANCY_PAST_DAYS before until settings.DAILY_OCCUPANCY_FUTURE_DAYS after today are kept up to
+date by the signal handlers in base.signals, which only recalculate the days touched by a change. Single day availability
+reads then become one indexed lookup, see available_for_types. Ranges are not answered from the rows: an object with a
+defect on one day is missing for the whole range and a rental only counts if it was due before the range started, neither
+can be put together from per day numbers.
+"""
+import random
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from base import availability
+
+import logging
+
+logger = logging.getLogger(name="django")
+
+# (first day, last day) both included
+DayRange = Tuple[date, date]
+
+
+def window() -> DayRange:
+    """
+    the days for which rows are materialized
+    """
+    today = timezone.localdate()
+    return today - timedelta(days=settings.DAILY_OCCUPANCY_PAST_DAYS), today + timedelta(days=settings.DAILY_OCCUPANCY_FUTURE_DAYS)
+
+
+def _merge(intervals: Iterable[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """
+    merge overlapping [start, end) intervals
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(start: date, end: date, holes: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """
+    remove the merged intervals in holes from [start, end)
+    """
+    ret = []
+    for hole_start, hole_end in holes:
+        if hole_end <= start or hole_start >= end:
+            continue
+        if hole_start > start:
+            ret.append((start, hole_start))
+        start = max(start, hole_end)
+    if start < end:
+        ret.append((start, end))
+    return ret
+
+
+def _first_counted_day(handed_out_at: datetime) -> date:
+    """
+    a rental only counts for a day if it was handed out before that day started
+    """
+    day = timezone.localtime(handed_out_at, timezone.get_current_timezone()).date()
+    if datetime.combine(day, datetime.min.time(), tzinfo=timezone.get_current_timezone()) < handed_out_at:
+        day += timedelta(days=1)
+    return max(day, handed_out_at.date())
+
+
+def daily_occupancy(pks: Iterable[int], first_day: date, last_day: date) -> Dict[int, List[Tuple[int, int]]]:
+    """
+    calculates (rentable, blocked) for every type and every day between first_day and last_day from one availability.Inventory.
+    each day is evaluated like a single day availability request
+    """
+    offset = settings.DEFAULT_OFFSET_BETWEEN_RENTALS
+    inventory = availability.Inventory(pks, first_day, last_day)
+
+    # days on which an object has a "defect" status, until_date defaults to datetime.max so it is capped to the requested range
+    defects = {object_pk: _merge((max(from_date, first_day), min(until_date, last_day) + timedelta(days=1)) for from_date, until_date in status)
+               for object_pk, status in inventory.status.items()}
+
+    ret = {}
+    for pk in inventory.pks:
+        defect_intervals = [(start, end, 1) for object_pk in inventory.objects[pk] for start, end in defects.get(object_pk, [])]
+        # a single day request only sees reservations that did not end before that day
+        blocked_intervals = [(reserved_from, reserved_until + min(offset, timedelta(days=1)), count)
+                             for reserved_from, reserved_until, count in inventory.reservations[pk]]
+        for object_pk, handed_out_at, current_until in inventory.rentals[pk]:
+            start = max(_first_counted_day(handed_out_at), current_until)
+            for interval_start, interval_end in _subtract(start, availability.blocked_end(current_until), defects.get(object_pk, [])):
+                blocked_intervals.append((interval_start, interval_end, 1))
+        defective = availability.blocked_per_day(defect_intervals, first_day, last_day)
+        blocked = availability.blocked_per_day(blocked_intervals, first_day, last_day)
+        ret[pk] = [(len(inventory.objects[pk]) - defective_units, blocked_units) for defective_units, blocked_units in zip(defective, blocked)]
+    return ret
+
+
+def refresh(pks: Iterable[int], first_day: date, last_day: date) -> int:
+    """
+    recalculates the rows of the given types between first_day and last_day, capped to the window. returns the number of written rows
+    """
+    from base import models
+    window_start, window_end = window()
+    first_day, last_day = max(first_day, window_start), min(last_day, window_end)
+    if first_day > last_day:
+        return 0
+    # types can be deleted before the refresh runs on commit
+    pks = list(models.RentalObjectType.objects.filter(pk__in=pks).values_list('pk', flat=True))
+    rows = []
+    for pk, days in daily_occupancy(pks, first_day, last_day).items():
+        for day_index, (rentable, blocked) in enumerate(days):
+            rows.append(models.DailyOccupancy(rental_object_type_id=pk, date=first_day + timedelta(days=day_index),
+                                              rentable=max(rentable, 0), blocked=blocked))
+    models.DailyOccupancy.objects.bulk_create(rows, batch_size=1000, update_conflicts=True, unique_fields=[
+        'rental_object_type', 'date'], update_fields=['rentable', 'blocked'])
+    return len(rows)
+
+
+def schedule_refresh(ranges: Iterable[Tuple[int, date, date]]) -> None:
+    """
+    refresh the given (type, first day, last day) ranges as soon as the current transaction is committed
+    """
+    if not settings.DAILY_OCCUPANCY_ENABLED:
+        return
+    for pk, first_day, last_day in ranges:
+        transaction.on_commit(partial(refresh, [pk], first_day, last_day))
+
+
+def affected_ranges(instance) -> List[Tuple[int, date, date]]:
+    """
+    the (type, first day, last day) ranges whose rows can change if the given instance is saved or deleted
+    """
+    from base import models
+    if isinstance(instance, models.Reservation):
+        return [(instance.objecttype_id, instance.reserved_from, instance.reserved_until)]
+    if isinstance(instance, models.Rental):
+        reservation = instance.reservation
+        first_day, last_day = reservation.reserved_from, reservation.reserved_until
+        if instance.handed_out_at is not None:
+            first_day = min(first_day, instance.handed_out_at.date())
+            last_day = max(last_day, availability.blocked_end(instance.extended_until()))
+        return [(instance.rented_object.type_id, first_day, last_day)]
+    if isinstance(instance, models.Extension):
+        return [(instance.extended_rental.rented_object.type_id, instance.extended_from, availability.blocked_end(instance.extended_until))]
+    if isinstance(instance, models.RentalObjectStatus):
+        window_start, window_end = window()
+        # an unsaved status still holds its defaults, datetimes like timezone.now and datetime.max. the date field converts
+        # them the same way when they are written
+        from_date = instance._meta.get_field('from_date').to_python(instance.from_date)
+        until_date = instance._meta.get_field('until_date').to_python(instance.until_date)
+        return [(instance.rental_object.type_id, max(from_date, window_start), min(until_date, window_end))]
+    if isinstance(instance, models.RentalObject):
+        return [(instance.type_id, *window())]
+    return []
+
+
+def available_for_types(pks: Iterable[int], from_day: date, until_day: date) -> Dict[int, Dict[str, int]]:
+    """
+    reads the availability of the given types from the materialized rows with one range scan. only equal to the live
+    calculation for a single day (from_day == until_day), see the module docstring.
+    types without a row for every requested day are left out, the caller has to calculate those live
+    """
+    from base import models
+    pks = list(pks)
+    days = (until_day - from_day).days + 1
+    if days <= 0:
+        return {}
+    rows = {pk: [] for pk in pks}
+    for pk, rentable, blocked in models.DailyOccupancy.objects.filter(
+            rental_object_type__in=pks, date__gte=from_day, date__lte=until_day).order_by('rental_object_type', 'date').values_list(
+            'rental_object_type', 'rentable', 'blocked'):
+        rows[pk].append(rentable - blocked)
+    ret = {}
+    for pk, free in rows.items():
+        if len(free) != days:
+            continue
+        ret[pk] = {str(from_day + timedelta(days=day_index)): free_units for day_index, free_units in enumerate(free)}
+        ret[pk]['available'] = min(free)
+    return ret
+
+
+def check(pks: Iterable[int], first_day: date, last_day: date) -> List[Tuple[int, date, Optional[Tuple[int, int]], Tuple[int, int]]]:
+    """
+    compares the stored rows with a fresh calculation. returns (type, day, stored (rentable, blocked) or None, expected) for every drifted row
+    """
+    from base import models
+    pks = list(pks)
+    stored = {(pk, day): (rentable, blocked) for pk, day, rentable, blocked in models.DailyOccupancy.objects.filter(
+        rental_object_type__in=pks, date__gte=first_day, date__lte=last_day).values_list('rental_object_type', 'date', 'rentable', 'blocked')}
+    drift = []
+    for pk, days in daily_occupancy(pks, first_day, last_day).items():
+        for day_index, (rentable, blocked) in enumerate(days):
+            day = first_day + timedelta(days=day_index)
+            expected = (max(rentable, 0), blocked)
+            if stored.get((pk, day)) != expected:
+                drift.append((pk, day, stored.get((pk, day)), expected))
+    return drift
+
+
+def parity(pks: Iterable[int], first_day: date, last_day: date, ranges: int = 50, seed: Optional[int] = None) -> List[Tuple[int, date, date, Optional[int], int]]:
+    """
+    compares what readers get with the live calculation (availability.Inventory): the stored free objects of every single day
+    between first_day and last_day and availability.available_for_types for random ranges in between.
+    returns (type, from day, until day, read 'available' or None without a row, live 'available') for every difference
+    """
+    from base import models
+    pks = list(pks)
+    inventory = availability.Inventory(pks, first_day, last_day)
+    stored = {(pk, day): max(rentable, 0) - blocked for pk, day, rentable, blocked in models.DailyOccupancy.objects.filter(
+        rental_object_type__in=pks, date__gte=first_day, date__lte=last_day).values_list('rental_object_type', 'date', 'rentable', 'blocked')}
+    ret = []
+    for day_index in range((last_day - first_day).days + 1):
+        day = first_day + timedelta(days=day_index)
+        for pk in pks:
+            live = inventory.available(pk, day, day)['available']
+            if stored.get((pk, day)) != live:
+                ret.append((pk, day, day, stored.get((pk, day)), live))
+    generator = random.Random(seed)
+    for _ in range(ranges if first_day <= last_day else 0):
+        from_day = first_day + timedelta(days=generator.randint(0, (last_day - first_day).days))
+        until_day = min(from_day + timedelta(days=generator.randint(0, 27)), last_day)
+        for pk, read in availability.available_for_types(pks, from_day, until_day).items():
+            live = inventory.available(pk, from_day, until_day)['available']
+            if read['available'] != live:
+                ret.append((pk, from_day, until_day, read['available'], live))
+    return ret
@@ -0,0 +1,104 @@
+"""
+Transactional mail outbox.
+
+Requests do not talk to the smtp server anymore. queue_mail writes an OutgoingMail row in the transaction of the change the mail
+belongs to, so a mail exists if and only if the change was committed. After the commit base.tasks.send_outbox is triggered,
+which sends the ready rows in batches over one reused connection. Failed mails are retried with an exponential backoff and
+marked failed (dead letter) after settings.MAIL_OUTBOX_MAX_ATTEMPTS, the periodic send_outbox task picks up retries.
+"""
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+import logging
+
+logger = logging.getLogger(name="django")
+
+
+def queue_mail(subject: str, message: str, recipient_list: Iterable[str], html_message: Optional[str] = None, from_email: Optional[str] = None):
+    """
+    same arguments as django.core.mail.send_mail, but the mail is only stored and sent by celery after the commit
+    """
+    from base import models
+    mail = models.OutgoingMail.objects.create(subject=subject, message=message, html_message=html_message,
+                                              from_email=from_email or settings.DEFAULT_FROM_EMAIL, recipients=list(recipient_list))
+    transaction.on_commit(trigger)
+    return mail
+
+
+def trigger() -> None:
+    """
+    ask a celery worker to send the outbox now instead of waiting for the periodic task
+    """
+    from base import tasks
+    try:
+        tasks.send_outbox.delay()
+    except Exception:
+        # the broker is not reachable, the periodic task sends the mail later
+        logger.exception("could not trigger send_outbox")
+
+
+def backoff(attempts: int):
+    return settings.MAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def send_batch(batch_size: Optional[int] = None) -> dict:
+    """
+    send the next ready mails over one connection. rows are locked with skip locked, so several workers never send the same mail.
+    returns the number of sent, retried and failed mails
+    """
+    from base import models
+    ret = {'sent': 0, 'retried': 0, 'failed': 0}
+    with transaction.atomic():
+        mails = list(models.OutgoingMail.objects.select_for_update(skip_locked=True).filter(
+            status=models.OutgoingMail.PENDING, next_attempt__lte=timezone.now()).order_by('next_attempt', 'pk')[:batch_size or settings.MAIL_OUTBOX_BATCH_SIZE])
+        if len(mails) == 0:
+            return ret
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as error:
+            # nothing could be sent, every mail of the batch counts as a failed attempt
+            logger.exception("could not connect to the mail server")
+            for mail in mails:
+                ret[failed_attempt(mail, error)] += 1
+            return ret
+        try:
+            for mail in mails:
+                message = EmailMultiAlternatives(subject=mail.subject, body=mail.message, from_email=mail.from_email,
+                                                 to=mail.recipients, connection=connection)
+                if mail.html_message:
+                    message.attach_alternative(mail.html_message, 'text/html')
+                try:
+                    message.send()
+                except Exception as error:
+                    logger.exception(f"could not send mail {mail.pk}")
+                    ret[failed_attempt(mail, error)] += 1
+                    continue
+                mail.status = models.OutgoingMail.SENT
+                mail.attempts += 1
+                mail.sent = timezone.now()
+                mail.save(update_fields=['status', 'attempts', 'sent'])
+                ret['sent'] += 1
+        finally:
+            connection.close()
+    return ret
+
+
+def failed_attempt(mail, error: Exception) -> str:
+    """
+    schedule the next attempt or give up, returns which counter of send_batch to increment
+    """
+    from base import models
+    mail.attempts += 1
+    mail.last_error = repr(error)
+    if mail.attempts >= settings.MAIL_OUTBOX_MAX_ATTEMPTS:
+        mail.status = models.OutgoingMail.FAILED
+        logger.error(f"giving up on mail {mail.pk} to {mail.recipients} after {mail.attempts} attempts")
+    else:
+        mail.next_attempt = timezone.now() + backoff(mail.attempts)
+    mail.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt'])
+    return 'failed' if mail.status == models.OutgoingMail.FAILED else 'retried'
@@ -0,0 +1,88 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.conf import settings
+from celery.signals import task_prerun, task_postrun
+
+from base import models
+from base import occupancy
+from base import config
+from base import durations
+from base import texts
+from base import metrics
+
+import logging
+import time
+
+logger = logging.getLogger(name="django")
+
+OCCUPANCY_MODELS = (models.Reservation, models.Rental, models.Extension,
+                    models.RentalObjectStatus, models.RentalObject)
+
+
+def remember_occupancy_before_change(sender, instance, raw=False, **kwargs):
+    """
+    remember which days the instance blocked before the change, e.g. a reservation moved to another week frees its old days
+    """
+    if raw or not settings.DAILY_OCCUPANCY_ENABLED or instance.pk is None:
+        return
+    old_instance = sender.objects.filter(pk=instance.pk).first()
+    instance._occupancy_ranges_before = occupancy.affected_ranges(
+        old_instance) if old_instance is not None else []
+
+
+def refresh_occupancy_on_save(sender, instance, raw=False, **kwargs):
+    if raw or not settings.DAILY_OCCUPANCY_ENABLED:
+        return
+    occupancy.schedule_refresh(
+        getattr(instance, '_occupancy_ranges_before', []) + occupancy.affected_ranges(instance))
+
+
+def refresh_occupancy_on_delete(sender, instance, **kwargs):
+    # ranges are collected before the delete since related rows may be deleted in the same cascade
+    if not settings.DAILY_OCCUPANCY_ENABLED:
+        return
+    occupancy.schedule_refresh(occupancy.affected_ranges(instance))
+
+
+for model in OCCUPANCY_MODELS:
+    pre_save.connect(remember_occupancy_before_change, sender=model)
+    post_save.connect(refresh_occupancy_on_save, sender=model)
+    pre_delete.connect(refresh_occupancy_on_delete, sender=model)
+
+
+@receiver(post_delete, sender=models.Extension)
+def sync_current_until_on_extension_delete(sender, instance, **kwargs):
+    # the rental ends with its latest remaining extension or its reservation again
+    models.Rental.sync_current_until(models.Rental.objects.filter(pk=instance.extended_rental_id))
+
+
+@receiver(post_save, sender=models.Reservation)
+def sync_current_until_on_reservation_change(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # rentals that were never extended end with their reservation, a new reservation has no rentals yet
+    if raw or created or (update_fields is not None and 'reserved_until' not in update_fields):
+        return
+    models.Rental.sync_current_until(models.Rental.objects.filter(reservation=instance))
+
+
+# the process-local caches and the models they are built from
+for local_cache, cached_models in [(config.local_cache, [models.Settings]), (texts.local_cache, [models.Text]),
+                                   (durations.local_cache, [models.MaxRentDuration, models.Priority])]:
+    for model in cached_models:
+        post_save.connect(local_cache.invalidate_on_commit, sender=model)
+        post_delete.connect(local_cache.invalidate_on_commit, sender=model)
+
+
+# task id: start of the task in this worker process
+_task_started = {}
+
+
+@task_prerun.connect
+def remember_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.observe('celery_task_duration_seconds', {'task': task.name, 'state': state or ''}, time.perf_counter() - started)
@@ -0,0 +1,114 @@
+"""
+Slot engine for the on premise workplaces.
+
+The slot grid only depends on the onpremise_* settings. Everything that disables a slot (own bookings, bookings of excluded
+workplaces, workplace status and general blocked times) is loaded for the whole window with four queries, merged into sorted
+disjoint intervals per workplace and swept once along the sorted slots. All intervals are closed like the old per slot
+queries, so an interval ending exactly when a slot starts still disables it.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.utils import timezone
+
+from base import config
+
+import logging
+
+logger = logging.getLogger(name="django")
+
+# (start, end, weekday of the day the slot belongs to)
+Slot = Tuple[datetime, datetime, int]
+
+
+def grid(now: datetime = None) -> List[Slot]:
+    """
+    all slots of the next onpremise_date_range_in_days days on onpremise_weekdays, sorted by start
+    """
+    weekdays = config.weekdays('onpremise_weekdays')
+    start_time = config.time_of_day('onpremise_starttime')
+    end_time = config.time_of_day('onpremise_endtime')
+    onpremise_break = config.minutes('onpremise_breakinbetween_in_min')
+    duration = config.minutes('onepremise_slotduration')
+    if now is None:
+        now = timezone.now().astimezone(tz=timezone.get_default_timezone())
+    ret = []
+    for diff in range(config.integer('onpremise_date_range_in_days')):
+        slot_day = now + timedelta(days=diff)
+        if slot_day.isoweekday() not in weekdays:
+            continue
+        start = slot_day.replace(hour=start_time.hour, minute=start_time.minute, second=0, microsecond=0)
+        day_end = slot_day.replace(hour=end_time.hour, minute=end_time.minute, second=0, microsecond=0)
+        while start + duration <= day_end:
+            ret.append((start, start + duration, slot_day.weekday()))
+            start = start + duration + onpremise_break
+    return ret
+
+
+def merge(intervals: Iterable[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """
+    merge closed [start, end] intervals into sorted disjoint ones
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def disabled(slots: List[Slot], intervals: List[Tuple[datetime, datetime]]) -> List[bool]:
+    """
+    sweep over the sorted slots and the merged intervals at once, a slot is disabled if it touches any interval
+    """
+    ret = []
+    index = 0
+    for slot_start, slot_end, _ in slots:
+        while index < len(intervals) and intervals[index][1] < slot_start:
+            index += 1
+        ret.append(index < len(intervals) and intervals[index][0] <= slot_end)
+    return ret
+
+
+def slots_for_workplaces(pks: Iterable[int], now: datetime = None) -> Dict[int, List[dict]]:
+    """
+    the slots of every given workplace [{start, end, weekday, date, disabled}] with four queries in total
+    """
+    from base import models
+    pks = [int(pk) for pk in pks]
+    slots = grid(now)
+    if len(slots) == 0:
+        return {pk: [] for pk in pks}
+    first, last = slots[0][0], slots[-1][1]
+
+    exclusions = {pk: set() for pk in pks}
+    for from_pk, to_pk in models.OnPremiseWorkplace.exclusions.through.objects.filter(
+            from_onpremiseworkplace__in=pks).values_list('from_onpremiseworkplace', 'to_onpremiseworkplace'):
+        exclusions[from_pk].add(to_pk)
+    excluded = set().union(*exclusions.values())
+
+    intervals = {pk: [] for pk in pks}
+    bookings = {}
+    for workplace_pk, slot_start, slot_end, canceled in models.OnPremiseBooking.objects.filter(
+            workplace__in=set(pks) | excluded, slot_start__lte=last, slot_end__gte=first).values_list(
+            'workplace', 'slot_start', 'slot_end', 'canceled'):
+        bookings.setdefault(workplace_pk, []).append((slot_start, slot_end, canceled))
+    for pk in pks:
+        intervals[pk] += [(slot_start, slot_end) for slot_start, slot_end, canceled in bookings.get(pk, []) if canceled is None]
+        # canceled bookings of excluded workplaces always blocked the slot as well, kept as is
+        for excluded_pk in exclusions[pk]:
+            intervals[pk] += [(slot_start, slot_end) for slot_start, slot_end, _ in bookings.get(excluded_pk, [])]
+
+    for workplace_pk, from_date, until_date in models.OnPremiseWorkplaceStatus.objects.filter(
+            workplace__in=pks, from_date__lte=last, until_date__gte=first).values_list('workplace', 'from_date', 'until_date'):
+        intervals[workplace_pk].append((from_date, until_date))
+
+    blocked = list(models.OnPremiseBlockedTimes.objects.filter(
+        starttime__lte=last, endtime__gte=first).values_list('starttime', 'endtime'))
+
+    ret = {}
+    for pk in pks:
+        ret[pk] = [{'start': slot_start, 'end': slot_end, 'weekday': weekday, 'date': slot_start.date(), 'disabled': is_disabled}
+                   for (slot_start, slot_end, weekday), is_disabled in zip(slots, disabled(slots, merge(intervals[pk] + blocked)))]
+    return ret
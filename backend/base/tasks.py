@@ -2,16 +2,23 @@ from celery import shared_task
 from django.forms import model_to_dict
 from django.utils import timezone
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.contrib.auth.models import User
 from django.db import transaction
-from django.template import Context, Template
+from django.template import Context
 
 from django_celery_beat.models import PeriodicTask
 
 from datetime import timedelta, datetime
+from itertools import groupby
+import time
 
 from base import models
+from base import occupancy
+from base import config
+from base import outbox
+from base import texts
+from base import metrics
 import logging
 
 logger = logging.getLogger("django")
@@ -30,79 +37,142 @@ def task_execute():
 @shared_task()
 def cleanup_accounts():
     """
-    Delete all accounts where the email has not been verified
+    Delete all accounts where the email has not been verified and all expired validation links
     """
+    models.EmailValidation.objects.filter(expires__lt=timezone.now()).delete()
     users = User.objects.filter(last_login__isnull=True, date_joined__lte=timezone.now(
     ) - timedelta(weeks=2), is_active=False)
-    result, _ = users.delete()
-    # 23 need to divide it by 2 because profiles also count against the count
-    return f"deleted {result/2} accounts"
+    _, deleted = users.delete()
+    # only count users, profiles and remaining validation links are deleted with them
+    return f"deleted {deleted.get(User._meta.label, 0)} accounts"
+
+
+@shared_task()
+def rebuild_occupancy():
+    """
+    recalculate the whole DailyOccupancy window. the window moves every day, this also adds the rows for the new days
+    """
+    if not settings.DAILY_OCCUPANCY_ENABLED:
+        return "daily occupancy is disabled"
+    first_day, last_day = occupancy.window()
+    models.DailyOccupancy.objects.filter(date__lt=first_day).delete()
+    written = occupancy.refresh(models.RentalObjectType.objects.values_list('pk', flat=True), first_day, last_day)
+    return f"wrote {written} occupancy rows"
+
+
+@shared_task()
+def send_outbox():
+    """
+    send all ready mails of the outbox (base.outbox) in batches, each batch over one connection
+    """
+    total = {'sent': 0, 'retried': 0, 'failed': 0}
+    while True:
+        result = outbox.send_batch()
+        for key in total:
+            total[key] += result[key]
+        metrics.record(counters=[('mails_total', {'kind': 'outbox', 'result': key}, count) for key, count in result.items() if count > 0])
+        # a smaller batch means there is nothing ready anymore
+        if sum(result.values()) < settings.MAIL_OUTBOX_BATCH_SIZE:
+            break
+    return f"sent {total['sent']} mails, {total['retried']} will be retried, {total['failed']} failed"
+
+
+def notification_mail(subject: str, message: str, recipient_list: list) -> EmailMultiAlternatives:
+    mail = EmailMultiAlternatives(subject=subject, body=message, from_email=settings.DEFAULT_FROM_EMAIL, to=recipient_list)
+    mail.attach_alternative(message, 'text/html')
+    return mail
 
 
 @shared_task()
 def notify_about_rentals_and_reservations():
     """
-    fetch all reservations for the next day 
+    notify the lenders about the reservations of the next day, the users about their rentals due in two days and the lenders
+    about rentals that did not come back today. every group of rows is selected with its whole graph in a few queries,
+    the mails are sent over one connection at the end
     """
-    reservations = models.Reservation.objects.filter(reserved_from__lte=(timezone.now(
-    ) + timedelta(days=1)).date(), reserved_from__gte=timezone.now().date(), canceled__isnull=True, notified__isnull=True)
-    count_mails = 0
+    started = time.perf_counter()
+    today = timezone.now().date()
+    now = timezone.now()
+    # (mail, rows marked as notified once the mail is sent)
+    mails = []
+    scanned = 0
+
+    reservations = list(models.Reservation.objects.filter(
+        reserved_from__lte=today + timedelta(days=1), reserved_from__gte=today, canceled__isnull=True, notified__isnull=True
+    ).select_related('reserver__user', 'objecttype').prefetch_related(
+        'reserver__user__groups', 'reserver__user__user_permissions', 'objecttype__tags'))
+    scanned += len(reservations)
     if len(reservations) > 0:
-        with transaction.atomic():
-            template_data = {"reservations": []}
-            for reservation in reservations:
-                reservation_dict = model_to_dict(reservation)
-                reservation_dict['reserver_profile'] = model_to_dict(
-                    reservation.reserver)
-                reservation_dict['reserver_user'] = model_to_dict(
-                    reservation.reserver.user)
-                reservation_dict['objecttype'] = model_to_dict(
-                    reservation.objecttype)
-                template_data['reservations'].append(reservation_dict)
-            logger.info(template_data)
-            # notify lender about reservations one day in advance
-            template = Template(models.Text.objects.filter(
-                name='reservation_lender_notification').first().content)
-            message = template.render(Context(template_data))
-            count_mails = send_mail(subject="Neue Reservierungen am " + str(template_data["reservations"][0]['reserved_from']),
-                                    from_email=settings.DEFAULT_FROM_EMAIL, message=message, html_message=message, recipient_list=[settings.DEFAULT_NOTIFICATION_EMAIL])
-            reservations.update(notified=timezone.now())
+        template_data = {"reservations": []}
+        for reservation in reservations:
+            reservation_dict = model_to_dict(reservation)
+            reservation_dict['reserver_profile'] = model_to_dict(reservation.reserver)
+            reservation_dict['reserver_user'] = model_to_dict(reservation.reserver.user)
+            reservation_dict['objecttype'] = model_to_dict(reservation.objecttype)
+            template_data['reservations'].append(reservation_dict)
+        logger.info(template_data)
+        # notify lender about reservations one day in advance
+        message = texts.render('reservation_lender_notification', template_data, unwrapped=False)
+        mails.append((notification_mail("Neue Reservierungen am " + str(template_data["reservations"][0]['reserved_from']),
+                                        message, [settings.DEFAULT_NOTIFICATION_EMAIL]),
+                      models.Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations])))
 
-    rentals = [ r for r in models.Rental.objects.filter( received_back_at__isnull=True, notified__isnull=True) if r.extended_until==(
-        timezone.now() + timedelta(days=2)).date()]
-    count_rental_mails = 0
+    # ordered by user, so the rentals of one user are next to each other
+    rentals = list(models.Rental.objects.filter(
+        received_back_at__isnull=True, notified__isnull=True, current_until=today + timedelta(days=2)
+    ).select_related('reservation__reserver__user', 'rented_object__type').prefetch_related(
+        'reservation__reserver__user__groups', 'reservation__reserver__user__user_permissions', 'rented_object__type__tags'
+    ).order_by('reservation__reserver__user', 'pk'))
+    scanned += len(rentals)
     if len(rentals) > 0:
-        with transaction.atomic():
-            template_data = {}
-            for rental in rentals:
+        return_date_info = {'start': config.value('returning_start_hour'), 'end': config.value('returning_end_hour')}
+        # compiled once for all users
+        template = texts.template('rental_expiration_notification', unwrapped=False)
+        for user, user_rentals in groupby(rentals, key=lambda rental: rental.reservation.reserver.user):
+            user_rentals = list(user_rentals)
+            template_data = {'user': model_to_dict(user), 'rentals': []}
+            for rental in user_rentals:
+                if 'return_date_info' not in template_data:
+                    template_data['return_date_info'] = {'date': rental.current_until, **return_date_info}
                 rental_dict = model_to_dict(rental)
-                if rental.reservation.reserver.user.pk not in template_data:
-                    user = rental.reservation.reserver.user
-                    template_data[user.pk] = {'user': model_to_dict(user), 'rentals': [], 'return_date_info': {'date': rental.extended_until(), 'start': models.Settings.objects.get(
-                        type='returning_start_hour').value, 'end': models.Settings.objects.get(type='returning_end_hour').value}}
-                rental_dict['rented_object'] = model_to_dict(
-                    rental.rented_object)
-                rental_dict['rented_object']['type'] = model_to_dict(
-                    rental.rented_object.type)
+                rental_dict['rented_object'] = model_to_dict(rental.rented_object)
+                rental_dict['rented_object']['type'] = model_to_dict(rental.rented_object.type)
                 rental_dict['rented_object']['merged_identifier'] = rental.rented_object.type.prefix_identifier + \
                     str(rental.rented_object.internal_identifier)
-                template_data[user.pk]['rentals'].append(rental_dict)
-            for key in template_data.keys():
-                template = Template(models.Text.objects.filter(
-                    name='rental_expiration_notification').first().content)
-                message = template.render(Context(template_data[key]))
-                count_rental_mails += send_mail(subject=f"Deine ausgeliehenen Gegenstände müssen am {template_data[key]['return_date_info']['date']} zurück",
-                                                from_email=settings.DEFAULT_FROM_EMAIL, message=message, html_message=message, recipient_list=[template_data[key]['user']['email']])
-                logger.info(message)
-            rentals.update(notified=timezone.now())
+                template_data['rentals'].append(rental_dict)
+            message = template.render(Context(template_data))
+            mails.append((notification_mail(f"Deine ausgeliehenen Gegenstände müssen am {template_data['return_date_info']['date']} zurück",
+                                            message, [template_data['user']['email']]),
+                          models.Rental.objects.filter(pk__in=[rental.pk for rental in user_rentals])))
+            logger.info(message)
+
     # only execute if returning hours are over
-    if timezone.now() > timezone.now().replace(hour=int(models.Settings.objects.get(type='returning_end_hour').value), minute=0, second=0):
+    if now > now.replace(hour=config.integer('returning_end_hour'), minute=0, second=0):
         # reuse notified state for this fetch all rentals that were supposed to come back today and which have been notified about reserved until before the rental hour startet
-        rentals_not_received_back = [ r for r in models.Rental.objects.filter(received_back_at__isnull=True, notified__lte=timezone.now(
-            ).replace(hour=int(models.Settings.objects.get(type='returning_start_hour').value))) if r.extended_until==timezone.now().date()]
+        rentals_not_received_back = list(models.Rental.objects.filter(received_back_at__isnull=True, notified__lte=now.replace(
+            hour=config.integer('returning_start_hour')), current_until=today).values_list('pk', flat=True))
+        scanned += len(rentals_not_received_back)
         if len(rentals_not_received_back) > 0:
-            message="Wir haben ein paar Gegenstände nicht zurückerhalten, bitte einmal überprüfen."
-            send_mail(subject=f"Fehlende Gegenstände für heutige Rückgabe",
-                from_email=settings.DEFAULT_FROM_EMAIL, message=message, html_message=message, recipient_list=[settings.DEFAULT_NOTIFICATION_EMAIL])
-            rentals.update(notified=timezone.now())
-    return f"send {count_mails} mails about reservations"
+            message = "Wir haben ein paar Gegenstände nicht zurückerhalten, bitte einmal überprüfen."
+            mails.append((notification_mail("Fehlende Gegenstände für heutige Rückgabe", message, [settings.DEFAULT_NOTIFICATION_EMAIL]),
+                          models.Rental.objects.filter(pk__in=rentals_not_received_back)))
+
+    sent = 0
+    if len(mails) > 0:
+        # the rows of a mail are marked as notified right after it was sent, a failing mail only leaves its own rows for the next run
+        try:
+            with get_connection(fail_silently=False) as connection:
+                for mail, rows in mails:
+                    try:
+                        connection.send_messages([mail])
+                    except Exception:
+                        logger.exception(f"could not send the notification \"{mail.subject}\" to {mail.to}")
+                        continue
+                    rows.update(notified=timezone.now())
+                    sent += 1
+        finally:
+            metrics.record(counters=[('mails_total', {'kind': 'notification', 'result': result}, count)
+                                     for result, count in [('sent', sent), ('failed', len(mails) - sent)] if count > 0])
+    elapsed = time.perf_counter() - started
+    logger.info(f"notify_about_rentals_and_reservations scanned {scanned} rows and sent {sent} of {len(mails)} mails in {elapsed:.3f}s")
+    return f"scanned {scanned} rows, sent {sent} of {len(mails)} mails in {elapsed:.3f}s"
@@ -1,3 +1,486 @@
-from django.test import TestCase
+"""
+Tests of the base app.
 
-# Create your tests here.
+The rewritten engines are compared with the code they replaced, kept below as baseline_* functions (e.g. the per day loop
+of RentalObjectType.available), on the data of seed_benchmark_data.
+"""
+import importlib
+import io
+from collections import Counter
+import random
+import threading
+from datetime import date, datetime, timedelta
+from smtplib import SMTPException
+from unittest import mock, skipIf, skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from base import availability
+from base import cart
+from base import config
+from base import models
+from base import numbers
+from base import occupancy
+from base import outbox
+from base import slots
+from base.management.commands.seed_benchmark_data import PREFIX, TEXTS, weekdays_between
+
+
+def baseline_extended_until(rental) -> date:
+    currentend = rental.reservation.reserved_until
+    if rental.extension_set.count() > 0:
+        currentend = rental.extension_set.order_by('-extended_until').first().extended_until
+    return currentend
+
+
+def baseline_available(pk: int, from_date: date, until_date: date) -> dict:
+    from_date = datetime.combine(from_date, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+    until_date = datetime.combine(until_date, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+    offset = settings.DEFAULT_OFFSET_BETWEEN_RENTALS
+    object_status = models.RentalObjectStatus.objects.filter(from_date__lte=until_date, until_date__gte=from_date, rentable=False,
+                                                             rental_object__in=models.RentalObject.objects.filter(type=pk))
+    objects = models.RentalObject.objects.filter(type=pk).exclude(rentable=False).exclude(rentalobjectstatus__in=object_status)
+    reservations = models.Reservation.objects.filter(
+        objecttype_id=pk, reserved_from__lte=until_date.date(), reserved_until__gte=from_date.date()).exclude(
+        rental__in=models.Rental.objects.filter(rented_object__type=pk)).exclude(canceled__isnull=False)
+    rentals = [rental for rental in models.Rental.objects.filter(rented_object__in=objects, handed_out_at__lte=until_date)
+               if baseline_extended_until(rental) <= from_date.date()]
+    blocked = [(rental.handed_out_at.date(), baseline_extended_until(rental)) for rental in rentals]
+    for reservation in reservations:
+        blocked += [(reservation.reserved_from, reservation.reserved_until)] * reservation.count
+    ret = {}
+    max_value = 0
+    for day_diff in range((until_date - from_date).days + 1):
+        current_date = (from_date + timedelta(days=day_diff)).date()
+        value = len([start for start, end in blocked if start <= current_date < end + offset])
+        max_value = max(value, max_value)
+        ret[str(current_date)] = len(objects) - value
+    ret['available'] = len(objects) - max_value
+    return ret
+
+
+def baseline_max_rent_duration(pk: int, prio):
+    if models.MaxRentDuration.objects.filter(prio=prio, rental_object_type=pk).exists():
+        return models.MaxRentDuration.objects.get(prio=prio, rental_object_type=pk).duration
+    lower = models.MaxRentDuration.objects.filter(rental_object_type=pk, prio__prio__gt=prio.prio).order_by('prio__prio').first()
+    return lower.duration if lower is not None else None
+
+
+def baseline_item_error(item: dict, profile):
+    """
+    the message the old BulkReservationSerializer answered with for a single item, None if it was valid
+    """
+    if not models.RentalObjectType.objects.filter(pk=item['objecttype']).exists():
+        return f"Invalid pk \"{item['objecttype']}\" - object does not exist."
+    reserved_from, reserved_until = date.fromisoformat(item['reserved_from']), date.fromisoformat(item['reserved_until'])
+    duration = baseline_max_rent_duration(item['objecttype'], profile.prio)
+    if duration is not None and duration + timedelta(days=7) < reserved_until - reserved_from:
+        return "the rent duration exceeds max_rent_duration."
+    if reserved_from.isoweekday() != int(models.Settings.objects.get(type='lenting_day').value):
+        return "this day is not a lenting day therefore a reservation can not start here"
+    if reserved_until.isoweekday() != int(models.Settings.objects.get(type='returning_day').value):
+        return "this day is not a returning day therefore a reservation can not end here"
+    if reserved_from >= reserved_until:
+        return "reserved_from must be before reserved_until"
+    if item['count'] > baseline_available(item['objecttype'], reserved_from, reserved_until)['available']:
+        return "There are not enough objects of this type to fullfill your reservation"
+    return None
+
+
+def baseline_slots(pk: int, now: datetime) -> list:
+    weekdays = models.Settings.objects.get(type='onpremise_weekdays').value.replace(' ', '').split(',')
+    start_time = models.Settings.objects.get(type='onpremise_starttime').value.replace(' ', '').split(':')
+    end_time = models.Settings.objects.get(type='onpremise_endtime').value.replace(' ', '').split(':')
+    onpremise_break = timedelta(minutes=int(models.Settings.objects.get(type='onpremise_breakinbetween_in_min').value))
+    duration = timedelta(minutes=int(models.Settings.objects.get(type='onepremise_slotduration').value))
+    excluded_workplaces = models.OnPremiseWorkplace.objects.get(pk=pk).exclusions.all()
+    ret = []
+    for diff in range(int(models.Settings.objects.get(type='onpremise_date_range_in_days').value)):
+        slot_day = now + timedelta(days=diff)
+        if str(slot_day.isoweekday()) not in weekdays:
+            continue
+        start = slot_day.replace(hour=int(start_time[0]), minute=int(start_time[1]) if len(start_time) > 1 else 0, second=0, microsecond=0)
+        day_end = slot_day.replace(hour=int(end_time[0]), minute=int(end_time[1]) if len(end_time) > 1 else 0, second=0, microsecond=0)
+        while start + duration <= day_end:
+            slot_start, slot_end = start, start + duration
+            disabled = (models.OnPremiseBooking.objects.filter(slot_start__lte=slot_end, slot_end__gte=slot_start, workplace_id=pk, canceled__isnull=True).exists()
+                        or models.OnPremiseWorkplaceStatus.objects.filter(from_date__lte=slot_end, until_date__gte=slot_start, workplace_id=pk).exists()
+                        or models.OnPremiseBlockedTimes.objects.filter(starttime__lte=slot_end, endtime__gte=slot_start).exists()
+                        or models.OnPremiseBooking.objects.filter(workplace__in=excluded_workplaces, slot_start__lte=slot_end, slot_end__gte=slot_start).exists())
+            ret.append({'start': slot_start, 'end': slot_end, 'weekday': slot_day.weekday(), 'date': start.date(), 'disabled': disabled})
+            start = slot_end + onpremise_break
+    return ret
+
+
+class SeededTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_benchmark_data', scale='small', seed=7, stdout=io.StringIO())
+        cls.types = list(models.RentalObjectType.objects.filter(name__startswith=PREFIX).order_by('pk').values_list('pk', flat=True))
+        cls.today = timezone.localdate()
+
+    def random_ranges(self, count: int, seed: int = 1):
+        generator = random.Random(seed)
+        for _ in range(count):
+            from_day = self.today + timedelta(days=generator.randint(-70, 70))
+            yield from_day, from_day + timedelta(days=generator.randint(0, 42))
+
+
+class AvailabilityTest(SeededTestCase):
+
+    def test_live_matches_baseline(self):
+        for from_day, until_day in self.random_ranges(20):
+            live = availability.available_for_types(self.types, from_day, until_day, live=True)
+            for pk in self.types:
+                self.assertEqual(live[pk], baseline_available(pk, from_day, until_day), f"type {pk} {from_day} - {until_day}")
+
+
+@override_settings(DAILY_OCCUPANCY_ENABLED=True)
+class OccupancyTest(SeededTestCase):
+
+    def setUp(self):
+        self.first_day, self.last_day = self.today - timedelta(days=30), self.today + timedelta(days=60)
+        occupancy.refresh(self.types, self.first_day, self.last_day)
+
+    def test_rows_match_live(self):
+        self.assertEqual(occupancy.check(self.types, self.first_day, self.last_day), [])
+        self.assertEqual(occupancy.parity(self.types, self.first_day, self.last_day, ranges=100, seed=3), [])
+
+    def test_rows_follow_changes(self):
+        reservation = models.Reservation.objects.filter(objecttype__in=self.types, canceled__isnull=True, rental__isnull=True,
+                                                        reserved_from__gt=self.today).order_by('pk').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Reservation.objects.create(reserver=reservation.reserver, objecttype=reservation.objecttype, operation_number=1,
+                                              count=2, reserved_from=self.today + timedelta(days=3), reserved_until=self.today + timedelta(days=10))
+            reservation.canceled = timezone.now()
+            reservation.save()
+        self.assertEqual(occupancy.check(self.types, self.first_day, self.last_day), [])
+
+    def test_defect_blocks_the_whole_range(self):
+        category = models.Category.objects.create(name="defect")
+        object_type = models.RentalObjectType.objects.create(name="defect", category=category, prefix_identifier="DEF")
+        rental_objects = [models.RentalObject.objects.create(type=object_type, internal_identifier=index) for index in range(3)]
+        profile = models.Profile.objects.create(user=User.objects.create(username="defect"))
+        first_day = self.today + timedelta(days=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            # without dates the status uses its datetime defaults
+            status = models.RentalObjectStatus.objects.create(rental_object=rental_objects[0], rentable=False)
+            status.from_date = status.until_date = first_day
+            status.save()
+            models.Reservation.objects.create(reserver=profile, objecttype=object_type, operation_number=1, count=2,
+                                              reserved_from=first_day + timedelta(days=2), reserved_until=first_day + timedelta(days=3))
+        # the rows only answer single days, a range is calculated live
+        self.assertEqual(availability.available(object_type.pk, first_day, first_day + timedelta(days=4))['available'], 0)
+        self.assertEqual(availability.available(object_type.pk, first_day, first_day + timedelta(days=4)),
+                         availability.available(object_type.pk, first_day, first_day + timedelta(days=4), live=True))
+        self.assertEqual(occupancy.parity([object_type.pk], first_day, first_day + timedelta(days=4), ranges=20, seed=1), [])
+
+
+class CurrentUntilTest(SeededTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = models.Category.objects.create(name="current until")
+        object_type = models.RentalObjectType.objects.create(name="current until", category=category)
+        user = User.objects.create(username="current_until")
+        cls.reservation = models.Reservation.objects.create(
+            reserver=models.Profile.objects.create(user=user), objecttype=object_type, operation_number=1, count=1,
+            reserved_from=cls.today, reserved_until=cls.today + timedelta(weeks=1))
+        cls.rental = models.Rental.objects.create(rented_object=models.RentalObject.objects.create(type=object_type, internal_identifier=1),
+                                                  reservation=cls.reservation, rental_number=1, handed_out_at=timezone.now())
+        cls.user = user
+
+    def extend(self, weeks: int):
+        return models.Extension.objects.create(extended_rental=self.rental, extended_by=self.user, extended_from=self.rental.current_until,
+                                               extended_until=self.reservation.reserved_until + timedelta(weeks=weeks))
+
+    def test_seeded_rentals_match_extensions(self):
+        for rental in models.Rental.objects.filter(rented_object__type__in=self.types).select_related('reservation'):
+            self.assertEqual(rental.current_until, baseline_extended_until(rental), rental)
+
+    def test_extensions(self):
+        self.assertEqual(self.rental.current_until, self.reservation.reserved_until)
+        first = self.extend(1)
+        last = self.extend(2)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.current_until, last.extended_until)
+        last.delete()
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.current_until, first.extended_until)
+        first.delete()
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.current_until, self.reservation.reserved_until)
+
+    def test_reservation_change(self):
+        self.reservation.reserved_until += timedelta(days=7)
+        self.reservation.save()
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.current_until, self.reservation.reserved_until)
+        # an extended rental keeps the end of its extension
+        extension = self.extend(2)
+        self.reservation.reserved_until -= timedelta(days=7)
+        self.reservation.save(update_fields=['reserved_until'])
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.current_until, extension.extended_until)
+
+
+class SlotsTest(SeededTestCase):
+
+    def test_slots_match_baseline(self):
+        workplaces = list(models.OnPremiseWorkplace.objects.filter(name__startswith=PREFIX).order_by('pk'))
+        now = timezone.now().astimezone(tz=timezone.get_default_timezone())
+        # a status of one workplace and a general blocked time, both ending exactly when a slot starts
+        grid = slots.grid(now)
+        models.OnPremiseWorkplaceStatus.objects.create(workplace=workplaces[0], from_date=grid[0][0] - timedelta(hours=1), until_date=grid[1][0], reason="test")
+        models.OnPremiseBlockedTimes.objects.create(starttime=grid[-2][1] - timedelta(minutes=10), endtime=grid[-1][0])
+        result = slots.slots_for_workplaces([workplace.pk for workplace in workplaces], now)
+        for workplace in workplaces:
+            self.assertEqual(result[workplace.pk], baseline_slots(workplace.pk, now), workplace.name)
+
+
+class FailingBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise SMTPException("rejected")
+
+
+class UnreachableBackend(BaseEmailBackend):
+
+    def open(self):
+        raise ConnectionRefusedError("no mail server")
+
+
+class OutboxTest(TestCase):
+
+    def queue(self, count: int = 1):
+        for index in range(count):
+            outbox.queue_mail(subject=f"mail {index}", message="text", html_message="<p>text</p>", recipient_list=[f"{index}@example.com"])
+
+    def test_sent_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.queue()
+        self.assertEqual(callbacks, [outbox.trigger])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(outbox.send_batch(), {'sent': 1, 'retried': 0, 'failed': 0})
+        self.assertEqual(mail.outbox[0].alternatives, [("<p>text</p>", 'text/html')])
+        sent = models.OutgoingMail.objects.get()
+        self.assertEqual((sent.status, sent.attempts), (models.OutgoingMail.SENT, 1))
+        self.assertEqual(outbox.send_batch(), {'sent': 0, 'retried': 0, 'failed': 0})
+
+    def test_batch_size(self):
+        self.queue(5)
+        self.assertEqual(outbox.send_batch(batch_size=3)['sent'], 3)
+        self.assertEqual(outbox.send_batch(batch_size=3)['sent'], 2)
+
+    @override_settings(EMAIL_BACKEND='base.tests.FailingBackend', MAIL_OUTBOX_MAX_ATTEMPTS=3)
+    def test_retry_with_backoff_then_fail(self):
+        self.queue()
+        for attempt in range(1, 3):
+            before = timezone.now()
+            with self.assertLogs('django', 'ERROR'):
+                self.assertEqual(outbox.send_batch(), {'sent': 0, 'retried': 1, 'failed': 0})
+            failed = models.OutgoingMail.objects.get()
+            self.assertEqual((failed.status, failed.attempts), (models.OutgoingMail.PENDING, attempt))
+            self.assertGreaterEqual(failed.next_attempt, before + settings.MAIL_OUTBOX_RETRY_DELAY * 2 ** (attempt - 1))
+            self.assertIn("rejected", failed.last_error)
+            # not ready before its next attempt
+            self.assertEqual(outbox.send_batch(), {'sent': 0, 'retried': 0, 'failed': 0})
+            models.OutgoingMail.objects.update(next_attempt=timezone.now())
+        with self.assertLogs('django', 'ERROR') as logs:
+            self.assertEqual(outbox.send_batch(), {'sent': 0, 'retried': 0, 'failed': 1})
+        self.assertIn("giving up on mail", logs.output[-1])
+        self.assertEqual(models.OutgoingMail.objects.get().status, models.OutgoingMail.FAILED)
+        # dead letters are not picked up again
+        models.OutgoingMail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(outbox.send_batch(), {'sent': 0, 'retried': 0, 'failed': 0})
+
+    @override_settings(EMAIL_BACKEND='base.tests.UnreachableBackend')
+    def test_unreachable_server(self):
+        self.queue(2)
+        with self.assertLogs('django', 'ERROR'):
+            self.assertEqual(outbox.send_batch(), {'sent': 0, 'retried': 2, 'failed': 0})
+        self.assertEqual(list(models.OutgoingMail.objects.values_list('attempts', flat=True)), [1, 1])
+
+
+@skipUnless(connection.vendor == 'postgresql', "select_for_update does nothing on sqlite")
+class OutboxLockTest(TransactionTestCase):
+
+    def test_locked_mails_are_skipped(self):
+        # created without queue_mail, its on commit trigger would ask celery to send them
+        models.OutgoingMail.objects.bulk_create([models.OutgoingMail(
+            subject=f"mail {index}", message="text", from_email=settings.DEFAULT_FROM_EMAIL, recipients=[f"{index}@example.com"]) for index in range(5)])
+        locked, release = threading.Event(), threading.Event()
+
+        def lock_first_two():
+            # another worker sending the first two mails
+            try:
+                with transaction.atomic():
+                    list(models.OutgoingMail.objects.select_for_update().order_by('pk')[:2])
+                    locked.set()
+                    release.wait(timeout=30)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=lock_first_two)
+        worker.start()
+        try:
+            self.assertTrue(locked.wait(timeout=30))
+            self.assertEqual(outbox.send_batch()['sent'], 3)
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(list(models.OutgoingMail.objects.order_by('pk').values_list('status', flat=True)),
+                         [models.OutgoingMail.PENDING] * 2 + [models.OutgoingMail.SENT] * 3)
+
+
+@skipUnless(connection.vendor == 'postgresql', "select_for_update does nothing on sqlite")
+class OverbookingTest(TransactionTestCase):
+    """
+    parallel bulk reservations of one type with few objects, every request in its own thread and connection
+    """
+    objects = 3
+
+    def setUp(self):
+        for name, content in TEXTS.items():
+            models.Text.objects.get_or_create(name=name, defaults={'content': content})
+        category = models.Category.objects.create(name="overbooking")
+        self.object_type = models.RentalObjectType.objects.create(name="overbooking", category=category, visible=True)
+        models.RentalObject.objects.bulk_create([models.RentalObject(type=self.object_type, internal_identifier=index)
+                                                 for index in range(self.objects)])
+        priority = models.Priority.objects.order_by('prio').first()
+        self.users = User.objects.bulk_create([User(username=f"overbooking_{index}", email=f"overbooking_{index}@example.com")
+                                               for index in range(20)])
+        models.Profile.objects.bulk_create([models.Profile(user=user, prio=priority, verified=True) for user in self.users])
+        today = timezone.localdate()
+        self.reserved_from = next(weekdays_between(today + timedelta(days=1), today + timedelta(weeks=1), config.integer('lenting_day')))
+        self.reserved_until = self.reserved_from + timedelta(weeks=1)
+        self.reserved_until -= timedelta(days=(self.reserved_until.isoweekday() - config.integer('returning_day')) % 7)
+
+    def fire(self, count: int) -> Counter:
+        """
+        post a cart of count objects for every user at the same time, returns the number of responses per status code
+        """
+        cart = [{'objecttype': self.object_type.pk, 'count': count, 'reserved_from': str(self.reserved_from), 'reserved_until': str(self.reserved_until)}]
+        barrier = threading.Barrier(len(self.users))
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def book(user):
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                status = client.post('/api/reservations/bulk/', {'data': cart}, format='json').status_code
+            finally:
+                connection.close()
+            with lock:
+                statuses[status] += 1
+
+        threads = [threading.Thread(target=book, args=(user,)) for user in self.users]
+        # the confirmation mails are not sent, the outbox is tested on its own
+        with mock.patch('base.outbox.trigger'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return statuses
+
+    def test_no_overbooking(self):
+        for count in [1, 2]:
+            with self.subTest(count=count):
+                models.Reservation.objects.filter(objecttype=self.object_type).delete()
+                with self.assertLogs('django.request', 'WARNING'):
+                    statuses = self.fire(count)
+                booked = self.objects // count
+                self.assertEqual(statuses, Counter({200: booked, 400: len(self.users) - booked}))
+                self.assertEqual(models.Reservation.objects.filter(objecttype=self.object_type).aggregate(Sum('count'))['count__sum'], booked * count)
+
+
+class NumbersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = models.Category.objects.create(name="numbers")
+        object_type = models.RentalObjectType.objects.create(name="numbers", category=category)
+        reservation = models.Reservation.objects.create(
+            reserver=models.Profile.objects.create(user=User.objects.create(username="numbers")), objecttype=object_type,
+            operation_number=41, count=1, reserved_from=date(2026, 1, 1), reserved_until=date(2026, 1, 8))
+        models.Rental.objects.create(rented_object=models.RentalObject.objects.create(type=object_type, internal_identifier=1),
+                                     reservation=reservation, rental_number=7)
+
+    @skipIf(connection.vendor == 'postgresql', "postgres allocates from sequences")
+    def test_fallback_continues_after_the_highest(self):
+        self.assertEqual(numbers.next_number('operation_number'), 42)
+        self.assertEqual(numbers.next_numbers('rental_number', 3), [8, 9, 10])
+        self.assertEqual(numbers.next_numbers('rental_number', 0), [])
+
+    @skipUnless(connection.vendor == 'postgresql', "only postgres has the sequences")
+    def test_sequences(self):
+        # the migration starts the sequences after the highest numbers
+        migration = importlib.import_module('base.migrations.0008_number_sequences')
+        with connection.schema_editor() as schema_editor:
+            migration.create_sequences(apps, schema_editor)
+        self.assertEqual(numbers.next_number('operation_number'), 42)
+        self.assertEqual(numbers.next_numbers('rental_number', 3), [8, 9, 10])
+        # numbers are never handed out twice, even if nothing was saved with them
+        self.assertEqual(numbers.next_number('rental_number'), 11)
+
+
+class CartTest(SeededTestCase):
+
+    def setUp(self):
+        self.profile = models.Profile.objects.filter(user__username__startswith=PREFIX).order_by('pk').first()
+        lenting_day, returning_day = config.integer('lenting_day'), config.integer('returning_day')
+        self.lenting = next(weekdays_between(self.today + timedelta(days=1), self.today + timedelta(weeks=1), lenting_day))
+        self.returning = self.lenting + timedelta(days=(returning_day - lenting_day) % 7 or 7)
+
+    def test_errors_match_baseline(self):
+        profile, lenting, returning = self.profile, self.lenting, self.returning
+        # a duration of the priority itself and one that is only set for a lower priority
+        lower = models.Priority.objects.filter(prio__gt=profile.prio.prio).order_by('prio').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            models.MaxRentDuration.objects.create(prio=profile.prio, rental_object_type_id=self.types[0], duration=timedelta(weeks=2))
+            models.MaxRentDuration.objects.create(prio=lower or profile.prio, rental_object_type_id=self.types[1], duration=timedelta(weeks=4))
+        items = []
+        for pk in self.types[:8]:
+            items += [
+                {'objecttype': pk, 'count': 1, 'reserved_from': str(lenting), 'reserved_until': str(returning)},
+                {'objecttype': pk, 'count': 50, 'reserved_from': str(lenting), 'reserved_until': str(returning)},
+                {'objecttype': pk, 'count': 1, 'reserved_from': str(lenting + timedelta(days=1)), 'reserved_until': str(returning)},
+                {'objecttype': pk, 'count': 1, 'reserved_from': str(lenting), 'reserved_until': str(returning + timedelta(days=1))},
+                {'objecttype': pk, 'count': 1, 'reserved_from': str(lenting), 'reserved_until': str(lenting)},
+                {'objecttype': pk, 'count': 1, 'reserved_from': str(lenting), 'reserved_until': str(returning + timedelta(weeks=12))},
+            ]
+        items.append({'objecttype': 999999, 'count': 1, 'reserved_from': str(lenting), 'reserved_until': str(returning)})
+        # every item on its own, like the old serializer checked them
+        for item in items:
+            reservation_cart = cart.Cart([item], profile)
+            self.assertEqual(reservation_cart.validate(), [baseline_item_error(item, profile)], item)
+            # validating again returns the same errors
+            self.assertEqual(reservation_cart.validate(), [baseline_item_error(item, profile)], item)
+
+    def test_items_of_one_range_count_together(self):
+        pk = next(pk for pk in self.types if availability.available(pk, self.lenting, self.returning, live=True)['available'] >= 2)
+        free = availability.available(pk, self.lenting, self.returning, live=True)['available']
+        item = {'objecttype': pk, 'count': free - 1, 'reserved_from': str(self.lenting), 'reserved_until': str(self.returning)}
+        self.assertTrue(cart.Cart([item], self.profile).is_valid())
+        self.assertEqual(cart.Cart([item, dict(item, count=2)], self.profile).validate(),
+                         ["There are not enough objects of this type to fullfill your reservation"] * 2)
+
+    def test_unparsable_items(self):
+        reservation_cart = cart.Cart([{'objecttype': 'abc', 'count': 1, 'reserved_from': '2026-01-01', 'reserved_until': '2026-01-08'}, {}], self.profile)
+        self.assertEqual(reservation_cart.type_pks(), set())
+        self.assertFalse(reservation_cart.is_valid())
+        self.assertEqual(reservation_cart.errors, ["objecttype, count, reserved_from and reserved_until are required"] * 2)
@@ -0,0 +1,42 @@
+"""
+Compiled mail templates of the Text rows, e.g. texts.render('signup_mail', data).
+
+Every template is read and compiled once per process and kept in a registry keyed by the Text name. The registry is a
+base.localcache.VersionedLocalCache like the rows of base.config, saving or deleting a Text empties it in every worker.
+"""
+from typing import Dict, Tuple
+
+from django.template import Context, Template
+
+from base.localcache import VersionedLocalCache
+
+# (Text name, unwrapped): compiled template, filled with the first use of every template
+local_cache: VersionedLocalCache[Dict[Tuple[str, bool], Template]] = VersionedLocalCache("texts:version", dict)
+
+
+def unwrap(content: str) -> str:
+    """
+    the rich text editor of the frontend wraps template tags in paragraphs, e.g. <p>{{% ... %}}</p>
+    """
+    return content.replace(r"%}}</p>", r"%}}").replace(r"<p>{{%", r"{{%")
+
+
+def template(name: str, unwrapped: bool = True) -> Template:
+    """
+    the compiled template of the Text with this name, raises Text.DoesNotExist if there is none.
+    unwrapped=False compiles the content as it is stored
+    """
+    templates = local_cache.get()
+    key = (name, unwrapped)
+    if key not in templates:
+        from base import models
+        contents = list(models.Text.objects.filter(name=name).values_list('content', flat=True))
+        if len(contents) == 0:
+            raise models.Text.DoesNotExist(f"Text matching name {name} does not exist.")
+        content = contents[0] or ""
+        templates[key] = Template(unwrap(content) if unwrapped else content)
+    return templates[key]
+
+
+def render(name: str, data: dict, unwrapped: bool = True) -> str:
+    return template(name, unwrapped).render(Context(data))